@@ -0,0 +1,74 @@
+"""
+Reports how many logins per second one core can check for each password hash
+method, and how many a PasswordHasher pool gets through, to help choose
+PASSWORD_HASH_METHOD and PASSWORD_HASH_WORKERS.
+
+Run with e.g.
+    python benchmarks/password_hashing.py --method pbkdf2:sha256:600000 scrypt
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from flaskr.passwords import PasswordHasher, default_hash_method, full_hash_method
+
+parser = argparse.ArgumentParser(prog="Password hashing benchmark")
+parser.add_argument(
+    "--method",
+    nargs="+",
+    default=[
+        "pbkdf2:sha256:150000",
+        "pbkdf2:sha256:300000",
+        default_hash_method,
+        "scrypt:16384:8:1",
+        "scrypt",
+    ],
+)
+parser.add_argument("--seconds", type=float, default=2.0)
+parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+
+
+def logins_per_second(method: str, seconds: float) -> float:
+    password_hash = generate_password_hash("correct horse", method)
+    checks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        check_password_hash(password_hash, "correct horse")
+        checks += 1
+    return checks / (time.perf_counter() - start)
+
+
+def pool_logins_per_second(
+    method: str, seconds: float, workers: int
+) -> tuple[float, dict]:
+    hasher = PasswordHasher(workers, workers * 2, method)
+    password_hash = generate_password_hash("correct horse", method)
+    checks = 0
+    # a thread per slot keeps every process in the pool busy
+    with ThreadPoolExecutor(max_workers=workers * 2) as threads:
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            futures = [
+                threads.submit(hasher.check, password_hash, "correct horse")
+                for _ in range(workers * 2)
+            ]
+            checks += sum(1 for future in futures if future.result())
+        elapsed = time.perf_counter() - start
+    stats = hasher.stats()
+    hasher.shutdown()
+    return checks / elapsed, stats
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    for method in map(full_hash_method, args.method):
+        print(method)
+        per_core = logins_per_second(method, args.seconds)
+        print(f"  {'logins per second per core':<36}{per_core:10.1f}")
+        pooled, stats = pool_logins_per_second(method, args.seconds, args.workers)
+        print(f"  {f'logins per second, {args.workers} workers':<36}{pooled:10.1f}")
+        queue_time = stats["meanQueueTime"] * 1000
+        print(f"  {'mean queue time':<36}{queue_time:10.1f} ms")
@@ -0,0 +1,112 @@
+"""
+Compares the puzzle JSON validator against the previous checks, which built a
+set for every clue and clue box, on a puzzle file and on synthetic grids.
+
+Run with e.g.
+    python benchmarks/puzzle_json_validation.py --grid-size 25
+"""
+import argparse
+import json
+import timeit
+from pathlib import Path
+
+from flaskr.file_validation import (
+    PuzzleJsonError,
+    check_grid_size,
+    check_private_clues,
+    check_public_clues,
+    check_puzzle_json,
+    load_puzzle_json,
+)
+
+test_data_dir = Path(__file__).parent.parent.joinpath("test", "test_data")
+
+parser = argparse.ArgumentParser(prog="Puzzle JSON validation benchmark")
+parser.add_argument("--puzzle", type=Path, default=test_data_dir.joinpath("test.json"))
+parser.add_argument("--grid-size", type=int, default=25)
+parser.add_argument("--repeat", type=int, default=1000)
+
+
+def previous_check_puzzle_json(input_json: dict) -> bool:
+    check_grid_size(input_json)
+    check_public_clues(input_json)
+    check_private_clues(input_json)
+    return True
+
+
+def synthetic_puzzle(grid_size: int) -> dict:
+    # an across clue for every row and a down clue for every column
+    clues = {}
+    for i in range(grid_size):
+        for direction, boxes in (
+            ("a", [(x, i) for x in range(grid_size)]),
+            ("d", [(i, y) for y in range(grid_size)]),
+        ):
+            clue_name = f"{i + 1}{direction}"
+            clues[clue_name] = {
+                "clue": f"Clue {clue_name} ({grid_size})",
+                "clueBoxes": [
+                    {"first": first, "second": second, "third": ""}
+                    for first, second in boxes
+                ],
+                "clueName": clue_name,
+            }
+    return {"gridSize": grid_size, "clues": clues, "_clues": clues}
+
+
+def broken_puzzle(puzzle: dict) -> dict:
+    # the first clue box is malformed, so the whole file after it is wasted
+    # work for a validator that parses everything first
+    clues = json.loads(json.dumps(puzzle["_clues"]))
+    first_clue = next(iter(clues.values()))
+    first_clue["clueBoxes"][0] = {"first": 0}
+    return {"_clues": clues, "clues": puzzle["clues"], "gridSize": 1}
+
+
+def previous_load(data: bytes):
+    try:
+        previous_check_puzzle_json(json.loads(data))
+    except KeyError:
+        pass
+
+
+def current_load(reject_early: bool):
+    def load(data: bytes):
+        try:
+            load_puzzle_json(data, reject_early=reject_early)
+        except PuzzleJsonError:
+            pass
+
+    return load
+
+
+def report(name: str, func, arg, repeat: int) -> float:
+    seconds = min(timeit.repeat(lambda: func(arg), number=repeat, repeat=5)) / repeat
+    print(f"  {name:<36}{seconds * 1e6:10.1f} us")
+    return seconds
+
+
+def benchmark(name: str, puzzle: dict, repeat: int):
+    data = json.dumps(puzzle).encode("UTF-8")
+    broken = json.dumps(broken_puzzle(puzzle)).encode("UTF-8")
+    print(f"{name} ({len(data)} bytes)")
+    previous = report("previous check", previous_check_puzzle_json, puzzle, repeat)
+    current = report("check_puzzle_json", check_puzzle_json, puzzle, repeat)
+    print(f"  {'speed up':<36}{previous / current:10.2f}x")
+    report("previous decode and check", previous_load, data, repeat)
+    report("load_puzzle_json", current_load(False), data, repeat)
+    report("load_puzzle_json, reject early", current_load(True), data, repeat)
+    print("  malformed first clue box")
+    report("previous decode and check", previous_load, broken, repeat)
+    report("load_puzzle_json", current_load(False), broken, repeat)
+    report("load_puzzle_json, reject early", current_load(True), broken, repeat)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    benchmark(args.puzzle.name, json.loads(args.puzzle.read_bytes()), args.repeat)
+    benchmark(
+        f"synthetic {args.grid_size}x{args.grid_size}",
+        synthetic_puzzle(args.grid_size),
+        args.repeat,
+    )
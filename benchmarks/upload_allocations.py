@@ -0,0 +1,97 @@
+"""
+Compares the memory allocated while validating and preparing an upload with
+CloudStorage against the previous approach, which read each part three times.
+
+Run with e.g.
+    python benchmarks/upload_allocations.py --puzzle test/test_data/test.json
+"""
+import argparse
+import io
+import json
+import os
+import timeit
+import tracemalloc
+from pathlib import Path
+
+from werkzeug.datastructures import FileStorage
+
+from flaskr.cloud.storage import CloudStorage
+from flaskr.file_validation import check_puzzle_json
+
+test_data_dir = Path(__file__).parent.parent.joinpath("test", "test_data")
+
+parser = argparse.ArgumentParser(prog="Upload allocation benchmark")
+parser.add_argument("--image", type=Path, default=test_data_dir.joinpath("test.png"))
+parser.add_argument("--puzzle", type=Path, default=test_data_dir.joinpath("test.json"))
+parser.add_argument("--repeat", type=int, default=1000)
+
+
+def previous_prepare_image(file: FileStorage) -> io.BytesIO:
+    file_bytes = file.stream.read()
+    if len(file_bytes) > CloudStorage.max_thumbnail_size:
+        raise ValueError("Thumbnail exceeds maximum upload size")
+    file.stream.seek(0)
+    return io.BytesIO(file.read())
+
+
+def previous_prepare_puzzle_json(file: FileStorage) -> io.BytesIO:
+    file_bytes = file.stream.read()
+    file_string = file_bytes.decode("UTF-8")
+    check_puzzle_json(json.loads(file_string))
+    file.stream.seek(0)
+    return io.BytesIO(file.read())
+
+
+def current_prepare(read) -> callable:
+    def prepare(file: FileStorage) -> io.BytesIO:
+        return io.BytesIO(read(file).data)
+
+    return prepare
+
+
+def make_file(content: bytes, file_name: str) -> FileStorage:
+    # werkzeug writes small form parts into a BytesIO, so reading the stream
+    # copies its buffer
+    stream = io.BytesIO()
+    stream.write(content)
+    stream.seek(0)
+    return FileStorage(stream, filename=file_name)
+
+
+def measure(prepare, path: Path, repeat: int) -> tuple[int, float]:
+    content = path.read_bytes()
+
+    file = make_file(content, path.name)
+    tracemalloc.start()
+    prepare(file)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    files = [make_file(content, path.name) for _ in range(repeat)]
+    seconds = timeit.timeit(lambda: prepare(files.pop()), number=repeat) / repeat
+    return peak, seconds
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    # creating the S3 client needs a region, but nothing is sent to AWS
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-north-1")
+    storage = CloudStorage(blob_cache_bytes=0)
+
+    cases = [
+        ("image", args.image, previous_prepare_image, storage.read_image),
+        (
+            "puzzle",
+            args.puzzle,
+            previous_prepare_puzzle_json,
+            storage.read_puzzle_json,
+        ),
+    ]
+    print(f"{'part':<8}{'version':<10}{'peak bytes':>12}{'time (us)':>12}")
+    for part, path, previous, read in cases:
+        for version, prepare in (
+            ("previous", previous),
+            ("current", current_prepare(read)),
+        ):
+            peak, seconds = measure(prepare, path, args.repeat)
+            print(f"{part:<8}{version:<10}{peak:>12}{seconds * 1e6:>12.1f}")
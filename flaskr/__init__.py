@@ -2,10 +2,46 @@ from os import PathLike
 
 from flask import Flask
 
-from flaskr.cloud.database import PuzzleDatabase, UserDatabase
+from flaskr.cloud.database import CachedPuzzleDatabase, PuzzleDatabase, UserDatabase
 from flaskr.cloud.email import EmailManager
 from flaskr.cloud.secrets import Secrets
 from flaskr.cloud.storage import CloudStorage
+from flaskr.email_domains import DnsResolver, EmailDomainChecker, StaticResolver
+from flaskr.passwords import PasswordHasher, default_hash_method
+from flaskr.upload_queue import UploadQueue
+
+# Settings that can be overridden by the test config, or in production by
+# environment variables prefixed with FLASK_, e.g. FLASK_STREAM_BUNDLES=true
+default_config = {
+    # largest request body in bytes, larger ones get a 413, e.g. an import
+    "MAX_CONTENT_LENGTH": 64 * 1024 * 1024,
+    # stream puzzle zips as they are read from S3 instead of buffering them
+    "STREAM_BUNDLES": False,
+    # number of puzzles to keep metadata for in memory, 0 turns the cache off
+    "PUZZLE_CACHE_SIZE": 0,
+    # seconds that cached puzzle metadata is used for
+    "PUZZLE_CACHE_TTL": 60,
+    # directory that queued uploads are spooled to, None turns them off
+    "UPLOAD_SPOOL_DIR": None,
+    # number of queued uploads that are stored at once
+    "UPLOAD_WORKERS": 4,
+    # times a queued upload is tried, and seconds before its first retry
+    "UPLOAD_MAX_ATTEMPTS": 3,
+    "UPLOAD_RETRY_DELAY": 1.0,
+    # processes that hash passwords, 0 hashes them on the request thread
+    "PASSWORD_HASH_WORKERS": 2,
+    # hashes that may wait for a process before logins are turned away
+    "PASSWORD_HASH_MAX_PENDING": 16,
+    # werkzeug hash method for new passwords, e.g. scrypt:32768:8:1. Older
+    # hashes are replaced the next time their user logs in.
+    "PASSWORD_HASH_METHOD": default_hash_method,
+    # seconds a DNS lookup of an email domain may take before the address is
+    # let through unchecked
+    "EMAIL_DNS_TIMEOUT": 2.0,
+    # seconds that domains which can, or cannot, receive mail are remembered
+    "EMAIL_DOMAIN_TTL": 3600,
+    "EMAIL_DOMAIN_NEGATIVE_TTL": 300,
+}
 
 
 class PuzzleFlask(Flask):
@@ -47,6 +83,8 @@ class PuzzleFlask(Flask):
         self.cloud_storage = cloud_storage
         self.puzzle_database = puzzle_database
         self.user_database = user_database
+        self.upload_queue: UploadQueue | None = None
+        self.password_hasher: PasswordHasher | None = None
 
 
 def create_app(
@@ -65,6 +103,7 @@ def create_app(
         import_name=__name__,
         instance_relative_config=True,
     )
+    app.config.from_mapping(default_config)
 
     if test_config is None:
         # load the instance config, if it exists, when not testing
@@ -75,6 +114,7 @@ def create_app(
             SECRET_KEY=secrets.get_secret("SECRET_KEY"),
             JWT_KEY=secrets.get_secret("JWT_KEY"),
         )
+        app.config.from_prefixed_env()
     else:
         # load the test config if passed in
         app.config.update(
@@ -82,6 +122,42 @@ def create_app(
             SECRET_KEY=test_config["SECRET_KEY"],
             JWT_KEY=test_config["JWT_KEY"],
         )
+        app.config.update(
+            {key: test_config[key] for key in default_config if key in test_config}
+        )
+
+    if app.config["PUZZLE_CACHE_SIZE"]:
+        app.puzzle_database = CachedPuzzleDatabase(
+            puzzle_database,
+            app.config["PUZZLE_CACHE_SIZE"],
+            app.config["PUZZLE_CACHE_TTL"],
+        )
+
+    app.password_hasher = PasswordHasher(
+        app.config["PASSWORD_HASH_WORKERS"],
+        app.config["PASSWORD_HASH_MAX_PENDING"],
+        app.config["PASSWORD_HASH_METHOD"],
+    )
+
+    # tests never reach DNS, every domain can receive mail unless they say not
+    app.email_domain_checker = EmailDomainChecker(
+        StaticResolver()
+        if app.config["TESTING"]
+        else DnsResolver(app.config["EMAIL_DNS_TIMEOUT"]),
+        app.config["EMAIL_DOMAIN_TTL"],
+        app.config["EMAIL_DOMAIN_NEGATIVE_TTL"],
+    )
+
+    if app.config["UPLOAD_SPOOL_DIR"]:
+        app.upload_queue = UploadQueue(
+            app.cloud_storage,
+            app.puzzle_database,
+            app.config["UPLOAD_SPOOL_DIR"],
+            app.config["UPLOAD_WORKERS"],
+            app.config["UPLOAD_MAX_ATTEMPTS"],
+            app.config["UPLOAD_RETRY_DELAY"],
+        )
+        app.upload_queue.recover()
 
     @app.route("/")
     def index():
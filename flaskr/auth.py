@@ -1,7 +1,9 @@
 import uuid
 from functools import wraps
 
+import click
 import jwt
+from botocore.exceptions import ClientError
 from flask import (
     Blueprint,
     request,
@@ -9,11 +11,30 @@ from flask import (
     jsonify,
 )
 from pyisemail import is_email
-from werkzeug.security import check_password_hash, generate_password_hash
+
+from flaskr.cloud.database import RegistrationConflict
+from flaskr.passwords import HasherBusy
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 
+def busy_response():
+    # the hashing pool is saturated, so clients should try again shortly
+    return "Too many requests, try again shortly", 503, {"Retry-After": "1"}
+
+
+def email_error(email) -> str | None:
+    try:
+        if not is_email(email, allow_gtld=False):
+            return "Email is not valid."
+    except TypeError:
+        return "Email was not a string"
+    if not current_app.email_domain_checker.accepts_mail(email):
+        return "Email is not valid."
+    current_app.logger.info("Email input was valid")
+    return None
+
+
 @bp.route("/register", methods=["POST"])
 def register():
     current_app.logger.info("Beginning registration")
@@ -23,23 +44,13 @@ def register():
 
     error = None
 
-    valid_email = False
-
-    try:
-        if current_app.config["TESTING"]:
-            valid_email = is_email(email, check_dns=False, allow_gtld=False)
-        else:
-            valid_email = is_email(email, check_dns=True, allow_gtld=False)
-        current_app.logger.info("Email input was valid")
-    except TypeError:
-        error = "Email was not a string"
-
+    # the cheap checks come first, so only complete registrations reach DNS
     if not username:
         error = "Username is required."
     elif not password:
         error = "Password is required."
-    elif not valid_email:
-        error = "Email is not valid."
+    else:
+        error = email_error(email)
 
     if error is not None:
         current_app.logger.info(error)
@@ -48,19 +59,25 @@ def register():
     current_app.logger.info("generating user id")
     user_id = str(uuid.uuid4())
     current_app.logger.info("hashing password")
-    hashed_password = generate_password_hash(password)
+    try:
+        hashed_password = current_app.password_hasher.hash(password)
+    except HasherBusy:
+        return busy_response()
     current_app.logger.info("generating reset code")
     reset_code = str(uuid.uuid4())
 
-    success = current_app.user_database.register_new_user(
-        user_id, username, hashed_password, email, reset_code
-    )
+    try:
+        success = current_app.user_database.register_new_user(
+            user_id, username, hashed_password, email, reset_code
+        )
+    except RegistrationConflict as e:
+        current_app.logger.info(e)
+        return str(e).capitalize(), 409
     if success:
         token = generate_token(username)
         return jsonify({"token": token}), 201
-    else:  # figure out how to tell if its username or email which is conflicted.
-        error = "Issue registering"
-        return error, 409
+    else:
+        return "Issue registering", 500
 
 
 # Generate a token for a given user
@@ -88,100 +105,133 @@ def login():
     username = request.json.get("username")
     password = request.json.get("password")
 
-    response = current_app.user_database.get_id_for_username(username)
-    status_code = response["ResponseMetadata"]["HTTPStatusCode"]
-    if status_code != 200:
-        return "Error retreiving user data", status_code
-
     try:
-        user_id = response["Item"]["id"]
-    except KeyError:
+        user = current_app.user_database.get_credentials_for_username(username)
+    except ClientError as e:
+        current_app.logger.exception(e)
+        return "Error retrieving user data", 500
+    if user is None:
         return jsonify({"error": "Invalid credentials"}), 401
 
-    response = current_app.user_database.get_user_data(user_id)
-
-    status_code = response["ResponseMetadata"]["HTTPStatusCode"]
-    if status_code != 200:
-        return "Error retrieving user data", status_code
-
-    user = response["Item"]
-
-    if user is not None and check_password_hash(user["password"], password):
+    try:
+        valid = user is not None and current_app.password_hasher.check(
+            user["password"], password
+        )
+    except HasherBusy:
+        return busy_response()
+    if valid:
+        rehash_password(user, password)
         token = generate_token(username)
         return jsonify({"token": token}), 200
     else:
         return jsonify({"error": "Invalid credentials"}), 401
 
 
-# TODO: make this simpler
-# flake8: noqa: C901
+def rehash_password(user: dict, password: str):
+    # moves a hash made with an older method to the current one, now that the
+    # password is known. Failing to is not a reason to fail the login.
+    if not current_app.password_hasher.needs_rehash(user["password"]):
+        return
+    try:
+        current_app.user_database.update_password(
+            user["id"],
+            current_app.password_hasher.hash(password),
+            user["resetGuid"],
+            user["username"],
+            user["email"],
+        )
+    except (HasherBusy, ClientError) as e:
+        current_app.logger.warning(f"could not rehash password of {user['id']}: {e}")
+    else:
+        current_app.logger.info(f"rehashed password of {user['id']}")
+
+
 @bp.route("/resetPassword", methods=["GET", "POST"])
 def reset_password():
     if request.method == "GET":
-        email = request.args.get("email")
-        if email is None or email == "":
-            return "No email submitted", 400
-        response = current_app.user_database.get_id_for_email(email)
-        status_code = response["ResponseMetadata"]["HTTPStatusCode"]
-        if status_code != 200:
-            return "Error retrieving user data", status_code
-
-        if "Item" not in response:
-            return "Invalid username", 400
-
-        user_id = response["Item"]["id"]
-
-        response = current_app.user_database.get_user_data(user_id)
-        status_code = response["ResponseMetadata"]["HTTPStatusCode"]
-        if status_code != 200:
-            return "Error retrieving user data", status_code
-
-        user = response["Item"]
+        return _send_reset_code()
+    return _reset_password()
 
-        reset_guid = user["resetGuid"]
-        current_app.email_manager.send_reset_code(email, reset_guid)
 
-        return "OK", 200
-
-    elif request.method == "POST":
-        username = request.json.get("username")
-        password = request.json.get("password")
-        reset_guid = request.json.get("resetGuid")
-
-        if username == "" or username is None:
-            return "Username empty", 400
-        if password == "" or password is None:
-            return "password empty", 400
-        if reset_guid == "" or reset_guid is None:
-            return "reset_guid empty", 400
+def _send_reset_code():
+    email = request.args.get("email")
+    if email is None or email == "":
+        return "No email submitted", 400
+    try:
+        user = current_app.user_database.get_credentials_for_email(email)
+    except ClientError as e:
+        current_app.logger.exception(e)
+        return "Error retrieving user data", 500
+    if user is None:
+        return "Invalid username", 400
+
+    reset_guid = user["resetGuid"]
+    current_app.email_manager.send_reset_code(email, reset_guid)
+
+    return "OK", 200
+
+
+def _reset_password():
+    for field, message in (
+        ("username", "Username empty"),
+        ("password", "password empty"),
+        ("resetGuid", "reset_guid empty"),
+    ):
+        if request.json.get(field) in ("", None):
+            return message, 400
+    username = request.json["username"]
+    password = request.json["password"]
 
-        response = current_app.user_database.get_id_for_username(username)
+    try:
+        user = current_app.user_database.get_credentials_for_username(username)
+    except ClientError as e:
+        current_app.logger.exception(e)
+        return "Error retrieving user data", 500
+    if user is None:
+        return "Invalid username", 400
 
-        status_code = response["ResponseMetadata"]["HTTPStatusCode"]
-        if status_code != 200:
-            return "Error retreiving user data", status_code
+    if user["resetGuid"] != request.json["resetGuid"]:
+        return "Invalid reset code", 400
 
-        if "Item" not in response:
-            return "Invalid username", 400
+    error = _update_password(user, password)
+    if error is not None:
+        return error
 
-        user_id = response["Item"]["id"]
+    token = generate_token(username)
 
-        response = current_app.user_database.get_user_data(user_id)
-        status_code = response["ResponseMetadata"]["HTTPStatusCode"]
-        if status_code != 200:
-            return "Error retrieving user data", status_code
+    return token, 200
 
-        user = response["Item"]
-        if user["resetGuid"] != reset_guid:
-            return "Invalid reset code", 400
 
+def _update_password(user: dict, password: str):
+    """Set a new password and reset code, or return the error response"""
+    try:
+        hashed_password = current_app.password_hasher.hash(password)
+    except HasherBusy:
+        return busy_response()
+    try:
         current_app.user_database.update_password(
-            user["id"], generate_password_hash(password), str(uuid.uuid4())
+            user["id"],
+            hashed_password,
+            str(uuid.uuid4()),
+            user["username"],
+            user["email"],
         )
-
-        token = generate_token(username)
-
-        return token, 200
+    except ClientError as e:
+        current_app.logger.exception(e)
+        return "Error updating password", 500
+    return None
+
+
+@bp.cli.command("backfill-credentials")
+def backfill_credentials_command():
+    """Copy user credentials onto their username and email items."""
+    copied, present, skipped = current_app.user_database.backfill_credentials()
+    click.echo(
+        f"Copied the credentials of {copied} users, {present} had them already, "
+        f"skipped {skipped}"
+    )
+    if skipped:
+        raise click.exceptions.Exit(1)
 
 
 def token_required(f):
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import zipfile
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Iterable, Iterator
+from urllib.parse import quote
+
+
+def bundle_key(meta_data: dict) -> str:
+    # named after the bundle's etag, so a puzzle whose files change gets a new
+    # bundle even if its lastModified does not, and no cached copy goes stale
+    if not isinstance(meta_data["id"], str):
+        raise TypeError("puzzle id must be a string")
+    if not isinstance(meta_data["lastModified"], str):
+        raise TypeError("lastModified must be a string")
+    return f"bundles/{quote(meta_data['id'], safe='')}/{bundle_etag(meta_data)}.zip"
+
+
+def bundle_etag(meta_data: dict) -> str:
+    version = "\n".join(
+        str(meta_data[key]) for key in ("id", "lastModified", "icon", "puzzle")
+    )
+    return hashlib.sha256(version.encode("UTF-8")).hexdigest()[:32]
+
+
+def parse_last_modified(last_modified: str) -> datetime | None:
+    # clients send times like 28/5/2023 13:35:36, which are taken to be UTC
+    try:
+        parsed = datetime.strptime(last_modified, "%d/%m/%Y %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+    return parsed.replace(tzinfo=timezone.utc)
+
+
+def build_bundle(
+    puzzle_id: str, puzzle_image: bytes, puzzle_json: bytes, meta_data: dict
+) -> bytes:
+    memory_file = BytesIO()
+    with zipfile.ZipFile(memory_file, "w") as zf:
+        zf.writestr(f"{puzzle_id}.png", puzzle_image)
+        zf.writestr(f"{puzzle_id}.json", puzzle_json)
+        zf.writestr("meta_data.json", json.dumps(dict(meta_data)))
+    return memory_file.getvalue()
+
+
+class _ZipStream:
+    """
+    A write only file object that collects the bytes zipfile writes to it so
+    they can be handed on as soon as they are produced. zipfile writes data
+    descriptors after each entry because this object cannot seek.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _stream_zip(entries: Iterable[tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w") as zf:
+        for file_name, chunks in entries:
+            with zf.open(file_name, "w") as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = stream.pop()
+                    if data:
+                        yield data
+    yield stream.pop()
+
+
+def stream_bundle(
+    puzzle_id: str,
+    puzzle_image: Iterable[bytes],
+    puzzle_json: Iterable[bytes],
+    meta_data: dict,
+) -> Iterator[bytes]:
+    return _stream_zip(
+        [
+            (f"{puzzle_id}.png", puzzle_image),
+            (f"{puzzle_id}.json", puzzle_json),
+            ("meta_data.json", [json.dumps(dict(meta_data)).encode("UTF-8")]),
+        ]
+    )
+
+
+def stream_batch(
+    puzzle_ids: list[str],
+    meta_data: dict[str, dict],
+    files: Iterator[tuple[str, BytesIO | None]],
+) -> Iterator[bytes]:
+    """
+    Stream a zip holding a directory for each puzzle and a manifest.json with
+    the status of every requested id. ``files`` yields the icon and then the
+    JSON of each puzzle in ``meta_data``, in the order of ``puzzle_ids``, with
+    None in place of a file that could not be downloaded.
+    """
+    manifest = {}
+
+    def entries():
+        for puzzle_id in puzzle_ids:
+            if puzzle_id not in meta_data:
+                manifest[puzzle_id] = "not_found"
+                continue
+            (_, puzzle_image), (_, puzzle_json) = next(files), next(files)
+            if puzzle_image is None or puzzle_json is None:
+                manifest[puzzle_id] = "missing_files"
+                continue
+            puzzle = dict(meta_data[puzzle_id])
+            yield f"{puzzle_id}/{puzzle_id}.png", [puzzle_image.getvalue()]
+            yield f"{puzzle_id}/{puzzle_id}.json", [puzzle_json.getvalue()]
+            yield f"{puzzle_id}/meta_data.json", [json.dumps(puzzle).encode("UTF-8")]
+            manifest[puzzle_id] = "ok"
+        yield "manifest.json", [json.dumps(manifest).encode("UTF-8")]
+
+    return _stream_zip(entries())
@@ -0,0 +1,226 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """
+    A thread safe LRU cache holding at most max_size entries, each of which
+    expires ttl seconds after it was set, or after the ttl it was set with.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value, ttl: float | None = None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class BlobCache:
+    """
+    A thread safe LRU cache of byte strings, bounded by their total size rather
+    than by the number of entries. Blobs are handed out as read only
+    memoryviews, so callers share the cached bytes instead of copying them.
+    """
+
+    def __init__(self, max_bytes: int, max_blob_bytes: int | None = None):
+        if max_bytes < 0:
+            raise ValueError("max_bytes cannot be negative")
+        self.max_bytes = max_bytes
+        self.max_blob_bytes = min(max_bytes, max_blob_bytes or max_bytes)
+        self._blobs: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> memoryview | None:
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is None:
+                self.misses += 1
+                return None
+            self._blobs.move_to_end(key)
+            self.hits += 1
+            return memoryview(blob)
+
+    def set(self, key: Hashable, blob: bytes):
+        blob = bytes(blob)
+        with self._lock:
+            self._remove(key)
+            if len(blob) > self.max_blob_bytes:
+                return
+            self._blobs[key] = blob
+            self.size_bytes += len(blob)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._blobs.popitem(last=False)
+                self.size_bytes -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._blobs.clear()
+            self.size_bytes = 0
+
+    def _remove(self, key: Hashable):
+        blob = self._blobs.pop(key, None)
+        if blob is not None:
+            self.size_bytes -= len(blob)
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._blobs),
+            "size_bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DiskBlobCache:
+    """
+    Blobs cached as files in a directory, so every worker process on a host
+    shares them and a newly started worker begins with a warm cache. Files are
+    written to a temporary name and renamed into place, so readers never see a
+    partial file. Hits are memory mapped rather than read into the process.
+    The modification time of a file is its last use, and the least recently
+    used files are removed once the directory grows past max_bytes.
+    """
+
+    _temp_prefix = ".tmp-"
+
+    def __init__(self, directory: str | os.PathLike, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key: str) -> Path:
+        return self.directory.joinpath(hashlib.sha256(key.encode("UTF-8")).hexdigest())
+
+    def get_path(self, key: str) -> Path | None:
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def get(self, key: str) -> memoryview | None:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return memoryview(b"")
+                # the map stays open for as long as the memoryview is used
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except FileNotFoundError:
+            # evicted by another process since it was found
+            return None
+
+    def set(self, key: str, blob: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=self._temp_prefix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        self._evict()
+
+    def invalidate(self, key: str):
+        self.path(key).unlink(missing_ok=True)
+
+    def _evict(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(self._temp_prefix):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        size_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if size_bytes <= self.max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            size_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
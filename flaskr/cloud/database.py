@@ -1,33 +1,40 @@
 import logging
+import time
+
 import boto3
 from botocore.exceptions import ClientError
 from mypy_boto3_dynamodb import DynamoDBServiceResource
 from mypy_boto3_dynamodb.service_resource import Table
 
+from flaskr.cache import TTLCache
 from flaskr.file_validation import get_file_extension
 
 logger = logging.getLogger(__name__)
 
 
+class RegistrationConflict(Exception):
+    """Raised when the username or email of a new user is already registered"""
+
+    def __init__(self, fields: list[str]):
+        super().__init__(f"{' and '.join(fields)} already registered")
+        self.fields = fields
+
+
+class DatabaseBusy(Exception):
+    """Raised when DynamoDB is still throttling a request after its retries"""
+
+
 class UserDatabase:
+    # the username and email items hold a copy of these, so that a login or a
+    # password reset can read a user's credentials with a single get_item
+    credential_fields = ("id", "username", "email", "password", "resetGuid")
+
     def __init__(self):
         self.dynamodb: DynamoDBServiceResource = boto3.resource("dynamodb")
         self.user_table: Table = self.dynamodb.Table("crossword-userdata")
         self.email_table: Table = self.dynamodb.Table("crossword-emails")
         self.username_table: Table = self.dynamodb.Table("crossword-usernames")
 
-    def _check_username_registered(self, username: str):
-        logger.info("Checking if username is registered")
-        response = self.username_table.get_item(Key={"username": username})
-        logger.info(f"username is registered: {'Item' in response}")
-        return "Item" in response
-
-    def _check_email_registered(self, email: str):
-        logger.info("Checking if email is registered")
-        response = self.email_table.get_item(Key={"email": email})
-        logger.info(f"email is registered: {'Item' in response}")
-        return "Item" in response
-
     def get_id_for_username(self, username):
         logger.info("getting id for username")
         response = self.username_table.get_item(Key={"username": username})
@@ -43,94 +50,192 @@ class UserDatabase:
         response = self.user_table.get_item(Key={"id": user_id})
         return response
 
-    def update_password(self, user_id, password, reset_guid):
-        logger.info("updating password")
-        response = self.user_table.update_item(
-            Key={"id": user_id},
-            UpdateExpression="set password=:p, resetGuid=:g",
-            ExpressionAttributeValues={":p": password, ":g": reset_guid},
-            ReturnValues="UPDATED_NEW",
-        )
+    def _get_credentials(self, table: Table, key: dict) -> dict | None:
+        item = table.get_item(Key=key).get("Item")
+        if item is None or all(field in item for field in self.credential_fields):
+            return item
+        # registered before credentials were copied, see backfill_credentials
+        logger.info(f"no credentials on {table.name} item, getting user data")
+        return self.user_table.get_item(Key={"id": item["id"]}).get("Item")
 
-        return response
+    def get_credentials_for_username(self, username: str) -> dict | None:
+        """
+        The data of the user with a username, or None if there is none. This
+        takes one request, or two for a user whose credentials have not been
+        copied yet.
+        """
+        logger.info("getting credentials for username")
+        return self._get_credentials(self.username_table, {"username": username})
 
-    def delete_email(self, email):
-        self.email_table.delete_item(Key={"email": email})
+    def get_credentials_for_email(self, email: str) -> dict | None:
+        """The data of the user with an email, like get_credentials_for_username"""
+        logger.info("getting credentials for email")
+        return self._get_credentials(self.email_table, {"email": email})
 
-    # TODO: make this simpler
-    # flake8: noqa: C901
-    def register_new_user(self, user_id, username: str, password, email, reset_guid):
-        # self.table.
+    def update_password(
+        self,
+        user_id,
+        password,
+        reset_guid,
+        username: str | None = None,
+        email: str | None = None,
+    ):
+        """
+        Set a user's password hash and reset code, on the user item and the
+        copies of its credentials, in one transaction. The copies are given
+        the username and email as well, so that they are whole even for a
+        user who was never backfilled. Without the username and email, the
+        user item is read first to find them.
+        """
+        logger.info("updating password")
+        if username is None or email is None:
+            user = self.user_table.get_item(Key={"id": user_id})["Item"]
+            username, email = user["username"], user["email"]
+        updates = (
+            (self.user_table, {"id": user_id}, {}),
+            (self.username_table, {"username": username}, {"email": email}),
+            (self.email_table, {"email": email}, {"username": username}),
+        )
+        return self.dynamodb.meta.client.transact_write_items(
+            TransactItems=[
+                {
+                    "Update": {
+                        "TableName": table.name,
+                        "Key": key,
+                        "UpdateExpression": "set "
+                        + ", ".join(f"#{field} = :{field}" for field in fields),
+                        # the copies must belong to this user, and no item is
+                        # created if one is missing
+                        "ConditionExpression": "id = :id",
+                        "ExpressionAttributeNames": {
+                            f"#{field}": field for field in fields
+                        },
+                        "ExpressionAttributeValues": {
+                            **{f":{field}": value for field, value in fields.items()},
+                            ":id": user_id,
+                        },
+                    }
+                }
+                for table, key, copied in updates
+                for fields in [
+                    {"password": password, "resetGuid": reset_guid, **copied}
+                ]
+            ]
+        )
 
-        # do a get item for username
-        # do a get item for email
+    def _copy_credentials(self, user: dict, table: Table, key_name: str) -> str:
+        """
+        Copy a user's credentials onto their item in table, unless it has them
+        already, as those may be newer than the user that was scanned. Returns
+        "copied", "present", or "skipped" if the item is missing or belongs to
+        someone else.
+        """
+        key = {key_name: user[key_name]}
+        fields = [f for f in self.credential_fields if f not in ("id", key_name)]
         try:
-            email_already_used = self._check_email_registered(email)
+            table.update_item(
+                Key=key,
+                UpdateExpression="set "
+                + ", ".join(f"#{field} = :{field}" for field in fields),
+                ConditionExpression="id = :id AND attribute_not_exists(password)",
+                ExpressionAttributeNames={f"#{field}": field for field in fields},
+                ExpressionAttributeValues={
+                    f":{field}": user[field] for field in ("id", *fields)
+                },
+            )
         except ClientError as e:
-            logger.exception(e)
-            return False
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            item = table.get_item(Key=key, ConsistentRead=True).get("Item")
+            if item is not None and item["id"] == user["id"]:
+                return "present"
+            logger.warning(f"{table.name} item of user {user['id']} is not theirs")
+            return "skipped"
+        return "copied"
 
-        try:
-            user_already_used = self._check_username_registered(username)
-        except ClientError as e:
-            logger.exception(e)
-            return False
+    def backfill_credentials(self) -> tuple[int, int, int]:
+        """
+        Copy the credentials of every user onto their username and email
+        items, for users registered before they were kept there. Returns the
+        number of users copied, of those whose items had them already, and of
+        those whose username or email item belongs to someone else or is
+        missing.
+        """
+        copied = present = skipped = 0
+        scan_kwargs = {"ConsistentRead": True}
+        while True:
+            page = self.user_table.scan(**scan_kwargs)
+            for user in page["Items"]:
+                results = {
+                    self._copy_credentials(user, self.username_table, "username"),
+                    self._copy_credentials(user, self.email_table, "email"),
+                }
+                if "skipped" in results:
+                    skipped += 1
+                elif "copied" in results:
+                    copied += 1
+                else:
+                    present += 1
+            if "LastEvaluatedKey" not in page:
+                return copied, present, skipped
+            scan_kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
 
-        if email_already_used or user_already_used:
-            return False
+    def delete_email(self, email):
+        self.email_table.delete_item(Key={"email": email})
 
+    def register_new_user(self, user_id, username: str, password, email, reset_guid):
+        """
+        Write a new user, and claim their username and email, in a single
+        transaction that fails if either is taken. Raises RegistrationConflict
+        naming those that were. Returns False if the write fails otherwise.
+        """
+        credentials = {
+            "id": user_id,
+            "username": username,
+            "email": email,
+            "password": password,
+            "resetGuid": reset_guid,
+        }
+        puts = (
+            (self.username_table, "username"),
+            (self.email_table, "email"),
+            (self.user_table, "id"),
+        )
         try:
-            response = self.username_table.put_item(
-                Item={"username": username, "id": user_id}
+            self.dynamodb.meta.client.transact_write_items(
+                TransactItems=[
+                    {
+                        "Put": {
+                            "TableName": table.name,
+                            "Item": credentials,
+                            "ConditionExpression": "attribute_not_exists(#key)",
+                            "ExpressionAttributeNames": {"#key": key_name},
+                        }
+                    }
+                    for table, key_name in puts
+                ]
             )
-            match response["ResponseMetadata"]["HTTPStatusCode"]:
-                case 200:
-                    username_set = True
-                case _:
-                    username_set = False
         except ClientError as e:
+            if e.response["Error"]["Code"] == "TransactionCanceledException":
+                # the reasons are in the same order as the puts
+                taken = [
+                    key_name
+                    for (_, key_name), reason in zip(
+                        puts, e.response.get("CancellationReasons", [])
+                    )
+                    if reason.get("Code") == "ConditionalCheckFailed"
+                ]
+                if taken:
+                    raise RegistrationConflict(taken) from e
             logger.exception(e)
             return False
-
-        try:
-            response = self.email_table.put_item(Item={"email": email, "id": user_id})
-            match response["ResponseMetadata"]["HTTPStatusCode"]:
-                case 200:
-                    email_set = True
-                case _:
-                    self.username_table.delete_item(Key={"username": username})
-                    email_set = False
-        except ClientError as e:
-            logger.exception(e)
-            self.username_table.delete_item(Key={"username": username})
-            return False
-
-        if not username_set or not email_set:
-            return False
-
-        try:
-            response = self.user_table.put_item(
-                Item={
-                    "id": user_id,
-                    "username": username,
-                    "password": password,
-                    "email": email,
-                    "resetGuid": reset_guid,
-                }
-            )
-            match response["ResponseMetadata"]["HTTPStatusCode"]:
-                case 200:
-                    return True
-                case _:
-                    self.username_table.delete_item(Key={"username": username})
-                    self.email_table.delete_item(Key={"email": email})
-                    return False
-        except ClientError:
-            logger.exception("There was an aws client error")
-            return False
+        return True
 
 
 class PuzzleDatabase:
+    max_batch_get_keys = 100
+    max_batch_get_retries = 5
+
     def __init__(self):
         self.dynamodb: DynamoDBServiceResource = boto3.resource("dynamodb")
         self.table: Table = self.dynamodb.Table("crosswords")
@@ -140,8 +245,40 @@ class PuzzleDatabase:
         response = self.table.get_item(Key={"id": puzzle_id})
         return response["Item"]
 
-    def upload_puzzle_meta_data(
-        self,
+    def get_puzzle_meta_data_batch(self, puzzle_ids: list[str]) -> dict[str, dict]:
+        """
+        Look up several puzzles with BatchGetItem. Returns the items found,
+        keyed by puzzle id. Ids with no puzzle are left out. Raises
+        DatabaseBusy if some are still unprocessed after the retries.
+        """
+        if not all(isinstance(puzzle_id, str) for puzzle_id in puzzle_ids):
+            raise TypeError("puzzle_ids must be strings")
+        puzzle_ids = list(dict.fromkeys(puzzle_ids))
+        logger.info(f"Searching database for {len(puzzle_ids)} puzzles")
+
+        items = {}
+        for start in range(0, len(puzzle_ids), self.max_batch_get_keys):
+            keys = [
+                {"id": puzzle_id}
+                for puzzle_id in puzzle_ids[start : start + self.max_batch_get_keys]
+            ]
+            request_items = {self.table.name: {"Keys": keys}}
+            retries = 0
+            while request_items:
+                response = self.dynamodb.batch_get_item(RequestItems=request_items)
+                for item in response["Responses"].get(self.table.name, []):
+                    items[item["id"]] = item
+                request_items = response.get("UnprocessedKeys")
+                if request_items:
+                    if retries == self.max_batch_get_retries:
+                        raise DatabaseBusy("Could not read all of the puzzles")
+                    # back off exponentially before asking for the rest
+                    time.sleep(0.05 * 2**retries)
+                    retries += 1
+        return items
+
+    @staticmethod
+    def check_puzzle_meta_data(
         puzzle_id: str,
         puzzle_json_fname: str,
         time_created: str,
@@ -159,12 +296,97 @@ class PuzzleDatabase:
         if get_file_extension(puzzle_image_fname) != "png":
             raise ValueError("puzzle icon must be a PNG file")
 
-        self.table.put_item(
-            Item={
-                "id": puzzle_id,
-                "puzzle": puzzle_json_fname,
-                "icon": puzzle_image_fname,
-                "timeCreated": time_created,
-                "lastModified": last_modified,
-            }
+    def upload_puzzle_meta_data(
+        self,
+        puzzle_id: str,
+        puzzle_json_fname: str,
+        time_created: str,
+        last_modified: str,
+        puzzle_image_fname: str,
+    ):
+        self.check_puzzle_meta_data(
+            puzzle_id,
+            puzzle_json_fname,
+            time_created,
+            last_modified,
+            puzzle_image_fname,
         )
+        item = {
+            "id": puzzle_id,
+            "puzzle": puzzle_json_fname,
+            "icon": puzzle_image_fname,
+            "timeCreated": time_created,
+            "lastModified": last_modified,
+        }
+        self.table.put_item(Item=item)
+        return item
+
+    def upload_puzzle_meta_data_batch(self, items: list[dict]):
+        """
+        Write the metadata of many puzzles with BatchWriteItem, 25 items per
+        request. The items should already have been checked.
+        """
+        logger.info(f"Writing {len(items)} puzzles to the database")
+        # batch_writer resends unprocessed items, and overwrite_by_pkeys drops
+        # all but the last item for an id, which BatchWriteItem rejects
+        with self.table.batch_writer(overwrite_by_pkeys=["id"]) as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+
+class CachedPuzzleDatabase:
+    """
+    Wraps a PuzzleDatabase and keeps the puzzle metadata it reads in a
+    TTLCache. Uploads through this object invalidate the cached entry. Uploads
+    made by other processes are seen once the entry expires.
+    """
+
+    def __init__(self, puzzle_database: PuzzleDatabase, max_size: int, ttl: float):
+        self.puzzle_database = puzzle_database
+        self.cache = TTLCache(max_size, ttl)
+
+    def __getattr__(self, name):
+        return getattr(self.puzzle_database, name)
+
+    def get_puzzle_meta_data(self, puzzle_id: str):
+        if not isinstance(puzzle_id, str):
+            return self.puzzle_database.get_puzzle_meta_data(puzzle_id)
+        item = self.cache.get(puzzle_id)
+        if item is None:
+            item = self.puzzle_database.get_puzzle_meta_data(puzzle_id)
+            self.cache.set(puzzle_id, item)
+        return item
+
+    def get_puzzle_meta_data_batch(self, puzzle_ids: list[str]) -> dict[str, dict]:
+        if not all(isinstance(puzzle_id, str) for puzzle_id in puzzle_ids):
+            raise TypeError("puzzle_ids must be strings")
+        items = {}
+        missing_ids = []
+        for puzzle_id in dict.fromkeys(puzzle_ids):
+            item = self.cache.get(puzzle_id)
+            if item is None:
+                missing_ids.append(puzzle_id)
+            else:
+                items[puzzle_id] = item
+        if missing_ids:
+            found = self.puzzle_database.get_puzzle_meta_data_batch(missing_ids)
+            for puzzle_id, item in found.items():
+                self.cache.set(puzzle_id, item)
+            items.update(found)
+        return items
+
+    def upload_puzzle_meta_data(self, puzzle_id: str, *args, **kwargs):
+        try:
+            return self.puzzle_database.upload_puzzle_meta_data(
+                puzzle_id, *args, **kwargs
+            )
+        finally:
+            if isinstance(puzzle_id, str):
+                self.cache.invalidate(puzzle_id)
+
+    def upload_puzzle_meta_data_batch(self, items: list[dict]):
+        try:
+            self.puzzle_database.upload_puzzle_meta_data_batch(items)
+        finally:
+            for item in items:
+                self.cache.invalidate(item["id"])
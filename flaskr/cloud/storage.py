@@ -1,5 +1,13 @@
+import hashlib
 import io
 import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator
+from urllib.parse import quote
 
 import boto3
 import logging
@@ -8,76 +16,340 @@ from botocore.exceptions import ClientError
 from mypy_boto3_s3 import S3Client
 from werkzeug.datastructures import FileStorage
 
-from flaskr.file_validation import check_puzzle_json, get_file_extension
+from flaskr.bundle import bundle_key
+from flaskr.cache import BlobCache, DiskBlobCache
+from flaskr.file_validation import get_file_extension, load_puzzle_json
+from flaskr.grid_preview import render_grid_preview
+from flaskr.images import (
+    IconProcessor,
+    can_resize_images,
+    icon_formats,
+    icon_mimetypes,
+)
+from flaskr.puzzle_format import encode_puzzle
 
 logger = logging.getLogger(__name__)
 
 
+def is_missing(error: ClientError) -> bool:
+    """Whether a ClientError says the object does not exist"""
+    return error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound")
+
+
+class FileDownloadError(ClientError):
+    """
+    A ClientError raised while downloading one of several files, which records
+    the name of the file that could not be downloaded.
+    """
+
+    def __init__(self, file_name: str, error: ClientError):
+        super().__init__(error.response, error.operation_name)
+        self.file_name = file_name
+
+
+class UploadedFile:
+    """
+    The content of an uploaded file, read once from the request and then
+    validated, hashed and sent to S3 without being copied again. It is stored
+    under a key made from its hash, so identical files share one object.
+    A staged file is one a client already stored in S3 under file_name.
+    """
+
+    def __init__(self, file_name: str, data: bytes, staged: bool = False):
+        self.file_name = file_name
+        self.data = data
+        self.staged = staged
+        self.sha256 = hashlib.sha256(data).hexdigest()
+
+    @property
+    def key(self) -> str:
+        return f"{self.sha256}.{get_file_extension(self.file_name)}"
+
+
 class CloudStorage:
     max_thumbnail_size = 20000
+    # larger icons are shrunk to max_thumbnail_size, when Pillow is installed
+    max_image_upload_size = 4 * 1024 * 1024
+    # icons are scaled to fit squares of these sizes on request
+    icon_sizes = (64, 128, 256)
+    icon_variant_prefix = "icons"
+    grid_preview_prefix = "previews"
+    max_transfer_workers = 8
+    # a batch keeps this many downloads submitted ahead of the one it yields
+    max_batch_downloads_ahead = 16
+    stream_chunk_size = 64 * 1024
+    max_cached_blob_size = 1024 * 1024
+    presigned_url_expiry = 3600
+    max_puzzle_json_size = 1024 * 1024
+    staged_upload_prefix = "uploads"
+    # objects stored under their content hash never change
+    immutable_cache_control = "public, max-age=31536000, immutable"
 
-    def __init__(self):
+    def __init__(
+        self,
+        blob_cache_bytes: int = 16 * 1024 * 1024,
+        disk_cache_dir: str | os.PathLike | None = None,
+        disk_cache_bytes: int = 512 * 1024 * 1024,
+    ):
         self.client: S3Client = boto3.client("s3")
         self.bucket_name = "jhb-crossword"
+        # Cached blobs are keyed by file name and the number of times this
+        # object has uploaded that file. A download that races an upload then
+        # caches the old bytes under a version that is never read again.
+        self.blob_cache = BlobCache(blob_cache_bytes, self.max_cached_blob_size)
+        # The disk cache is shared by the workers on a host, so it is keyed by
+        # file name alone and uploads overwrite its entries.
+        self.disk_cache = None
+        if disk_cache_dir is not None:
+            self.disk_cache = DiskBlobCache(disk_cache_dir, disk_cache_bytes)
+        self._versions: dict[str, int] = {}
+        self._versions_lock = threading.Lock()
+        self.icon_processor = IconProcessor(self.max_thumbnail_size)
+        # boto3 clients are thread safe. Under gevent workers the threads in
+        # this pool are monkey patched into greenlets.
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_transfer_workers, thread_name_prefix="s3-transfer"
+        )
 
-    def _upload_file(self, file: FileStorage):
-        if file is None:
-            raise ValueError("file cannot be None")
-        logger.info(f"uploading {file.filename}")
+    def _cache_key(self, file_name: str) -> tuple[str, int]:
+        return file_name, self._versions.get(file_name, 0)
+
+    def _cache_upload(self, file_name: str, data: bytes):
+        with self._versions_lock:
+            self.blob_cache.invalidate(self._cache_key(file_name))
+            self._versions[file_name] = self._versions.get(file_name, 0) + 1
+            self.blob_cache.set(self._cache_key(file_name), data)
+            self._set_disk_cache(file_name, data)
+
+    def _set_disk_cache(self, file_name: str, data: bytes):
+        if self.disk_cache is None:
+            return
+        try:
+            self.disk_cache.set(file_name, data)
+        except OSError as e:
+            logger.warning(f"could not write {file_name} to the disk cache: {e}")
+
+    def _object_exists(self, file_name: str) -> bool:
         try:
-            memory_file = io.BytesIO(file.read())
-            logger.info(f"created file in memory: {file.filename}")
+            self.client.head_object(Bucket=self.bucket_name, Key=file_name)
+        except ClientError as e:
+            if is_missing(e):
+                return False
+            logger.error(e)
+            raise
+        return True
 
-            self.client.upload_fileobj(memory_file, self.bucket_name, file.filename)
+    def upload_file(self, upload: UploadedFile) -> bool:
+        """
+        Store a file under its content hash. Returns False without uploading
+        anything if an identical file is already stored.
+        """
+        if self._object_exists(upload.key):
+            logger.info(f"{upload.file_name} is already stored as {upload.key}")
+            created = False
+        else:
+            logger.info(f"uploading {upload.file_name} as {upload.key}")
+            try:
+                # a BytesIO made from a bytes object shares its buffer, so the
+                # upload reads the same bytes that were validated
+                self.client.upload_fileobj(
+                    io.BytesIO(upload.data),
+                    self.bucket_name,
+                    upload.key,
+                    ExtraArgs={"CacheControl": self.immutable_cache_control},
+                )
+            except ClientError as e:
+                logger.error(e)
+                raise
+            created = True
+        self._cache_upload(upload.key, upload.data)
+        return created
 
+    def _copy_staged_file(self, upload: UploadedFile) -> bool:
+        if self._object_exists(upload.key):
+            created = False
+        else:
+            logger.info(f"copying {upload.file_name} to {upload.key}")
+            try:
+                self.client.copy_object(
+                    Bucket=self.bucket_name,
+                    Key=upload.key,
+                    CopySource={"Bucket": self.bucket_name, "Key": upload.file_name},
+                    CacheControl=self.immutable_cache_control,
+                    MetadataDirective="REPLACE",
+                )
+            except ClientError as e:
+                logger.error(e)
+                raise
+            created = True
+        self._cache_upload(upload.key, upload.data)
+        return created
+
+    def store_staged_file(self, upload: UploadedFile) -> bool:
+        """
+        Move a file a client stored with a presigned post to its content hash
+        key. Returns False if an identical file was already stored there.
+        """
+        if upload.staged:
+            created = self._copy_staged_file(upload)
+        else:
+            # changed since it was staged, e.g. an icon that was shrunk
+            created = self.upload_file(upload)
+        try:
+            self.delete_file(upload.file_name)
+        except ClientError:
+            logger.warning(f"could not delete staged file {upload.file_name}")
+        return created
+
+    def delete_file(self, file_name: str):
+        logger.info(f"deleting {file_name}")
+        try:
+            self.client.delete_object(Bucket=self.bucket_name, Key=file_name)
         except ClientError as e:
             logger.error(e)
             raise
+        with self._versions_lock:
+            self.blob_cache.invalidate(self._cache_key(file_name))
+            self._versions[file_name] = self._versions.get(file_name, 0) + 1
+            if self.disk_cache is not None:
+                self.disk_cache.invalidate(file_name)
 
-    def _download_file(self, file_name: str) -> io.BytesIO:
+    def _fetch_file(self, file_name: str) -> bytes:
         logger.info(f"downloading {file_name}")
         memory_file = io.BytesIO()
         try:
-            # with memory_file as f:
             self.client.download_fileobj(self.bucket_name, file_name, memory_file)
-            # memory_file.seek(0)
         except ClientError as e:
             logger.error(e)
             raise
+        return memory_file.getvalue()
+
+    def download_blob(self, file_name: str) -> memoryview:
+        """
+        Download a file through the blob cache. The returned memoryview is read
+        only and shares the cached bytes.
+        """
+        key = self._cache_key(file_name)
+        blob = self.blob_cache.get(key)
+        if blob is None and self.disk_cache is not None:
+            blob = self.disk_cache.get(file_name)
+        if blob is None:
+            data = self._fetch_file(file_name)
+            self.blob_cache.set(key, data)
+            with self._versions_lock:
+                if key == self._cache_key(file_name):
+                    self._set_disk_cache(file_name, data)
+            blob = memoryview(data)
+        return blob
 
-        memory_file.seek(0)
-        return memory_file
+    def cached_file_path(self, file_name: str) -> Path | None:
+        """
+        The path of a file in the disk cache, which can be sent to a client
+        with sendfile. None if there is no disk cache or the file is not in it.
+        """
+        if self.disk_cache is None:
+            return None
+        return self.disk_cache.get_path(file_name)
 
-    def upload_image(self, file: FileStorage):
+    def _download_file(self, file_name: str) -> io.BytesIO:
+        # a BytesIO made from a bytes object shares its buffer until written to
+        return io.BytesIO(self.download_blob(file_name).obj)
+
+    def _iter_blob(self, blob: memoryview) -> Iterator[bytes]:
+        for start in range(0, len(blob), self.stream_chunk_size):
+            yield blob[start : start + self.stream_chunk_size].tobytes()
+
+    def _open_file(self, file_name: str) -> Iterator[bytes]:
+        blob = self.blob_cache.get(self._cache_key(file_name))
+        if blob is not None:
+            return iter([blob.obj])
+        if self.disk_cache is not None:
+            blob = self.disk_cache.get(file_name)
+            if blob is not None:
+                return self._iter_blob(blob)
+        logger.info(f"streaming {file_name}")
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=file_name)
+        except ClientError as e:
+            logger.error(e)
+            raise
+        return response["Body"].iter_chunks(self.stream_chunk_size)
+
+    def _run_concurrently(self, func: Callable, file_names: list[str]) -> list:
+        futures = [self.executor.submit(func, file_name) for file_name in file_names]
+        results = []
+        for file_name, future in zip(file_names, futures):
+            try:
+                results.append(future.result())
+            except ClientError as e:
+                raise FileDownloadError(file_name, e) from e
+        return results
+
+    @staticmethod
+    def _check_puzzle_file_names(image_file_name: str, json_file_name: str):
+        file_type = get_file_extension(image_file_name)
+        if file_type != "png":
+            raise ValueError(f"Expected png file, got {file_type}")
+        file_type = get_file_extension(json_file_name)
+        if file_type != "json":
+            raise ValueError(f"Expected json file, got {file_type}")
+
+    @staticmethod
+    def _read_file(file: FileStorage, file_type: str, max_size: int) -> UploadedFile:
         if file is None:
             raise ValueError("file cannot be None")
-        file_type = get_file_extension(file.filename)
-        if file_type != "png":
-            raise ValueError(f"Expected png, got {file_type}")
+        actual_file_type = get_file_extension(file.filename)
+        if actual_file_type != file_type:
+            raise ValueError(f"Expected {file_type} file, got {actual_file_type}")
+        # one byte past the limit is enough to tell that a file is too large
+        data = file.stream.read(max_size + 1)
+        if len(data) > max_size:
+            raise ValueError(
+                f"{file_type} file exceeds maximum upload size ({max_size})"
+            )
+        return UploadedFile(file.filename, data)
+
+    @property
+    def image_upload_limit(self) -> int:
+        if can_resize_images():
+            return self.max_image_upload_size
+        return self.max_thumbnail_size
 
-        file_bytes = file.stream.read()
-        if len(file_bytes) > self.max_thumbnail_size:
+    def _prepare_image(self, upload: UploadedFile) -> UploadedFile:
+        if len(upload.data) > self.image_upload_limit:
             raise ValueError(
-                f"Thumbnail ({len(file_bytes)}) exceeds maximum "
-                f"upload size ({self.max_thumbnail_size})"
+                f"Thumbnail ({len(upload.data)}) exceeds maximum "
+                f"upload size ({self.image_upload_limit})"
             )
-        file.stream.seek(0)
-        return self._upload_file(file)
+        data = self.icon_processor.normalize(upload.data)
+        if data is upload.data:
+            return upload
+        return UploadedFile(upload.file_name, data)
 
-    def upload_puzzle_json(self, file: FileStorage):
-        if file is None:
-            raise ValueError("file cannot be None")
-        file_type = get_file_extension(file.filename)
-        if file_type != "json":
-            raise ValueError(f"Expected json file, got {file_type}")
+    @staticmethod
+    def _check_puzzle_json(upload: UploadedFile):
+        # check the content matches the expected json format. json.loads
+        # decodes the bytes itself, so no decoded copy is kept.
+        load_puzzle_json(upload.data)
+
+    def read_image(self, file: FileStorage) -> UploadedFile:
+        upload = self._read_file(file, "png", self.image_upload_limit)
+        return self._prepare_image(upload)
 
-        # check the content matches the expected json format
-        file_bytes = file.stream.read()
-        file_string = file_bytes.decode("UTF-8")
-        check_puzzle_json(json.loads(file_string))
-        file.stream.seek(0)
+    def read_puzzle_json(self, file: FileStorage) -> UploadedFile:
+        upload = self._read_file(file, "json", self.max_puzzle_json_size)
+        self._check_puzzle_json(upload)
+        return upload
 
-        return self._upload_file(file)
+    def upload_image(self, file: FileStorage) -> UploadedFile:
+        upload = self.read_image(file)
+        self.upload_file(upload)
+        return upload
+
+    def upload_puzzle_json(self, file: FileStorage) -> UploadedFile:
+        upload = self.read_puzzle_json(file)
+        self.upload_file(upload)
+        return upload
 
     def download_image(self, file_name: str) -> io.BytesIO:
         file_type = get_file_extension(file_name)
@@ -90,3 +362,270 @@ class CloudStorage:
         if file_type != "json":
             raise ValueError(f"Expected json file, got {file_type}")
         return self._download_file(file_name)
+
+    def download_puzzle_binary(self, file_name: str) -> bytes:
+        """
+        Download a puzzle JSON in the binary form of puzzle_format. The
+        encoding is cached alongside the JSON it came from. Raises ValueError
+        if the puzzle cannot be encoded.
+        """
+        key = (self._cache_key(file_name), "binary")
+        blob = self.blob_cache.get(key)
+        if blob is not None:
+            return blob.obj
+        data = encode_puzzle(json.loads(self.download_blob(file_name).tobytes()))
+        self.blob_cache.set(key, data)
+        return data
+
+    def icon_size_for(self, size: int) -> int:
+        """The smallest icon variant at least size pixels across, or the largest"""
+        return next((s for s in self.icon_sizes if s >= size), self.icon_sizes[-1])
+
+    def icon_variant_key(self, file_name: str, size: int, image_format: str) -> str:
+        stem = file_name.rpartition(".")[0]
+        return (
+            f"{self.icon_variant_prefix}/{quote(stem, safe='')}/{size}.{image_format}"
+        )
+
+    def _check_icon_variant(self, size: int, image_format: str):
+        if size not in self.icon_sizes:
+            raise ValueError(f"size must be one of {self.icon_sizes}")
+        if image_format not in icon_formats():
+            raise ValueError(f"cannot make {image_format} icons")
+
+    def _store_derived_file(self, key: str, data: bytes, content_type: str):
+        # for files made from stored ones, which are not content addressed
+        logger.info(f"uploading {key}")
+        try:
+            self.client.put_object(
+                Bucket=self.bucket_name, Key=key, Body=data, ContentType=content_type
+            )
+        except ClientError as e:
+            logger.error(e)
+            raise
+        self._cache_upload(key, data)
+
+    def _store_icon_variant(
+        self, file_name: str, size: int, image_format: str
+    ) -> bytes:
+        data = self.icon_processor.render_variant(
+            self.download_blob(file_name).tobytes(), size, image_format
+        )
+        self._store_derived_file(
+            self.icon_variant_key(file_name, size, image_format),
+            data,
+            icon_mimetypes[image_format],
+        )
+        return data
+
+    def download_icon_variant(
+        self, file_name: str, size: int, image_format: str
+    ) -> bytes:
+        """
+        An icon scaled to fit in size x size pixels, as png or webp. A variant
+        is made the first time it is asked for, then stored and cached like
+        any other file. Raises ValueError if the variant cannot be made.
+        """
+        self._check_icon_variant(size, image_format)
+        try:
+            blob = self.download_blob(
+                self.icon_variant_key(file_name, size, image_format)
+            )
+        except ClientError:
+            return self._store_icon_variant(file_name, size, image_format)
+        return blob.tobytes()
+
+    def icon_variant_url(self, file_name: str, size: int, image_format: str) -> str:
+        """A presigned url for an icon variant, which is made first if need be"""
+        self._check_icon_variant(size, image_format)
+        key = self.icon_variant_key(file_name, size, image_format)
+        if self.blob_cache.get(self._cache_key(key)) is None and not (
+            self._object_exists(key)
+        ):
+            self._store_icon_variant(file_name, size, image_format)
+        return self.presigned_url(key)
+
+    def grid_preview_key(self, puzzle_file_name: str) -> str:
+        stem = puzzle_file_name.rpartition(".")[0]
+        return f"{self.grid_preview_prefix}/{quote(stem, safe='')}.png"
+
+    @staticmethod
+    def grid_preview_image(puzzle_json: UploadedFile) -> UploadedFile:
+        """
+        An icon for a puzzle uploaded without one, rendered from its JSON,
+        which must have been checked already. Raises ValueError if the grid
+        cannot be drawn.
+        """
+        return UploadedFile(
+            "icon.png", render_grid_preview(json.loads(puzzle_json.data))
+        )
+
+    def download_grid_preview(self, puzzle_file_name: str) -> bytes:
+        """
+        A preview of the empty grid of a stored puzzle JSON. Puzzle files are
+        stored under their content hash, so a preview is rendered once for
+        each version of a puzzle, then stored and cached. Raises ValueError if
+        the grid cannot be drawn.
+        """
+        key = self.grid_preview_key(puzzle_file_name)
+        try:
+            return self.download_blob(key).tobytes()
+        except ClientError:
+            pass
+        puzzle = load_puzzle_json(self.download_blob(puzzle_file_name).tobytes())
+        data = render_grid_preview(puzzle)
+        self._store_derived_file(key, data, "image/png")
+        return data
+
+    def download_files(self, file_names: list[str]) -> list[io.BytesIO]:
+        return self._run_concurrently(self._download_file, file_names)
+
+    def open_files(self, file_names: list[str]) -> list[Iterator[bytes]]:
+        """
+        Start downloading several files concurrently. Each file is returned as an
+        iterator over chunks of its body, so it is never held in memory in full.
+        """
+        return self._run_concurrently(self._open_file, file_names)
+
+    def download_file_batch(
+        self, file_names: list[str]
+    ) -> Iterator[tuple[str, io.BytesIO | None]]:
+        """
+        Download files concurrently and yield them in order as they arrive. A
+        file that could not be downloaded is yielded as None. Only
+        max_batch_downloads_ahead downloads are submitted at a time, so a large
+        batch neither floods the shared executor nor holds every file at once.
+        """
+        remaining = iter(file_names)
+        pending: deque[tuple[str, Future]] = deque()
+
+        def submit_next():
+            file_name = next(remaining, None)
+            if file_name is not None:
+                future = self.executor.submit(self._download_file, file_name)
+                pending.append((file_name, future))
+
+        for _ in range(self.max_batch_downloads_ahead):
+            submit_next()
+
+        def results():
+            while pending:
+                file_name, future = pending.popleft()
+                submit_next()
+                try:
+                    yield file_name, future.result()
+                except ClientError:
+                    yield file_name, None
+
+        return results()
+
+    def download_puzzle_files(
+        self, image_file_name: str, json_file_name: str
+    ) -> tuple[io.BytesIO, io.BytesIO]:
+        self._check_puzzle_file_names(image_file_name, json_file_name)
+        puzzle_image, puzzle_json = self.download_files(
+            [image_file_name, json_file_name]
+        )
+        return puzzle_image, puzzle_json
+
+    def open_puzzle_files(
+        self, image_file_name: str, json_file_name: str
+    ) -> tuple[Iterator[bytes], Iterator[bytes]]:
+        self._check_puzzle_file_names(image_file_name, json_file_name)
+        puzzle_image, puzzle_json = self.open_files([image_file_name, json_file_name])
+        return puzzle_image, puzzle_json
+
+    def presigned_url(self, file_name: str, download_name: str | None = None) -> str:
+        params = {"Bucket": self.bucket_name, "Key": file_name}
+        if download_name is not None:
+            params[
+                "ResponseContentDisposition"
+            ] = f'attachment; filename="{download_name}"'
+        return self.client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=self.presigned_url_expiry
+        )
+
+    def staged_upload_keys(self, upload_id: str) -> tuple[str, str]:
+        """The keys a presigned upload stores its icon and puzzle JSON under"""
+        prefix = f"{self.staged_upload_prefix}/{upload_id}"
+        return f"{prefix}/icon.png", f"{prefix}/puzzle.json"
+
+    def presigned_post(self, file_name: str, max_size: int) -> dict:
+        # S3 rejects a post whose body is empty or larger than max_size
+        return self.client.generate_presigned_post(
+            self.bucket_name,
+            file_name,
+            Conditions=[["content-length-range", 1, max_size]],
+            ExpiresIn=self.presigned_url_expiry,
+        )
+
+    def presigned_puzzle_upload(self, upload_id: str) -> dict:
+        """
+        Presigned posts that let a client store the icon and puzzle JSON of an
+        upload in S3 directly, without sending them through this server.
+        """
+        image_file_name, json_file_name = self.staged_upload_keys(upload_id)
+        return {
+            "icon": self.presigned_post(image_file_name, self.image_upload_limit),
+            "puzzle": self.presigned_post(json_file_name, self.max_puzzle_json_size),
+        }
+
+    def read_staged_puzzle_files(
+        self, upload_id: str
+    ) -> tuple[UploadedFile, UploadedFile]:
+        """
+        Download and validate the files a client stored with a presigned puzzle
+        upload. Raises FileDownloadError if either is missing, and ValueError
+        or KeyError if either is invalid.
+        """
+        file_names = self.staged_upload_keys(upload_id)
+        image, puzzle_json = (
+            UploadedFile(file_name, data, staged=True)
+            for file_name, data in zip(
+                file_names, self._run_concurrently(self._fetch_file, file_names)
+            )
+        )
+        return self.prepare_puzzle_files(image, puzzle_json)
+
+    def prepare_puzzle_files(
+        self, image: UploadedFile | None, puzzle_json: UploadedFile
+    ) -> tuple[UploadedFile, UploadedFile]:
+        """
+        Validate an icon and puzzle JSON that were not read from a request,
+        shrinking the icon if need be, or drawing one from the grid if there
+        is none. Raises ValueError or KeyError if either is invalid.
+        """
+        self._check_puzzle_json(puzzle_json)
+        if image is None:
+            return self.grid_preview_image(puzzle_json), puzzle_json
+        return self._prepare_image(image), puzzle_json
+
+    def presigned_bundle_url(self, puzzle: dict) -> str:
+        return self.presigned_url(bundle_key(puzzle), download_name="puzzle.zip")
+
+    def bundle_exists(self, puzzle: dict) -> bool:
+        return self._object_exists(bundle_key(puzzle))
+
+    def upload_bundle(self, puzzle: dict, bundle: bytes):
+        key = bundle_key(puzzle)
+        logger.info(f"uploading bundle {key}")
+        try:
+            self.client.put_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                Body=bundle,
+                ContentType="application/zip",
+            )
+        except ClientError as e:
+            logger.error(e)
+            raise
+        self._cache_upload(key, bundle)
+
+    def download_bundle(self, puzzle: dict) -> io.BytesIO:
+        return self._download_file(bundle_key(puzzle))
+
+    def cached_bundle_path(self, puzzle: dict) -> Path | None:
+        return self.cached_file_path(bundle_key(puzzle))
+
+    def open_bundle(self, puzzle: dict) -> Iterator[bytes]:
+        return self._open_file(bundle_key(puzzle))
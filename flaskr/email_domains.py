@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+import dns.exception
+import dns.resolver
+
+from flaskr.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class DnsResolver:
+    """
+    Looks up whether a domain can receive mail the way pyisemail does: it has
+    an MX record, or failing that an A record. A lookup gives up after
+    timeout seconds, however many nameservers it has tried.
+    """
+
+    def __init__(self, timeout: float = 2.0):
+        self.resolver = dns.resolver.Resolver()
+        self.timeout = timeout
+
+    def _has_record(self, domain: str, record_type: str, lifetime: float) -> bool:
+        try:
+            self.resolver.resolve(domain, record_type, lifetime=lifetime)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return False
+        return True
+
+    def accepts_mail(self, domain: str) -> bool | None:
+        """None if the answer is not known, e.g. because the lookup timed out"""
+        deadline = time.monotonic() + self.timeout
+        try:
+            if self._has_record(domain, "MX", self.timeout):
+                return True
+            # the A lookup only gets what the MX lookup left of the timeout
+            return self._has_record(domain, "A", max(0.0, deadline - time.monotonic()))
+        except (dns.resolver.NoNameservers, dns.exception.Timeout) as e:
+            logger.warning(f"could not look up {domain}: {e}")
+            return None
+        except dns.exception.DNSException:
+            # e.g. a name that is too long or has an empty label
+            return False
+
+
+class StaticResolver:
+    """
+    A stand-in for DnsResolver that answers from domains, a dict of domain
+    to answer, and with default for any other domain. Used by tests and
+    wherever DNS cannot be reached. Each lookup is kept in lookups.
+    """
+
+    def __init__(
+        self, domains: dict[str, bool | None] | None = None, default: bool = True
+    ):
+        self.domains = domains or {}
+        self.default = default
+        self.lookups: list[str] = []
+
+    def accepts_mail(self, domain: str) -> bool | None:
+        self.lookups.append(domain)
+        return self.domains.get(domain, self.default)
+
+
+class EmailDomainChecker:
+    """
+    Checks that the domain of an email address can receive mail, caching the
+    answer for each domain for positive_ttl seconds if it can and
+    negative_ttl seconds if it cannot. When the resolver does not know, the
+    address is let through and nothing is cached, so a slow DNS server turns
+    no one away and the next registration asks again. The cache hit ratio
+    and lookup times are reported by stats, and logged every report_every
+    checks.
+    """
+
+    report_every = 100
+
+    def __init__(
+        self,
+        resolver: DnsResolver | StaticResolver,
+        positive_ttl: float = 3600,
+        negative_ttl: float = 300,
+        max_size: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.resolver = resolver
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(max_size, positive_ttl, clock)
+        self._stats_lock = threading.Lock()
+        self.checks = 0
+        self.lookups = 0
+        self.unknown = 0
+        self.total_lookup_time = 0.0
+        self.max_lookup_time = 0.0
+
+    def _record(self, lookup_time: float, answer: bool | None):
+        with self._stats_lock:
+            self.lookups += 1
+            if answer is None:
+                self.unknown += 1
+            self.total_lookup_time += lookup_time
+            self.max_lookup_time = max(self.max_lookup_time, lookup_time)
+
+    def _count_check(self):
+        with self._stats_lock:
+            self.checks += 1
+            report = self.checks % self.report_every == 0
+        if report:
+            logger.info(f"email domain checks: {self.stats()}")
+
+    def accepts_mail(self, email: str) -> bool:
+        self._count_check()
+        domain = email.rpartition("@")[2].lower()
+        cached = self.cache.get(domain)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        answer = self.resolver.accepts_mail(domain)
+        self._record(time.perf_counter() - start, answer)
+        if answer is None:
+            return True
+        self.cache.set(
+            domain, answer, self.positive_ttl if answer else self.negative_ttl
+        )
+        return answer
+
+    def stats(self) -> dict:
+        cache_stats = self.cache.stats()
+        checks = cache_stats["hits"] + cache_stats["misses"]
+        with self._stats_lock:
+            return {
+                "domains": cache_stats["size"],
+                "hits": cache_stats["hits"],
+                "misses": cache_stats["misses"],
+                "hitRatio": cache_stats["hits"] / checks if checks else 0.0,
+                "lookups": self.lookups,
+                "unknown": self.unknown,
+                "meanLookupTime": self.total_lookup_time / self.lookups
+                if self.lookups
+                else 0.0,
+                "maxLookupTime": self.max_lookup_time,
+            }
@@ -1,3 +1,6 @@
+import json
+
+
 def check_clue_boxes(clue_boxes: dict[str, dict]):
     valid_keys = {"first", "second", "third"}
     for clue_box in clue_boxes:
@@ -30,13 +33,106 @@ def check_grid_size(input_json: dict):
         raise KeyError("gridSize not in json")
 
 
+class PuzzleJsonError(KeyError):
+    """
+    Raised when a puzzle JSON does not have the expected structure. It lists
+    every violation found rather than only the first.
+    """
+
+    def __init__(self, violations: list[str]):
+        super().__init__(violations[0])
+        self.violations = violations
+
+    def __str__(self):
+        return "; ".join(self.violations)
+
+
+_clue_keys = frozenset({"clue", "clueBoxes", "clueName"})
+_clue_box_keys = frozenset({"first", "second", "third"})
+
+
+def _find_clue_violations(clues, path: str, violations: list[str], max_violations: int):
+    if not isinstance(clues, dict):
+        violations.append(f"{path} is not an object")
+        return
+    for clue_name, clue in clues.items():
+        if len(violations) >= max_violations:
+            return
+        # comparing a keys view with a frozenset does not build a new set
+        if not isinstance(clue, dict) or clue.keys() != _clue_keys:
+            violations.append(f"{path}.{clue_name}: Invalid clue structure")
+            continue
+        clue_boxes = clue["clueBoxes"]
+        if not isinstance(clue_boxes, list):
+            violations.append(f"{path}.{clue_name}.clueBoxes is not a list")
+            continue
+        for i, clue_box in enumerate(clue_boxes):
+            if not isinstance(clue_box, dict) or clue_box.keys() != _clue_box_keys:
+                violations.append(
+                    f"{path}.{clue_name}.clueBoxes[{i}]: Invalid clue box structure"
+                )
+
+
+def find_puzzle_json_violations(input_json, max_violations: int = 100) -> list[str]:
+    """
+    Check the structure of a decoded puzzle JSON in a single pass. Returns
+    the violations found, stopping after max_violations.
+    """
+    if not isinstance(input_json, dict):
+        return ["puzzle is not an object"]
+    violations = []
+    if "gridSize" not in input_json:
+        violations.append("gridSize not in json")
+    for key in ("clues", "_clues"):
+        if key not in input_json:
+            violations.append(f"{key} not in json")
+        else:
+            _find_clue_violations(input_json[key], key, violations, max_violations)
+    return violations[:max_violations]
+
+
+def _reject_early(pairs: list[tuple]) -> dict:
+    # json calls this for each object as soon as it has been parsed, so a
+    # malformed clue or clue box stops the parse there
+    obj = dict(pairs)
+    if not obj.keys().isdisjoint(_clue_box_keys) and obj.keys() != _clue_box_keys:
+        raise PuzzleJsonError(["Invalid clue box structure"])
+    if "clueBoxes" in obj and obj.keys() != _clue_keys:
+        raise PuzzleJsonError([f"{obj.get('clueName')}: Invalid clue structure"])
+    return obj
+
+
+def load_puzzle_json(data: bytes | str, reject_early: bool = False) -> dict:
+    """
+    Decode and check a puzzle JSON. With reject_early, clues and clue boxes
+    are checked while the JSON is parsed, so a malformed file is rejected
+    before all of it has been decoded. That is slower for valid files.
+    Raises PuzzleJsonError listing the violations, or ValueError if the data
+    is not JSON.
+    """
+    if reject_early:
+        input_json = json.loads(data, object_pairs_hook=_reject_early)
+    else:
+        input_json = json.loads(data)
+    check_puzzle_json(input_json)
+    return input_json
+
+
 def check_puzzle_json(input_json: dict) -> bool:
-    check_grid_size(input_json)
-    check_public_clues(input_json)
-    check_private_clues(input_json)
+    violations = find_puzzle_json_violations(input_json)
+    if violations:
+        raise PuzzleJsonError(violations)
     return True
 
 
+png_signature = b"\x89PNG\r\n\x1a\n"
+
+
+def check_png_signature(data: bytes):
+    if bytes(data[: len(png_signature)]) != png_signature:
+        raise ValueError("Not a png file")
+
+
 def get_file_extension(file_name: str):
     if file_name is None:
         raise ValueError("Not a file")
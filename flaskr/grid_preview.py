@@ -0,0 +1,75 @@
+"""
+Renders a preview of an empty crossword grid as a PNG, from the gridSize and
+clue boxes of its puzzle JSON. The squares that belong to a clue are white,
+the rest black, with grey lines between them. Only the standard library is
+used, so previews can be made without Pillow.
+"""
+import struct
+import zlib
+
+# the grid is scaled so that previews are about this many pixels across
+preview_size = 256
+max_grid_size = 100
+
+_white = 255
+_black = 0
+_line = 160
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(chunk_type + data)
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+
+def _is_in_grid(value, grid_size: int) -> bool:
+    return type(value) is int and 0 <= value < grid_size
+
+
+def grid_squares(puzzle: dict) -> list[bytearray]:
+    """
+    Whether each square of the grid belongs to a clue, by row. The first
+    coordinate of a clue box is its column, the second its row. Raises
+    ValueError if the grid is too large or a clue box lies outside it.
+    """
+    grid_size = puzzle["gridSize"]
+    if not (type(grid_size) is int and 0 < grid_size <= max_grid_size):
+        raise ValueError(f"gridSize must be between 1 and {max_grid_size}")
+    squares = [bytearray(grid_size) for _ in range(grid_size)]
+    for clues in (puzzle["clues"], puzzle["_clues"]):
+        for name, clue in clues.items():
+            for clue_box in clue["clueBoxes"]:
+                column, row = clue_box["first"], clue_box["second"]
+                if not (_is_in_grid(column, grid_size) and _is_in_grid(row, grid_size)):
+                    raise ValueError(f"a clue box of {name} is outside the grid")
+                squares[row][column] = 1
+    return squares
+
+
+def render_grid_preview(puzzle: dict) -> bytes:
+    """A greyscale PNG of the empty grid of a puzzle JSON"""
+    squares = grid_squares(puzzle)
+    cell = max(2, preview_size // len(squares))
+    size = len(squares) * cell + 1
+
+    line_row = b"\x00" + bytes([_line]) * size
+    rows = []
+    for row in squares:
+        # each scanline starts with its filter type, 0 for none
+        scanline = bytearray(b"\x00")
+        for square in row:
+            scanline.append(_line)
+            scanline.extend(bytes([_white if square else _black]) * (cell - 1))
+        scanline.append(_line)
+        rows.append(line_row)
+        rows.extend([bytes(scanline)] * (cell - 1))
+    rows.append(line_row)
+
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            # 8 bit greyscale, without interlacing
+            _chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0)),
+            _chunk(b"IDAT", zlib.compress(b"".join(rows), 9)),
+            _chunk(b"IEND", b""),
+        )
+    )
@@ -0,0 +1,189 @@
+import io
+import logging
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flaskr.file_validation import check_png_signature
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is optional, install the image extra to resize icons
+    Image = None
+
+icon_mimetypes = {"png": "image/png", "webp": "image/webp"}
+
+logger = logging.getLogger(__name__)
+
+# the IHDR chunk always comes first, straight after the signature
+_ihdr = struct.Struct(">I4sII")
+
+
+def can_resize_images() -> bool:
+    return Image is not None
+
+
+def icon_formats() -> tuple[str, ...]:
+    """The formats icon variants can be encoded in, which needs Pillow"""
+    if not can_resize_images():
+        return ()
+    if features.check("webp"):
+        return "png", "webp"
+    return ("png",)
+
+
+def png_dimensions(data: bytes) -> tuple[int, int]:
+    """
+    The width and height of a PNG, read from its header without decoding it.
+    Raises ValueError if the data is not a PNG.
+    """
+    check_png_signature(data)
+    try:
+        length, chunk_type, width, height = _ihdr.unpack_from(data, 8)
+    except struct.error as e:
+        raise ValueError("png file is truncated") from e
+    if length != 13 or chunk_type != b"IHDR" or width == 0 or height == 0:
+        raise ValueError("png file has no valid header")
+    return width, height
+
+
+def check_icon(data: bytes, max_dimension: int):
+    """
+    Raises ValueError if the data is not a PNG, or is larger than
+    max_dimension pixels either way. Nothing is decoded, so this is cheap
+    enough to run before deciding whether to resize it.
+    """
+    width, height = png_dimensions(data)
+    if max(width, height) > max_dimension:
+        raise ValueError(
+            f"Thumbnail ({width}x{height}) exceeds maximum dimensions "
+            f"({max_dimension}x{max_dimension})"
+        )
+
+
+def _encode_png(image) -> bytes:
+    out = io.BytesIO()
+    image.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def _palette_image(image):
+    # a 256 colour palette usually shrinks an icon far more than resizing it
+    if image.mode in ("P", "1", "L"):
+        return None
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    return image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+
+
+def fit_png(data: bytes, max_bytes: int, min_dimension: int = 16) -> bytes:
+    """
+    Re-encode a PNG so that it is at most max_bytes long, first by reducing
+    it to a palette and then by scaling it down. Needs Pillow. Raises
+    ValueError if the image is still too large at min_dimension pixels.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+    image = source
+    while True:
+        for candidate in (image, _palette_image(image)):
+            if candidate is None:
+                continue
+            encoded = _encode_png(candidate)
+            if len(encoded) <= max_bytes:
+                return encoded
+        width, height = image.size
+        if max(width, height) <= min_dimension:
+            raise ValueError("icon cannot be made small enough")
+        # the encoded size shrinks roughly with the number of pixels
+        scale = min(0.9, (max_bytes / len(encoded)) ** 0.5)
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        image = source.resize(size, Image.Resampling.LANCZOS)
+
+
+def resize_icon(data: bytes, size: int, image_format: str) -> bytes:
+    """
+    Scale an icon down to fit in size x size pixels, keeping its aspect
+    ratio, and encode it as png or webp. Needs Pillow.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # thumbnail never makes an image larger
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        if image_format == "webp":
+            image.save(out, "WEBP", quality=80)
+        else:
+            image.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+class ResizeFailed(Exception):
+    """Raised when a resize process died before it answered"""
+
+
+class IconProcessor:
+    """
+    Checks uploaded icons, shrinks those over max_bytes to fit, and renders
+    smaller variants of them. Resizing is CPU bound, so it runs in a process
+    pool rather than on the request thread. Without Pillow, oversized icons
+    are rejected instead, and there are no variants. If a process in the pool
+    dies, the calls waiting on it raise ResizeFailed and the next call starts
+    a new pool.
+    """
+
+    # each pool process decodes a whole icon, 16MB as RGBA at this size
+    max_dimension = 2048
+    max_workers = 2
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # started on first use, so processes that never resize an icon, and
+        # workers forked before then, do not hold an idle pool
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _run(self, func, *args):
+        executor = self.executor
+        try:
+            return executor.submit(func, *args).result()
+        except BrokenProcessPool as e:
+            logger.error("an icon resizing process died, starting a new pool")
+            with self._executor_lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise ResizeFailed("an icon resizing process died") from e
+
+    def normalize(self, data: bytes) -> bytes:
+        """
+        Check an icon and return it, or a smaller copy of it if it is over
+        max_bytes. Raises ValueError if it is invalid or cannot be shrunk, or
+        ResizeFailed.
+        """
+        check_icon(data, self.max_dimension)
+        if len(data) <= self.max_bytes:
+            return data
+        if not can_resize_images():
+            raise ValueError(
+                f"Thumbnail ({len(data)}) exceeds maximum "
+                f"upload size ({self.max_bytes})"
+            )
+        resized = self._run(fit_png, data, self.max_bytes)
+        logger.info(f"shrank icon from {len(data)} to {len(resized)} bytes")
+        return resized
+
+    def render_variant(self, data: bytes, size: int, image_format: str) -> bytes:
+        """Raises ValueError if the icon cannot be resized, or ResizeFailed"""
+        if image_format not in icon_formats():
+            raise ValueError(f"cannot make {image_format} icons")
+        # icons stored before the dimensions were limited are checked again
+        check_icon(data, self.max_dimension)
+        return self._run(resize_icon, data, size, image_format)
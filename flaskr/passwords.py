@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+logger = logging.getLogger(__name__)
+
+default_hash_method = f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"
+# the parameters werkzeug uses for each method when they are left out
+_method_defaults = {
+    "pbkdf2": ("sha256", str(DEFAULT_PBKDF2_ITERATIONS)),
+    "scrypt": ("32768", "8", "1"),
+}
+
+
+def full_hash_method(method: str) -> str:
+    """
+    A werkzeug hash method with all of its parameters, as it is written at
+    the start of the hashes it makes, e.g. pbkdf2:sha256:600000 for pbkdf2.
+    Raises ValueError for methods other than pbkdf2 and scrypt.
+    """
+    name, *params = method.split(":")
+    if name not in _method_defaults:
+        raise ValueError(f"unsupported password hash method {method}")
+    defaults = _method_defaults[name]
+    if len(params) > len(defaults):
+        raise ValueError(f"too many parameters for {name}")
+    if name == "scrypt" and len(params) not in (0, len(defaults)):
+        raise ValueError("scrypt takes all of n, r and p, or none of them")
+    return ":".join((name, *params, *defaults[len(params) :]))
+
+
+class HasherBusy(Exception):
+    """Raised when too many passwords are already waiting to be hashed"""
+
+
+def _call(func, *args):
+    # the monotonic clock is shared by the processes on a host, so the parent
+    # can tell how long the call waited for a worker
+    return time.monotonic(), func(*args)
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords in a process pool, so that pbkdf2 does not
+    hold the request thread, or under gevent the whole worker. At most
+    max_pending calls may be queued or running at once; past that HasherBusy
+    is raised straight away rather than making the caller wait. How long
+    calls wait for a free process is kept, and reported by stats. With
+    max_workers set to 0, or where no pool can be started, as on AWS Lambda
+    which has no /dev/shm, passwords are hashed on the calling thread. If a
+    process in the pool dies, the calls waiting on it raise HasherBusy and
+    the next call starts a new pool.
+
+    New hashes use method, a werkzeug hash method such as
+    pbkdf2:sha256:600000 or scrypt:32768:8:1. Hashes made with other
+    methods or parameters still check, and needs_rehash picks them out.
+    """
+
+    # queue times above this many seconds are logged
+    slow_queue_time = 0.1
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_pending: int = 16,
+        method: str = default_hash_method,
+    ):
+        self.max_workers = max_workers
+        self.method = full_hash_method(method)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.rejected = 0
+        self.total_queue_time = 0.0
+        self.max_queue_time = 0.0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor | None:
+        # started on first use, like the icon processor's pool
+        with self._executor_lock:
+            if self._executor is None and self.max_workers:
+                try:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                except (OSError, NotImplementedError) as e:
+                    logger.warning(f"hashing passwords inline, no process pool: {e}")
+                    self.max_workers = 0
+            return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        logger.error("a password hashing process died, starting a new pool")
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _record(self, queue_time: float):
+        with self._stats_lock:
+            self.calls += 1
+            self.total_queue_time += queue_time
+            self.max_queue_time = max(self.max_queue_time, queue_time)
+        if queue_time > self.slow_queue_time:
+            logger.warning(f"password hash waited {queue_time * 1000:.0f}ms")
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            raise HasherBusy("too many passwords are being hashed")
+        try:
+            submitted = time.monotonic()
+            executor = self.executor
+            if executor is None:
+                started, result = _call(func, *args)
+            else:
+                try:
+                    started, result = executor.submit(_call, func, *args).result()
+                except BrokenProcessPool as e:
+                    self._discard(executor)
+                    raise HasherBusy("a password hashing process died") from e
+            self._record(started - submitted)
+            return result
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        """Raises HasherBusy if the pool is saturated"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash: str, password: str) -> bool:
+        """Raises HasherBusy if the pool is saturated"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Whether a hash was made with a method other than the current one"""
+        return password_hash.partition("$")[0] != self.method
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "calls": self.calls,
+                "rejected": self.rejected,
+                "meanQueueTime": self.total_queue_time / self.calls
+                if self.calls
+                else 0.0,
+                "maxQueueTime": self.max_queue_time,
+            }
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
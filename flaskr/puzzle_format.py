@@ -0,0 +1,241 @@
+"""
+A compact binary encoding of puzzle JSON.
+
+The JSON repeats the same keys for every clue and clue box, and usually holds
+the same clues twice, under "clues" and "_clues". The binary form keeps every
+string once in a string table, and packs clues and clue boxes into arrays of
+32 bit little endian integers that refer to it:
+
+    header     magic, flags, gridSize and the counts of everything below
+    strings    the byte length of each string, then their UTF-8 bytes
+    clues      key, clue, clueName and number of boxes of each clue
+    boxes      first, second and third of each clue box
+
+The clues of "clues" come first, then those of "_clues", unless the flags say
+that "_clues" is the same as "clues". Decoding gives back a puzzle equal to
+the one encoded, with its clues in the same order.
+"""
+import struct
+import sys
+from array import array
+
+binary_puzzle_mimetype = "application/vnd.crossword.puzzle"
+
+_magic = b"PZB1"
+# magic, flags, gridSize, strings, string bytes, clues, private clues, boxes
+_header = struct.Struct("<4sBiIIIII")
+_private_clues_shared = 0x01
+_clue_keys = ("clue", "clueBoxes", "clueName")
+_clue_box_keys = ("first", "second", "third")
+_int32_range = range(-(2**31), 2**31)
+
+# array has no fixed byte order or item size, so both are checked here
+assert array("i").itemsize == 4 and array("I").itemsize == 4
+_swap_bytes = sys.byteorder == "big"
+
+
+def _to_bytes(values: array) -> bytes:
+    if _swap_bytes:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode: str, data: memoryview) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if _swap_bytes:
+        values.byteswap()
+    return values
+
+
+def _is_int32(value) -> bool:
+    # bool is a subclass of int, but would come back as a number
+    return type(value) is int and value in _int32_range
+
+
+class _StringTable:
+    def __init__(self):
+        self.indexes: dict[str, int] = {}
+
+    def index(self, value) -> int:
+        if type(value) is not str:
+            raise ValueError(f"expected a string, got {type(value).__name__}")
+        return self.indexes.setdefault(value, len(self.indexes))
+
+
+def _encode_clues(
+    clues, strings: _StringTable, clue_records: array, box_records: array
+):
+    if type(clues) is not dict:
+        raise ValueError("clues must be an object")
+    for key, clue in clues.items():
+        # uploads may list the keys in any order, decoding puts them in this one
+        if type(clue) is not dict or set(clue) != set(_clue_keys):
+            raise ValueError(f"clue {key} cannot be encoded")
+        clue_boxes = clue["clueBoxes"]
+        if type(clue_boxes) is not list:
+            raise ValueError(f"clue boxes of {key} cannot be encoded")
+        clue_records.extend(
+            (
+                strings.index(key),
+                strings.index(clue["clue"]),
+                strings.index(clue["clueName"]),
+                len(clue_boxes),
+            )
+        )
+        for clue_box in clue_boxes:
+            if (
+                type(clue_box) is not dict
+                or set(clue_box) != set(_clue_box_keys)
+                or not _is_int32(clue_box["first"])
+                or not _is_int32(clue_box["second"])
+            ):
+                raise ValueError(f"a clue box of {key} cannot be encoded")
+            box_records.extend(
+                (
+                    clue_box["first"],
+                    clue_box["second"],
+                    strings.index(clue_box["third"]),
+                )
+            )
+
+
+def encode_puzzle(puzzle: dict) -> bytes:
+    """
+    Encode a puzzle JSON. Raises ValueError for a puzzle that the binary form
+    cannot hold exactly, e.g. one with keys it does not know, so that it can
+    be sent as JSON instead.
+    """
+    if type(puzzle) is not dict or set(puzzle) != {"gridSize", "clues", "_clues"}:
+        raise ValueError("puzzle cannot be encoded")
+    if not _is_int32(puzzle["gridSize"]):
+        raise ValueError("gridSize cannot be encoded")
+
+    strings = _StringTable()
+    clue_records = array("I")
+    box_records = array("i")
+    _encode_clues(puzzle["clues"], strings, clue_records, box_records)
+    public_clues = len(clue_records) // 4
+    flags = 0
+    if puzzle["_clues"] == puzzle["clues"]:
+        flags |= _private_clues_shared
+    else:
+        _encode_clues(puzzle["_clues"], strings, clue_records, box_records)
+
+    encoded_strings = [value.encode("UTF-8") for value in strings.indexes]
+    string_bytes = b"".join(encoded_strings)
+    header = _header.pack(
+        _magic,
+        flags,
+        puzzle["gridSize"],
+        len(encoded_strings),
+        len(string_bytes),
+        public_clues,
+        len(clue_records) // 4 - public_clues,
+        len(box_records) // 3,
+    )
+    return b"".join(
+        (
+            header,
+            _to_bytes(array("I", map(len, encoded_strings))),
+            string_bytes,
+            _to_bytes(clue_records),
+            _to_bytes(box_records),
+        )
+    )
+
+
+def _decode_strings(lengths: array, data: memoryview) -> list[str]:
+    strings = []
+    start = 0
+    for length in lengths:
+        strings.append(str(data[start : start + length], "UTF-8"))
+        start += length
+    if start != len(data):
+        raise ValueError("encoded puzzle has the wrong length")
+    return strings
+
+
+def _decode_clues(
+    strings: list[str],
+    clue_records: array,
+    box_records: array,
+    clue_indexes: range,
+    box: int,
+) -> tuple[dict, int]:
+    # returns the clues and the index of the box after their last one
+    clues = {}
+    for i in clue_indexes:
+        key, clue, clue_name, boxes = clue_records[i * 4 : i * 4 + 4]
+        end = box + boxes
+        if end * 3 > len(box_records):
+            raise IndexError("clue box out of range")
+        clues[strings[key]] = {
+            "clue": strings[clue],
+            "clueBoxes": [
+                {
+                    "first": box_records[j * 3],
+                    "second": box_records[j * 3 + 1],
+                    "third": strings[box_records[j * 3 + 2]],
+                }
+                for j in range(box, end)
+            ],
+            "clueName": strings[clue_name],
+        }
+        box = end
+    return clues, box
+
+
+def decode_puzzle(data: bytes) -> dict:
+    """Decode a puzzle encoded by encode_puzzle. Raises ValueError if invalid."""
+    data = memoryview(data)
+    try:
+        (
+            magic,
+            flags,
+            grid_size,
+            string_count,
+            string_bytes,
+            public_clues,
+            private_clues,
+            box_count,
+        ) = _header.unpack_from(data)
+    except struct.error as e:
+        raise ValueError("not an encoded puzzle") from e
+    if magic != _magic:
+        raise ValueError("not an encoded puzzle")
+    clue_count = public_clues + private_clues
+    sizes = (string_count * 4, string_bytes, clue_count * 16, box_count * 12)
+    if len(data) != _header.size + sum(sizes):
+        raise ValueError("encoded puzzle has the wrong length")
+
+    offset = _header.size
+    sections = []
+    for size in sizes:
+        sections.append(data[offset : offset + size])
+        offset += size
+    lengths = _from_bytes("I", sections[0])
+    clue_records = _from_bytes("I", sections[2])
+    box_records = _from_bytes("i", sections[3])
+
+    strings = _decode_strings(lengths, sections[1])
+
+    try:
+        public, box = _decode_clues(
+            strings, clue_records, box_records, range(public_clues), 0
+        )
+        if flags & _private_clues_shared:
+            # decoded again, so that changing one does not change the other
+            private, _ = _decode_clues(
+                strings, clue_records, box_records, range(public_clues), 0
+            )
+        else:
+            private, box = _decode_clues(
+                strings, clue_records, box_records, range(public_clues, clue_count), box
+            )
+    except IndexError as e:
+        raise ValueError("encoded puzzle refers to a missing string or box") from e
+    if box != box_count:
+        raise ValueError("encoded puzzle has unused clue boxes")
+    return {"_clues": private, "clues": public, "gridSize": grid_size}
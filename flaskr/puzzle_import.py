@@ -0,0 +1,232 @@
+import json
+import logging
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import IO
+
+from botocore.exceptions import ClientError
+
+from flaskr.cloud.database import PuzzleDatabase
+from flaskr.cloud.storage import CloudStorage, UploadedFile
+from flaskr.file_validation import load_puzzle_json
+from flaskr.images import IconProcessor, can_resize_images, check_icon, fit_png
+
+logger = logging.getLogger(__name__)
+
+
+def read_archive(
+    file: IO[bytes],
+    max_file_size: int,
+    max_total_size: int | None = None,
+    max_puzzles: int | None = None,
+) -> dict[str, dict]:
+    """
+    Read a zip laid out like a /puzzles/batch download, with a directory per
+    puzzle holding {id}.png, {id}.json and meta_data.json. Returns the files
+    of each puzzle keyed by id, then by "icon", "puzzle" and "metaData". Other
+    files, such as manifest.json, are ignored. A file larger than
+    max_file_size is left unread and stored as None. Raises ValueError if the
+    archive holds more than max_puzzles puzzles, or its files would inflate to
+    more than max_total_size bytes.
+    """
+    puzzles = {}
+    with zipfile.ZipFile(file) as zf:
+        parts = []
+        total_size = 0
+        for info in zf.infolist():
+            puzzle_id, _, file_name = info.filename.partition("/")
+            part = {
+                f"{puzzle_id}.png": "icon",
+                f"{puzzle_id}.json": "puzzle",
+                "meta_data.json": "metaData",
+            }.get(file_name)
+            if part is None:
+                continue
+            files = puzzles.setdefault(puzzle_id, {})
+            if max_puzzles is not None and len(puzzles) > max_puzzles:
+                raise ValueError(f"archive holds more than {max_puzzles} puzzles")
+            if info.file_size > max_file_size:
+                files[part] = None
+                continue
+            total_size += info.file_size
+            if max_total_size is not None and total_size > max_total_size:
+                raise ValueError(
+                    f"archive inflates to more than {max_total_size} bytes"
+                )
+            parts.append((files, part, info))
+        # everything is checked against the sizes in the zip directory before
+        # anything is inflated, and zipfile reads no more than those sizes
+        for files, part, info in parts:
+            files[part] = zf.read(info)
+    return puzzles
+
+
+def validate_puzzle(
+    puzzle_id: str, files: dict, max_image_size: int
+) -> tuple[dict | None, bytes | None, str | None]:
+    """
+    Check the files of one puzzle from an archive. Returns its times created
+    and last modified, its icon if it had to be shrunk to fit max_image_size,
+    and an error message if it is invalid. Runs in a worker process, so it
+    takes and returns only plain values.
+    """
+    icon = None
+    try:
+        missing = [part for part in ("icon", "puzzle", "metaData") if part not in files]
+        if missing:
+            raise ValueError(f"missing {', '.join(missing)}")
+        too_large = [part for part, data in files.items() if data is None]
+        if too_large:
+            raise ValueError(f"{', '.join(too_large)} too large")
+        check_icon(files["icon"], IconProcessor.max_dimension)
+        if len(files["icon"]) > max_image_size:
+            if not can_resize_images():
+                raise ValueError(
+                    f"Thumbnail ({len(files['icon'])}) exceeds maximum "
+                    f"upload size ({max_image_size})"
+                )
+            icon = fit_png(files["icon"], max_image_size)
+        load_puzzle_json(files["puzzle"])
+        meta_data = json.loads(files["metaData"])
+        times = {
+            "timeCreated": meta_data["timeCreated"],
+            "lastModified": meta_data["lastModified"],
+        }
+        PuzzleDatabase.check_puzzle_meta_data(
+            puzzle_id,
+            "puzzle.json",
+            times["timeCreated"],
+            times["lastModified"],
+            "icon.png",
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return None, None, str(e)
+    return times, icon, None
+
+
+class PuzzleImporter:
+    """
+    Imports an archive of puzzles. The puzzles are validated, and oversized
+    icons shrunk, in a pool of max_validation_workers processes. Their files
+    are stored with at most max_upload_concurrency uploads in flight, and the
+    metadata is written with BatchWriteItem. A puzzle that fails any stage is
+    reported and left out, without stopping the others. Bundles are not
+    built, search builds each one the first time it is needed.
+    """
+
+    # each import starts its own pool, so a few concurrent imports must not
+    # start a process per core each
+    max_validation_workers = 2
+    max_upload_concurrency = 8
+    # archives are read into memory, so their size is bounded
+    max_archive_puzzles = 1000
+    max_archive_size = 100 * 1024 * 1024
+
+    def __init__(self, cloud_storage: CloudStorage, puzzle_database: PuzzleDatabase):
+        self.cloud_storage = cloud_storage
+        self.puzzle_database = puzzle_database
+
+    def _validate(self, puzzles: dict[str, dict]) -> dict[str, tuple]:
+        if not puzzles:
+            return {}
+        workers = min(self.max_validation_workers, len(puzzles))
+        # a few chunks per worker keeps them busy without pickling each
+        # puzzle as a separate task
+        chunk_size = max(1, len(puzzles) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                validate_puzzle,
+                puzzles.keys(),
+                puzzles.values(),
+                repeat(self.cloud_storage.max_thumbnail_size),
+                chunksize=chunk_size,
+            )
+            return dict(zip(puzzles.keys(), results))
+
+    def _upload(self, uploads: list[UploadedFile]) -> dict[str, bool | None]:
+        # returns whether each key was created, or None if it failed
+        results = {}
+        with ThreadPoolExecutor(
+            max_workers=self.max_upload_concurrency, thread_name_prefix="s3-import"
+        ) as pool:
+            futures = {
+                upload.key: pool.submit(self.cloud_storage.upload_file, upload)
+                for upload in uploads
+            }
+            for key, future in futures.items():
+                try:
+                    results[key] = future.result()
+                except ClientError as e:
+                    logger.error(f"could not store {key}: {e}")
+                    results[key] = None
+        return results
+
+    def import_archive(self, file: IO[bytes]) -> dict:
+        """
+        Import the puzzles in a zip. Raises zipfile.BadZipFile if the file is
+        not a zip, or ValueError if it is too large. Returns a report of what
+        was imported and what failed.
+        """
+        start = time.perf_counter()
+        max_file_size = max(
+            self.cloud_storage.image_upload_limit,
+            self.cloud_storage.max_puzzle_json_size,
+        )
+        puzzles = read_archive(
+            file, max_file_size, self.max_archive_size, self.max_archive_puzzles
+        )
+        failed = {}
+
+        items = {}
+        uploads = {}
+        for puzzle_id, (times, icon, error) in self._validate(puzzles).items():
+            if error is not None:
+                failed[puzzle_id] = error
+                continue
+            image = UploadedFile(f"{puzzle_id}.png", icon or puzzles[puzzle_id]["icon"])
+            puzzle_json = UploadedFile(
+                f"{puzzle_id}.json", puzzles[puzzle_id]["puzzle"]
+            )
+            # identical files in the archive are uploaded once
+            uploads.setdefault(image.key, image)
+            uploads.setdefault(puzzle_json.key, puzzle_json)
+            items[puzzle_id] = {
+                "id": puzzle_id,
+                "puzzle": puzzle_json.key,
+                "icon": image.key,
+                **times,
+            }
+
+        stored = self._upload(list(uploads.values()))
+        for puzzle_id, item in list(items.items()):
+            if None in (stored[key] for key in (item["icon"], item["puzzle"])):
+                failed[puzzle_id] = "could not store its files"
+                del items[puzzle_id]
+
+        if items:
+            try:
+                self.puzzle_database.upload_puzzle_meta_data_batch(list(items.values()))
+            except ClientError as e:
+                logger.error(f"could not write the imported puzzles: {e}")
+                for puzzle_id in items:
+                    failed[puzzle_id] = "could not write its metadata"
+                items = {}
+
+        seconds = time.perf_counter() - start
+        report = {
+            "imported": len(items),
+            "failed": [
+                {"id": puzzle_id, "error": error} for puzzle_id, error in failed.items()
+            ],
+            "objectsUploaded": sum(1 for created in stored.values() if created),
+            "objectsSkipped": sum(1 for created in stored.values() if created is False),
+            "seconds": round(seconds, 3),
+            "puzzlesPerSecond": round(len(items) / seconds, 1) if seconds else 0,
+        }
+        logger.info(
+            f"imported {report['imported']} puzzles in {report['seconds']}s, "
+            f"{len(failed)} failed"
+        )
+        return report
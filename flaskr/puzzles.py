@@ -1,27 +1,59 @@
-import json
+import uuid
 import zipfile
+from datetime import datetime
 from io import BytesIO
+from typing import Callable
 
+import click
 from botocore.exceptions import ClientError
-from flask import Blueprint, current_app, send_file, request
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    make_response,
+    redirect,
+    request,
+    send_file,
+    url_for,
+)
 
 from flaskr.auth import token_required
+from flaskr.bundle import (
+    build_bundle,
+    bundle_etag,
+    parse_last_modified,
+    stream_batch,
+    stream_bundle,
+)
+from flaskr.cloud.database import DatabaseBusy
+from flaskr.cloud.storage import FileDownloadError, is_missing
+from flaskr.images import ResizeFailed, icon_formats, icon_mimetypes
+from flaskr.puzzle_format import binary_puzzle_mimetype
+from flaskr.puzzle_import import PuzzleImporter
+from flaskr.upload import PuzzleUploader, UploadError
 
 bp = Blueprint("puzzles", __name__, url_prefix="/puzzles")
 
-# TODO: simplify search
+max_batch_size = 100
+# zip sends the puzzle bundle, url returns presigned S3 urls for its parts and
+# redirect sends the client to a presigned url for the bundle
+search_modes = ("zip", "url", "redirect")
+# a puzzle is sent as JSON unless the client prefers the binary form
+puzzle_mimetypes = ("application/json", binary_puzzle_mimetype)
 
 
-# flake8: noqa: C901
 @bp.route("/search", methods=["GET", "POST"])
 @token_required
 def search():
-    puzzle_id = None
-
     if request.method == "POST":
-        puzzle_id = request.json.get("id")
-    elif request.method == "GET":
-        puzzle_id = request.args.get("id")
+        params = request.json
+    else:
+        params = request.args
+    puzzle_id = params.get("id")
+    mode = params.get("mode", "zip")
+    if mode not in search_modes:
+        return f"mode must be one of {', '.join(search_modes)}", 400
 
     # puzzle_id = f'{puzzle_id}'
     try:
@@ -34,42 +66,413 @@ def search():
         return "No resource found", 404
 
     current_app.logger.info(puzzle["id"])
-    puzzle_image_id = puzzle["icon"]
-    puzzle_json_id = puzzle["puzzle"]
+    if mode != "zip":
+        return _send_presigned(puzzle, mode, params)
+    if current_app.config["STREAM_BUNDLES"]:
+        send_zip = _stream_bundle
+    else:
+        send_zip = _send_bundle
+    return _send_revalidated(
+        puzzle, bundle_etag(puzzle), lambda: make_response(send_zip(puzzle))
+    )
+
+
+def _send_presigned(puzzle: dict, mode: str, params) -> Response:
+    # the presigned url of a bundle that is missing would be refused by S3
+    error = _ensure_bundle(puzzle)
+    if error is not None:
+        return error
+    if mode == "url":
+        response = _presigned_urls(puzzle, params)
+        if response.status_code != 200:
+            return response
+    else:
+        response = redirect(current_app.cloud_storage.presigned_bundle_url(puzzle))
+    # the presigned urls expire, so these responses must not be reused
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def _presigned_urls(puzzle: dict, params) -> Response:
+    # signing is done locally, so this makes no requests to S3, unless an icon
+    # variant is asked for that has not been made yet. The bundle must exist.
+    cloud_storage = current_app.cloud_storage
+    icon_size = params.get("iconSize")
+    if icon_size is not None:
+        image_format = _icon_format(params.get("iconFormat"))
+        if image_format is None:
+            return make_response("iconFormat must be png or webp", 400)
+        icon_size = _positive_int(icon_size)
+        if icon_size is None:
+            return make_response("iconSize must be a positive number of pixels", 400)
+    if not icon_formats():
+        # without Pillow there are no variants, only the uploaded icon
+        icon_size = None
+    if icon_size is not None:
+        try:
+            icon_url = cloud_storage.icon_variant_url(
+                puzzle["icon"], cloud_storage.icon_size_for(icon_size), image_format
+            )
+        except (ClientError, ValueError, ResizeFailed) as e:
+            return _icon_error(puzzle, e)
+    else:
+        icon_url = cloud_storage.presigned_url(puzzle["icon"])
+    return jsonify(
+        {
+            "metaData": dict(puzzle),
+            "icon": icon_url,
+            "puzzle": cloud_storage.presigned_url(puzzle["puzzle"]),
+            "bundle": cloud_storage.presigned_bundle_url(puzzle),
+            "expiresIn": cloud_storage.presigned_url_expiry,
+        }
+    )
+
+
+def _is_not_modified(etag: str, last_modified: datetime | None) -> bool:
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def _send_bundle(puzzle: dict):
+    path = current_app.cloud_storage.cached_bundle_path(puzzle)
+    if path is not None:
+        # lets the server use sendfile for the bundle
+        try:
+            return send_file(
+                path, download_name="puzzle.zip", mimetype="application/zip", etag=False
+            )
+        except FileNotFoundError:
+            current_app.logger.info(f"cached bundle for {puzzle['id']} was evicted")
+
     try:
-        puzzle_image = current_app.cloud_storage.download_image(puzzle_image_id)
+        bundle = current_app.cloud_storage.download_bundle(puzzle)
     except ClientError:
-        return f"Could not locate {puzzle_image_id}", 404
+        current_app.logger.info(f"no bundle for {puzzle['id']}, rebuilding it")
+        try:
+            bundle_bytes = _build_bundle(puzzle)
+        except FileDownloadError as e:
+            return f"Could not locate {e.file_name}", 404
+        _store_bundle(puzzle, bundle_bytes)
+        bundle = BytesIO(bundle_bytes)
+
+    return send_file(bundle, download_name="puzzle.zip", mimetype="application/zip")
+
+
+def _build_bundle(puzzle: dict) -> bytes:
+    """Raises FileDownloadError if the icon or puzzle is missing"""
+    puzzle_image, puzzle_json = current_app.cloud_storage.download_puzzle_files(
+        puzzle["icon"], puzzle["puzzle"]
+    )
+    current_app.logger.info("got files")
+    return build_bundle(
+        puzzle["id"], puzzle_image.getvalue(), puzzle_json.getvalue(), puzzle
+    )
+
+
+def _ensure_bundle(puzzle: dict) -> Response | None:
+    # puzzles uploaded before bundles were stored, and imported puzzles, have
+    # none until one is built. Returns an error response if it cannot be.
+    cloud_storage = current_app.cloud_storage
     try:
-        puzzle_json = current_app.cloud_storage.download_puzzle_json(puzzle_json_id)
+        if cloud_storage.bundle_exists(puzzle):
+            return None
     except ClientError:
-        return f"Could not locate {puzzle_json_id}", 404
+        return make_response("Storage Client error", 500)
+    current_app.logger.info(f"no bundle for {puzzle['id']}, building it")
+    try:
+        bundle = _build_bundle(puzzle)
+    except FileDownloadError as e:
+        return make_response(f"Could not locate {e.file_name}", 404)
+    try:
+        cloud_storage.upload_bundle(puzzle, bundle)
+    except ClientError:
+        return make_response("Could not store the puzzle bundle", 500)
+    return None
 
-    files = [
-        (f"{puzzle_id}.png", puzzle_image),
-        (f"{puzzle_id}.json", puzzle_json),
-    ]
 
-    current_app.logger.info("got files")
+def _stream_bundle(puzzle: dict):
+    # No Content-Length is set, so the server sends the zip with chunked
+    # transfer encoding as the S3 bodies arrive.
+    try:
+        chunks = current_app.cloud_storage.open_bundle(puzzle)
+    except ClientError:
+        current_app.logger.info(f"no bundle for {puzzle['id']}, streaming a new one")
+        try:
+            puzzle_image, puzzle_json = current_app.cloud_storage.open_puzzle_files(
+                puzzle["icon"], puzzle["puzzle"]
+            )
+        except FileDownloadError as e:
+            return f"Could not locate {e.file_name}", 404
+        chunks = stream_bundle(puzzle["id"], puzzle_image, puzzle_json, puzzle)
+        _store_bundle_later(puzzle)
 
-    memory_file = BytesIO()
-    with zipfile.ZipFile(memory_file, "w") as zf:
-        for individualFile in files:
-            current_app.logger.info(f"zipping {individualFile[0]}")
-            with individualFile[1] as f:
-                zf.writestr(individualFile[0], f.read())
-        zf.writestr("meta_data.json", json.dumps(dict(puzzle)))
-    memory_file.seek(0)
-    return send_file(
-        memory_file, download_name="puzzle.zip", mimetype="application/zip"
+    return Response(
+        chunks,
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=puzzle.zip"},
     )
 
 
+def _store_bundle_later(puzzle: dict):
+    # builds the bundle again on the storage executor, so later requests find
+    # it stored. The task runs outside the app context, and downloads the files
+    # one after the other rather than submitting them to its own pool.
+    cloud_storage = current_app.cloud_storage
+    logger = current_app.logger
+
+    def build_and_store():
+        try:
+            bundle = build_bundle(
+                puzzle["id"],
+                cloud_storage.download_image(puzzle["icon"]).getvalue(),
+                cloud_storage.download_puzzle_json(puzzle["puzzle"]).getvalue(),
+                puzzle,
+            )
+            cloud_storage.upload_bundle(puzzle, bundle)
+        except (ClientError, ValueError) as e:
+            logger.warning(f"could not store bundle for {puzzle['id']}: {e}")
+
+    cloud_storage.executor.submit(build_and_store)
+
+
+@bp.route("/puzzle", methods=["GET"])
+@token_required
+def puzzle_document():
+    if request.accept_mimetypes:
+        mimetype = request.accept_mimetypes.best_match(puzzle_mimetypes)
+    else:
+        mimetype = "application/json"
+    if mimetype is None:
+        return f"Accept must allow one of {', '.join(puzzle_mimetypes)}", 406
+
+    try:
+        puzzle = current_app.puzzle_database.get_puzzle_meta_data(
+            request.args.get("id")
+        )
+    except KeyError:
+        return "Puzzle not found", 404
+    except ClientError:
+        return "Database Client error", 500
+
+    response = _send_revalidated(
+        puzzle,
+        f"{bundle_etag(puzzle)}-{puzzle_mimetypes.index(mimetype)}",
+        lambda: _send_puzzle_document(puzzle, mimetype),
+    )
+    # the body depends on the Accept header, so caches must key on it
+    response.vary.add("Accept")
+    return response
+
+
+def _send_revalidated(
+    puzzle: dict, etag: str, send: Callable[[], Response]
+) -> Response:
+    last_modified = parse_last_modified(puzzle["lastModified"])
+    if _is_not_modified(etag, last_modified):
+        response = Response(status=304)
+    else:
+        response = send()
+    if response.status_code in (200, 304):
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # clients may keep the response, but must revalidate it before using it
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _send_puzzle_document(puzzle: dict, mimetype: str) -> Response:
+    cloud_storage = current_app.cloud_storage
+    try:
+        if mimetype == binary_puzzle_mimetype:
+            try:
+                data = cloud_storage.download_puzzle_binary(puzzle["puzzle"])
+            except ValueError as e:
+                current_app.logger.warning(f"cannot encode {puzzle['id']}: {e}")
+                if not request.accept_mimetypes.best_match(["application/json"]):
+                    return make_response("Puzzle has no binary form", 406)
+                mimetype = "application/json"
+                data = cloud_storage.download_puzzle_json(puzzle["puzzle"]).getvalue()
+        else:
+            data = cloud_storage.download_puzzle_json(puzzle["puzzle"]).getvalue()
+    except ClientError:
+        return make_response(f"Could not locate {puzzle['puzzle']}", 404)
+    return Response(data, mimetype=mimetype)
+
+
+def _icon_format(requested: str | None) -> str | None:
+    # a format in the query wins over the Accept header, and png is sent when
+    # webp cannot be made
+    if requested is not None:
+        if requested not in icon_mimetypes:
+            return None
+        return requested if requested in icon_formats() else "png"
+    if not request.accept_mimetypes:
+        return "png"
+    # */* and image/* do not mean that a client can decode webp
+    if "webp" in icon_formats() and "image/webp" in request.accept_mimetypes.values():
+        offered = ["image/webp", "image/png"]
+    else:
+        offered = ["image/png"]
+    mimetype = request.accept_mimetypes.best_match(offered)
+    if mimetype is None:
+        return None
+    return mimetype.partition("/")[2]
+
+
+@bp.route("/icon", methods=["GET"])
+@token_required
+def icon():
+    size = request.args.get("size", type=int)
+    if size is not None and size <= 0:
+        return "size must be a positive number of pixels", 400
+    image_format = _icon_format(request.args.get("format"))
+    if image_format is None:
+        return "Icons are available as image/png or image/webp", 406
+    if not icon_formats():
+        # without Pillow there are no variants, only the uploaded icon
+        size = None
+    elif size is not None:
+        size = current_app.cloud_storage.icon_size_for(size)
+    if size is None:
+        image_format = "png"
+
+    try:
+        puzzle = current_app.puzzle_database.get_puzzle_meta_data(
+            request.args.get("id")
+        )
+    except KeyError:
+        return "Puzzle not found", 404
+    except ClientError:
+        return "Database Client error", 500
+
+    response = _send_revalidated(
+        puzzle,
+        f"{bundle_etag(puzzle)}-{size or 'original'}-{image_format}",
+        lambda: _send_icon(puzzle, size, image_format),
+    )
+    response.vary.add("Accept")
+    return response
+
+
+def _send_icon(puzzle: dict, size: int | None, image_format: str) -> Response:
+    cloud_storage = current_app.cloud_storage
+    try:
+        if size is None:
+            data = cloud_storage.download_image(puzzle["icon"]).getvalue()
+        else:
+            data = cloud_storage.download_icon_variant(
+                puzzle["icon"], size, image_format
+            )
+    except (ClientError, ValueError, ResizeFailed) as e:
+        return _icon_error(puzzle, e)
+    return Response(data, mimetype=icon_mimetypes[image_format])
+
+
+def _positive_int(value) -> int | None:
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def _icon_error(puzzle: dict, error: Exception) -> Response:
+    """The response for an icon, or variant of it, that could not be read or made"""
+    if isinstance(error, ResizeFailed):
+        return make_response(_resize_failed_response())
+    if isinstance(error, ValueError):
+        current_app.logger.warning(f"cannot resize icon of {puzzle['id']}: {error}")
+        return make_response("Icon cannot be resized", 500)
+    if is_missing(error):
+        return make_response(f"Could not locate {puzzle['icon']}", 404)
+    current_app.logger.error(error)
+    return make_response(f"Could not read {puzzle['icon']}", 500)
+
+
+@bp.route("/preview", methods=["GET"])
+@token_required
+def grid_preview():
+    try:
+        puzzle = current_app.puzzle_database.get_puzzle_meta_data(
+            request.args.get("id")
+        )
+    except KeyError:
+        return "Puzzle not found", 404
+    except ClientError:
+        return "Database Client error", 500
+
+    return _send_revalidated(
+        puzzle, f"{bundle_etag(puzzle)}-preview", lambda: _send_grid_preview(puzzle)
+    )
+
+
+def _send_grid_preview(puzzle: dict) -> Response:
+    try:
+        data = current_app.cloud_storage.download_grid_preview(puzzle["puzzle"])
+    except ClientError:
+        return make_response(f"Could not locate {puzzle['puzzle']}", 404)
+    except ValueError as e:
+        current_app.logger.warning(f"cannot draw the grid of {puzzle['id']}: {e}")
+        return make_response("Puzzle grid cannot be drawn", 500)
+    return Response(data, mimetype="image/png")
+
+
+@bp.route("/batch", methods=["POST"])
+@token_required
+def batch():
+    puzzle_ids = request.json.get("ids")
+    if not isinstance(puzzle_ids, list) or not all(
+        isinstance(puzzle_id, str) for puzzle_id in puzzle_ids
+    ):
+        return "ids must be a list of strings", 400
+    if len(puzzle_ids) > max_batch_size:
+        return f"Too many ids, the maximum is {max_batch_size}", 400
+    puzzle_ids = list(dict.fromkeys(puzzle_ids))
+
+    try:
+        puzzles = current_app.puzzle_database.get_puzzle_meta_data_batch(puzzle_ids)
+    except ClientError:
+        return "Database Client error", 500
+    except DatabaseBusy:
+        return "Database busy, try again shortly", 503, {"Retry-After": "1"}
+
+    file_names = [
+        file_name
+        for puzzle_id in puzzle_ids
+        if puzzle_id in puzzles
+        for file_name in (puzzles[puzzle_id]["icon"], puzzles[puzzle_id]["puzzle"])
+    ]
+    files = current_app.cloud_storage.download_file_batch(file_names)
+
+    return Response(
+        stream_batch(puzzle_ids, puzzles, files),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=puzzles.zip"},
+    )
+
+
+def _store_bundle(puzzle: dict, bundle: bytes):
+    try:
+        current_app.cloud_storage.upload_bundle(puzzle, bundle)
+    except ClientError as e:
+        # the bundle is only a cache, search rebuilds it if it is missing
+        current_app.logger.warning(f"could not store bundle for {puzzle['id']}")
+        current_app.logger.exception(e)
+
+
+def _resize_failed_response():
+    return "Could not resize the icon, try again shortly", 503, {"Retry-After": "1"}
+
+
 @bp.route("/upload", methods=["POST"])
 @token_required
 def upload():
     puzzle_file = request.files["puzzle"]
-    image_file = request.files["image"]
+    # without an icon, a preview of the grid is used instead
+    image_file = request.files.get("image")
     puzzle_id = request.form.get("id")
     time_created = request.form.get("timeCreated")
     last_modified = request.form.get("lastModified")
@@ -79,18 +482,173 @@ def upload():
     current_app.logger.info(last_modified)
 
     try:
-        current_app.cloud_storage.upload_image(image_file)
-        current_app.cloud_storage.upload_puzzle_json(puzzle_file)
-        current_app.puzzle_database.upload_puzzle_meta_data(
-            puzzle_id,
-            puzzle_file.filename,
-            time_created,
-            last_modified,
-            image_file.filename,
-        )
-        current_app.logger.info(f"uploaded {puzzle_id}")
-        return "OK", 200
+        puzzle_json = current_app.cloud_storage.read_puzzle_json(puzzle_file)
+        if image_file is None:
+            image = current_app.cloud_storage.grid_preview_image(puzzle_json)
+        else:
+            image = current_app.cloud_storage.read_image(image_file)
+    except (ValueError, KeyError) as e:
+        current_app.logger.info(e)
+        return f"Invalid puzzle upload: {e}", 400
+    except ResizeFailed:
+        return _resize_failed_response()
 
-    except ClientError as e:
+    uploader = PuzzleUploader(current_app.cloud_storage, current_app.puzzle_database)
+    return _run_upload(
+        uploader,
+        lambda: uploader.upload(
+            puzzle_id, time_created, last_modified, image, puzzle_json
+        ),
+    )
+
+
+def _run_upload(uploader: PuzzleUploader, store: Callable[[], None]) -> Response:
+    try:
+        store()
+    except (TypeError, ValueError) as e:
+        current_app.logger.info(e)
+        return make_response(f"Invalid puzzle upload: {e}", 400)
+    except UploadError as e:
         current_app.logger.exception(e)
-        return 500
+        return make_response("Could not store the puzzle", 500)
+
+    response = make_response("OK", 200)
+    response.headers["Server-Timing"] = uploader.server_timing()
+    return response
+
+
+@bp.route("/upload/jobs", methods=["POST"])
+@token_required
+def queue_upload():
+    upload_queue = current_app.upload_queue
+    if upload_queue is None:
+        return "Queued uploads are not enabled", 404
+    try:
+        job = upload_queue.enqueue(
+            request.form.get("id"),
+            request.form.get("timeCreated"),
+            request.form.get("lastModified"),
+            request.files.get("image"),
+            request.files.get("puzzle"),
+        )
+    except (TypeError, ValueError) as e:
+        current_app.logger.info(e)
+        return f"Invalid puzzle upload: {e}", 400
+
+    response = make_response(jsonify(job), 202)
+    response.headers["Location"] = url_for(".upload_job", job_id=job["id"])
+    return response
+
+
+@bp.route("/upload/jobs/<job_id>", methods=["GET"])
+@token_required
+def upload_job(job_id):
+    upload_queue = current_app.upload_queue
+    if upload_queue is None:
+        return "Queued uploads are not enabled", 404
+    try:
+        job = upload_queue.status(job_id)
+    except KeyError:
+        return "Upload job not found", 404
+    response = jsonify(job)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@bp.route("/upload/start", methods=["POST"])
+@token_required
+def start_upload():
+    # the client posts the icon and JSON straight to S3 with these, then calls
+    # /upload/complete with the upload id
+    upload_id = uuid.uuid4().hex
+    return jsonify(
+        {
+            "uploadId": upload_id,
+            **current_app.cloud_storage.presigned_puzzle_upload(upload_id),
+            "expiresIn": current_app.cloud_storage.presigned_url_expiry,
+        }
+    )
+
+
+@bp.route("/upload/complete", methods=["POST"])
+@token_required
+def complete_upload():
+    upload_id = request.json.get("uploadId")
+    puzzle_id = request.json.get("id")
+    time_created = request.json.get("timeCreated")
+    last_modified = request.json.get("lastModified")
+
+    try:
+        upload_id = uuid.UUID(hex=upload_id).hex
+    except (AttributeError, TypeError, ValueError):
+        return "Invalid upload id", 400
+
+    cloud_storage = current_app.cloud_storage
+    try:
+        image, puzzle_json = cloud_storage.read_staged_puzzle_files(upload_id)
+    except FileDownloadError as e:
+        return f"Could not locate {e.file_name}", 404
+    except ResizeFailed:
+        # the staged files are kept, so the client can complete it again
+        return _resize_failed_response()
+    except (ValueError, KeyError) as e:
+        current_app.logger.info(e)
+        _delete_staged_upload(upload_id)
+        return f"Invalid puzzle upload: {e}", 400
+
+    uploader = PuzzleUploader(cloud_storage, current_app.puzzle_database)
+    return _run_upload(
+        uploader,
+        lambda: uploader.complete(
+            puzzle_id, time_created, last_modified, image, puzzle_json
+        ),
+    )
+
+
+def _delete_staged_upload(upload_id: str):
+    cloud_storage = current_app.cloud_storage
+    for file_name in cloud_storage.staged_upload_keys(upload_id):
+        try:
+            cloud_storage.delete_file(file_name)
+        except ClientError:
+            current_app.logger.warning(f"could not delete {file_name}")
+
+
+@bp.route("/import", methods=["POST"])
+@token_required
+def import_puzzles():
+    archive = request.files.get("archive")
+    if archive is None:
+        return "archive is required", 400
+    importer = PuzzleImporter(current_app.cloud_storage, current_app.puzzle_database)
+    try:
+        report = importer.import_archive(archive.stream)
+    except zipfile.BadZipFile:
+        return "archive must be a zip file", 400
+    except ValueError as e:
+        return f"Archive too large: {e}", 413
+    return jsonify(report)
+
+
+@bp.cli.command("import")
+@click.argument("archive", type=click.Path(exists=True, dir_okay=False))
+def import_command(archive):
+    """Import the puzzles in a zip laid out like a /puzzles/batch download."""
+    importer = PuzzleImporter(current_app.cloud_storage, current_app.puzzle_database)
+    try:
+        with open(archive, "rb") as f:
+            report = importer.import_archive(f)
+    except zipfile.BadZipFile:
+        raise click.BadParameter("not a zip file", param_hint="ARCHIVE")
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="ARCHIVE")
+    click.echo(
+        f"Imported {report['imported']} puzzles in {report['seconds']}s "
+        f"({report['puzzlesPerSecond']} puzzles/s), uploaded "
+        f"{report['objectsUploaded']} files and skipped "
+        f"{report['objectsSkipped']} already stored"
+    )
+    for failure in report["failed"]:
+        click.echo(f"Failed {failure['id']}: {failure['error']}", err=True)
+    if report["failed"]:
+        raise click.exceptions.Exit(1)
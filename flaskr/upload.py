@@ -0,0 +1,164 @@
+import logging
+import time
+from typing import Callable
+
+from botocore.exceptions import ClientError
+
+from flaskr.bundle import build_bundle
+from flaskr.cloud.database import PuzzleDatabase
+from flaskr.cloud.storage import CloudStorage, UploadedFile
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """
+    Raised when a stage of a puzzle upload fails. The objects the upload had
+    already stored are left in place.
+    """
+
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(f"upload failed at {stage}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class PuzzleUploader:
+    """
+    Stores a puzzle's icon and JSON in S3 concurrently, and writes its metadata
+    only after both have been stored, so the slowest call rather than the sum
+    of them sets the upload time. Files are stored under their content hash,
+    and the metadata refers to them by it. If a stage fails, the objects
+    already stored are kept. A concurrent upload of the same content may have
+    found them and skipped storing its own, and an unreferenced object is
+    harmless since it never changes. The duration of each stage is kept in
+    timings.
+    """
+
+    def __init__(self, cloud_storage: CloudStorage, puzzle_database: PuzzleDatabase):
+        self.cloud_storage = cloud_storage
+        self.puzzle_database = puzzle_database
+        self.timings: dict[str, float] = {}
+
+    def _timed(self, stage: str, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.timings[stage] = time.perf_counter() - start
+
+    def _check_meta_data(
+        self,
+        puzzle_id: str,
+        time_created: str,
+        last_modified: str,
+        image: UploadedFile,
+        puzzle_json: UploadedFile,
+    ):
+        self.puzzle_database.check_puzzle_meta_data(
+            puzzle_id, puzzle_json.key, time_created, last_modified, image.key
+        )
+
+    def _store_files(
+        self, store: Callable[[UploadedFile], bool], *uploads: UploadedFile
+    ):
+        futures = {
+            stage: self.cloud_storage.executor.submit(self._timed, stage, store, upload)
+            for stage, upload in zip(("image", "puzzle"), uploads)
+        }
+        failure = None
+        # every future is waited for, so no store is still running on failure
+        for stage, future in futures.items():
+            try:
+                future.result()
+            except ClientError as e:
+                failure = failure or UploadError(stage, e)
+        if failure is not None:
+            raise failure
+
+    def upload(
+        self,
+        puzzle_id: str,
+        time_created: str,
+        last_modified: str,
+        image: UploadedFile,
+        puzzle_json: UploadedFile,
+    ) -> dict:
+        start = time.perf_counter()
+        self._check_meta_data(
+            puzzle_id, time_created, last_modified, image, puzzle_json
+        )
+        self._store_files(self.cloud_storage.upload_file, image, puzzle_json)
+        return self._store_puzzle(
+            puzzle_id, time_created, last_modified, image, puzzle_json, start
+        )
+
+    def complete(
+        self,
+        puzzle_id: str,
+        time_created: str,
+        last_modified: str,
+        image: UploadedFile,
+        puzzle_json: UploadedFile,
+    ) -> dict:
+        """
+        Finish an upload whose icon and JSON a client stored in S3 with a
+        presigned post, by moving them to their content hash keys and writing
+        the metadata and bundle.
+        """
+        start = time.perf_counter()
+        self._check_meta_data(
+            puzzle_id, time_created, last_modified, image, puzzle_json
+        )
+        self._store_files(self.cloud_storage.store_staged_file, image, puzzle_json)
+        return self._store_puzzle(
+            puzzle_id, time_created, last_modified, image, puzzle_json, start
+        )
+
+    def _store_puzzle(
+        self,
+        puzzle_id: str,
+        time_created: str,
+        last_modified: str,
+        image: UploadedFile,
+        puzzle_json: UploadedFile,
+        start: float,
+    ) -> dict:
+        try:
+            puzzle = self._timed(
+                "metaData",
+                self.puzzle_database.upload_puzzle_meta_data,
+                puzzle_id,
+                puzzle_json.key,
+                time_created,
+                last_modified,
+                image.key,
+            )
+        except ClientError as e:
+            raise UploadError("metaData", e) from e
+
+        bundle = build_bundle(puzzle_id, image.data, puzzle_json.data, puzzle)
+        try:
+            self._timed(
+                "bundle",
+                self.cloud_storage.upload_bundle,
+                puzzle,
+                bundle,
+            )
+        except ClientError as e:
+            # the bundle is only a cache, search rebuilds it if it is missing
+            logger.warning(f"could not store bundle for {puzzle_id}: {e}")
+
+        self.timings["total"] = time.perf_counter() - start
+        logger.info(
+            f"uploaded {puzzle_id} in "
+            + ", ".join(f"{stage} {dur:.3f}s" for stage, dur in self.timings.items())
+        )
+        return puzzle
+
+    def server_timing(self) -> str:
+        """The timings as the value of a Server-Timing header"""
+        return ", ".join(
+            f"{stage};dur={seconds * 1000:.1f}"
+            for stage, seconds in self.timings.items()
+        )
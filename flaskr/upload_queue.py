@@ -0,0 +1,250 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO
+
+from werkzeug.datastructures import FileStorage
+
+from flaskr.cloud.database import PuzzleDatabase
+from flaskr.cloud.storage import CloudStorage, UploadedFile
+from flaskr.images import ResizeFailed
+from flaskr.upload import PuzzleUploader, UploadError
+
+logger = logging.getLogger(__name__)
+
+pending_states = ("queued", "running", "retrying")
+
+
+class UploadQueue:
+    """
+    Runs puzzle uploads in the background. The parts of each upload are
+    spooled to a directory of its own under spool_dir, next to a status file
+    that any worker process on the host can read, and at most max_workers
+    uploads run at once. An upload whose files or metadata cannot be stored
+    is retried up to max_attempts times, waiting retry_delay seconds, doubled
+    after each attempt, while an invalid upload fails straight away.
+
+    Pending jobs survive a restart, recover runs them again. Several
+    processes may share a spool, so a job is claimed with an flock on its
+    lock file before it runs, and a job claimed by another process is
+    skipped. The kernel drops the claim of a process that dies, so its jobs
+    can be recovered by the next one.
+    """
+
+    status_file_name = "status.json"
+    image_file_name = "icon.png"
+    puzzle_file_name = "puzzle.json"
+    lock_file_name = ".lock"
+    # finished jobs are reported for this many seconds
+    job_ttl = 24 * 60 * 60
+
+    def __init__(
+        self,
+        cloud_storage: CloudStorage,
+        puzzle_database: PuzzleDatabase,
+        spool_dir: str | os.PathLike,
+        max_workers: int = 4,
+        max_attempts: int = 3,
+        retry_delay: float = 1.0,
+    ):
+        self.cloud_storage = cloud_storage
+        self.puzzle_database = puzzle_database
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="upload-job"
+        )
+
+    def _job_dir(self, job_id: str) -> Path:
+        # the id comes from a url, so it must not name any other path
+        try:
+            if str(uuid.UUID(job_id)) != job_id:
+                raise ValueError(job_id)
+        except (AttributeError, TypeError, ValueError):
+            raise KeyError(job_id) from None
+        return self.spool_dir.joinpath(job_id)
+
+    def _write_status(self, status: dict):
+        path = self._job_dir(status["id"]).joinpath(self.status_file_name)
+        # written whole and then renamed, so a reader never sees half of it
+        temp_path = path.with_name(f".{self.status_file_name}.{threading.get_ident()}")
+        temp_path.write_text(json.dumps(status))
+        os.replace(temp_path, path)
+
+    def _update(self, status: dict, state: str, error: str | None = None):
+        status.update(status=state, error=error, updated=time.time())
+        self._write_status(status)
+
+    def status(self, job_id: str) -> dict:
+        """The status of a job. Raises KeyError if there is no such job."""
+        try:
+            text = self._job_dir(job_id).joinpath(self.status_file_name).read_text()
+        except FileNotFoundError:
+            raise KeyError(job_id) from None
+        return json.loads(text)
+
+    def enqueue(
+        self,
+        puzzle_id: str,
+        time_created: str,
+        last_modified: str,
+        image: FileStorage | None,
+        puzzle_json: FileStorage | None,
+    ) -> dict:
+        """
+        Spool an upload and queue it. Only the metadata and file types are
+        checked here, the files themselves are checked by the job. Without an
+        image, the job uses a preview of the grid. Raises TypeError or
+        ValueError if the upload is invalid. Returns the status of the new
+        job.
+        """
+        if puzzle_json is None:
+            raise ValueError("an upload needs a puzzle")
+        PuzzleDatabase.check_puzzle_meta_data(
+            puzzle_id,
+            puzzle_json.filename,
+            time_created,
+            last_modified,
+            self.image_file_name if image is None else image.filename,
+        )
+        job_id = str(uuid.uuid4())
+        job_dir = self._job_dir(job_id)
+        job_dir.mkdir()
+        if image is not None:
+            image.save(job_dir.joinpath(self.image_file_name))
+        puzzle_json.save(job_dir.joinpath(self.puzzle_file_name))
+        status = {
+            "id": job_id,
+            "puzzleId": puzzle_id,
+            "timeCreated": time_created,
+            "lastModified": last_modified,
+            "attempts": 0,
+            "submitted": time.time(),
+        }
+        # the status file is written last, so a job without one is incomplete
+        self._update(status, "queued")
+        self.executor.submit(self._run, job_id)
+        return status
+
+    def _read_files(self, job_id: str) -> tuple[UploadedFile, UploadedFile]:
+        job_dir = self._job_dir(job_id)
+        puzzle_json = UploadedFile(
+            self.puzzle_file_name,
+            job_dir.joinpath(self.puzzle_file_name).read_bytes(),
+        )
+        image_path = job_dir.joinpath(self.image_file_name)
+        image = None
+        if image_path.exists():
+            image = UploadedFile(self.image_file_name, image_path.read_bytes())
+        return self.cloud_storage.prepare_puzzle_files(image, puzzle_json)
+
+    def _claim(self, job_id: str) -> IO | None:
+        # the lock is held until the returned file is closed
+        try:
+            lock = open(self._job_dir(job_id).joinpath(self.lock_file_name), "a")
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def _run(self, job_id: str):
+        lock = self._claim(job_id)
+        if lock is None:
+            logger.info(f"upload job {job_id} is claimed by another worker")
+            return
+        try:
+            # it may have finished while the claim was held elsewhere
+            status = self.status(job_id)
+            if status["status"] in pending_states:
+                self._attempt(status)
+        finally:
+            lock.close()
+
+    def _attempt(self, status: dict):
+        job_id = status["id"]
+        status["attempts"] += 1
+        self._update(status, "running")
+        uploader = PuzzleUploader(self.cloud_storage, self.puzzle_database)
+        try:
+            image, puzzle_json = self._read_files(job_id)
+            uploader.upload(
+                status["puzzleId"],
+                status["timeCreated"],
+                status["lastModified"],
+                image,
+                puzzle_json,
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            logger.info(f"upload job {job_id} is invalid: {e}")
+            self._finish(status, "failed", f"Invalid puzzle upload: {e}")
+        except UploadError as e:
+            self._retry(status, e)
+        except ResizeFailed as e:
+            self._retry(status, UploadError("image", e))
+        except Exception as e:
+            # the job must not be left running forever
+            logger.exception(e)
+            self._finish(status, "failed", "Could not store the puzzle")
+        else:
+            status["timings"] = {
+                stage: round(seconds * 1000, 1)
+                for stage, seconds in uploader.timings.items()
+            }
+            self._finish(status, "succeeded")
+
+    def _retry(self, status: dict, error: UploadError):
+        if status["attempts"] >= self.max_attempts:
+            logger.error(f"upload job {status['id']} failed: {error}")
+            self._finish(status, "failed", "Could not store the puzzle")
+            return
+        delay = self.retry_delay * 2 ** (status["attempts"] - 1)
+        logger.warning(f"upload job {status['id']} retrying in {delay}s: {error}")
+        self._update(status, "retrying", f"upload failed at {error.stage}")
+        # waits outside the pool, so a backlog of retries holds no workers
+        timer = threading.Timer(delay, self.executor.submit, (self._run, status["id"]))
+        timer.daemon = True
+        timer.start()
+
+    def _finish(self, status: dict, state: str, error: str | None = None):
+        self._update(status, state, error)
+        job_dir = self._job_dir(status["id"])
+        for file_name in (self.image_file_name, self.puzzle_file_name):
+            job_dir.joinpath(file_name).unlink(missing_ok=True)
+
+    def recover(self) -> int:
+        """
+        Queue the jobs left pending by a previous process, and delete those
+        that finished more than job_ttl seconds ago. Returns the number of
+        jobs queued.
+        """
+        expired = time.time() - self.job_ttl
+        queued = 0
+        for job_dir in self.spool_dir.iterdir():
+            try:
+                status = self.status(job_dir.name)
+            except KeyError:
+                # a job that was never queued, or not a job at all
+                if job_dir.is_dir() and job_dir.stat().st_mtime < expired:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                continue
+            if status["status"] in pending_states:
+                self.executor.submit(self._run, status["id"])
+                queued += 1
+            elif status["updated"] < expired:
+                shutil.rmtree(job_dir, ignore_errors=True)
+        if queued:
+            logger.info(f"recovered {queued} upload jobs")
+        return queued
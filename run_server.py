@@ -1,8 +1,11 @@
+import os
+
 from flaskr import EmailManager, CloudStorage, PuzzleDatabase, UserDatabase
 from flaskr import create_app
 
 email_manager = EmailManager()
-cloud_storage = CloudStorage()
+# S3 objects are cached on disk here when set, shared by all of the workers
+cloud_storage = CloudStorage(disk_cache_dir=os.environ.get("PUZZLE_DISK_CACHE_DIR"))
 database = PuzzleDatabase()
 user_database = UserDatabase()
 
@@ -1,4 +1,10 @@
+import json
 import os
+import random
+import struct
+import zipfile
+import zlib
+from io import BytesIO
 from pathlib import Path
 from typing import List, Tuple
 import logging
@@ -19,7 +25,7 @@ logger = logging.getLogger(__name__)
 
 
 @pytest.fixture()
-def app(fake_all_services):
+def app(fake_all_services, tmp_path):
     # We need to create the bucket since this is all in Moto's 'virtual' AWS account
     # conn.create_bucket(Bucket="jhb-crossword")
 
@@ -28,7 +34,17 @@ def app(fake_all_services):
     email_manager: EmailManager = fake_all_services[2]
     cloud_storage: CloudStorage = fake_all_services[3]
 
-    config = {"TESTING": True, "SECRET_KEY": "dev", "JWT_KEY": "iLoveCats"}
+    config = {
+        "TESTING": True,
+        "SECRET_KEY": "dev",
+        "JWT_KEY": "iLoveCats",
+        "PUZZLE_CACHE_SIZE": 128,
+        "UPLOAD_SPOOL_DIR": tmp_path.joinpath("uploads"),
+        "UPLOAD_RETRY_DELAY": 0.01,
+        # a pool for every app would leave processes behind after each test
+        "PASSWORD_HASH_WORKERS": 0,
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+    }
     app = create_app(
         email_manager=email_manager,
         cloud_storage=cloud_storage,
@@ -300,3 +316,58 @@ def new_user(fake_all_services):
 def delete_emails(messages):
     yield
     messages.clear()
+
+
+@pytest.fixture
+def make_archive(test_data_dir):
+    """Builds a zip of puzzles laid out like a /puzzles/batch download"""
+    image = test_data_dir.joinpath("test.png").read_bytes()
+    puzzle_json = test_data_dir.joinpath("test.json").read_bytes()
+
+    def make_archive(puzzle_ids, **overrides) -> BytesIO:
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            for puzzle_id in puzzle_ids:
+                files = {
+                    f"{puzzle_id}.png": image,
+                    f"{puzzle_id}.json": puzzle_json,
+                    "meta_data.json": json.dumps(
+                        {
+                            "id": puzzle_id,
+                            "timeCreated": "28/5/2023 12:35:36",
+                            "lastModified": "28/5/2023 13:35:36",
+                        }
+                    ),
+                }
+                files.update(overrides.get(puzzle_id, {}))
+                for file_name, data in files.items():
+                    if data is not None:
+                        zf.writestr(f"{puzzle_id}/{file_name}", data)
+            zf.writestr("manifest.json", "{}")
+        archive.seek(0)
+        return archive
+
+    return make_archive
+
+
+@pytest.fixture
+def make_png():
+    """Builds an RGB PNG of random pixels, which barely compresses"""
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(chunk_type + data)
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+    def make_png(width: int, height: int) -> bytes:
+        rng = random.Random(0)
+        rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+        return b"".join(
+            (
+                b"\x89PNG\r\n\x1a\n",
+                chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)),
+                chunk(b"IDAT", zlib.compress(rows)),
+                chunk(b"IEND", b""),
+            )
+        )
+
+    return make_png
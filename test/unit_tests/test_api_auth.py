@@ -2,9 +2,11 @@ import json
 import jwt
 
 import pytest
+from botocore.exceptions import ClientError
 from werkzeug.security import check_password_hash
 
 from flaskr.auth import verify_token
+from flaskr.passwords import PasswordHasher
 
 
 def test_register_new_user(flask_client, new_user):
@@ -26,7 +28,21 @@ def test_register_duplicate_users_text(flask_client, new_user):
     flask_client.post("/auth/register", json=new_user)
     response = flask_client.post("/auth/register", json=new_user)
 
-    assert response.text == "Issue registering"
+    assert response.text == "Username and email already registered"
+
+
+@pytest.mark.parametrize(
+    "changes,expected",
+    [
+        ({"email": "other@email.com"}, "Username already registered"),
+        ({"username": "other"}, "Email already registered"),
+    ],
+)
+def test_register_conflict_names_field(flask_client, new_user, changes, expected):
+    flask_client.post("/auth/register", json=new_user)
+    response = flask_client.post("/auth/register", json={**new_user, **changes})
+    assert response.status == "409 CONFLICT"
+    assert response.text == expected
 
 
 def test_register_user_empty_json(flask_client):
@@ -77,6 +93,24 @@ def test_register_invalid_emails(flask_client, test_input, new_user):
     assert response.status == "400 BAD REQUEST"
 
 
+def test_register_undeliverable_email(app, flask_client, new_user):
+    app.email_domain_checker.resolver.domains["addr.com"] = False
+    response = flask_client.post("/auth/register", json=new_user)
+
+    assert response.status == "400 BAD REQUEST"
+    assert response.text == "Email is not valid."
+
+
+def test_register_checks_fields_before_email_domain(app, flask_client, new_user):
+    del new_user["password"]
+    flask_client.post("/auth/register", json=new_user)
+    new_user["password"] = "pword"
+    new_user["email"] = "not an email"
+    flask_client.post("/auth/register", json=new_user)
+
+    assert app.email_domain_checker.resolver.lookups == []
+
+
 @pytest.mark.parametrize("test_input", [None, ""])
 def test_register_invalid_usernames(flask_client, test_input):
     user_json = {"username": test_input, "password": "pword", "email": "test@email.com"}
@@ -291,6 +325,33 @@ def test_post_reset_password_status_new_code(
     assert old_reset_code != new_reset_code
 
 
+def test_post_reset_password_update_fails(
+    app, flask_client, fake_crossword_user_databases, new_user, monkeypatch
+):
+    flask_client.post("/auth/register", json=new_user)
+    user = fake_crossword_user_databases.get_credentials_for_username(
+        new_user["username"]
+    )
+
+    def cancelled(*args):
+        raise ClientError(
+            {"Error": {"Code": "TransactionCanceledException"}}, "TransactWriteItems"
+        )
+
+    monkeypatch.setattr(app.user_database, "update_password", cancelled)
+    response = flask_client.post(
+        "/auth/resetPassword",
+        json={
+            "username": new_user["username"],
+            "password": "new_password",
+            "resetGuid": user["resetGuid"],
+        },
+    )
+
+    assert response.status == "500 INTERNAL SERVER ERROR"
+    assert response.text == "Error updating password"
+
+
 def test_post_reset_password_status_new_password(
     flask_client, fake_crossword_user_databases, new_user
 ):
@@ -369,3 +430,48 @@ def test_post_reset_invalid_reset_code(
     )
 
     assert response.status == "400 BAD REQUEST"
+
+
+def test_login_when_hasher_is_busy(app, flask_client, new_user):
+    flask_client.post("/auth/register", json=new_user)
+    app.password_hasher = PasswordHasher(max_workers=0, max_pending=0)
+    response = flask_client.post(
+        "/auth/login",
+        json={"username": new_user["username"], "password": new_user["password"]},
+    )
+    assert response.status == "503 SERVICE UNAVAILABLE"
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_login_rehashes_outdated_password(
+    app, flask_client, fake_crossword_user_databases, new_user
+):
+    def stored_user():
+        user_id = fake_crossword_user_databases.get_id_for_username("uname")
+        return fake_crossword_user_databases.get_user_data(user_id["Item"]["id"])[
+            "Item"
+        ]
+
+    flask_client.post("/auth/register", json=new_user)
+    old_user = stored_user()
+    app.password_hasher = PasswordHasher(max_workers=0, method="pbkdf2:sha256:2000")
+    credentials = {"username": "uname", "password": "pword"}
+    assert flask_client.post("/auth/login", json=credentials).status == "200 OK"
+    user = stored_user()
+    assert user["password"].startswith("pbkdf2:sha256:2000$")
+    assert check_password_hash(user["password"], "pword")
+    assert user["resetGuid"] == old_user["resetGuid"]
+
+    # a current hash is left alone
+    assert flask_client.post("/auth/login", json=credentials).status == "200 OK"
+    assert stored_user()["password"] == user["password"]
+
+
+def test_backfill_credentials_command(app, flask_client, new_user):
+    flask_client.post("/auth/register", json=new_user)
+    result = app.test_cli_runner().invoke(args=["auth", "backfill-credentials"])
+    assert result.exit_code == 0
+    assert (
+        "Copied the credentials of 0 users, 1 had them already, skipped 0"
+        in result.output
+    )
@@ -1,3 +1,6 @@
+from flaskr import CachedPuzzleDatabase
+
+
 def test_hello_text(flask_client):
     response = flask_client.get("/hello")
     assert response.text == "Hello, World!"
@@ -6,3 +9,8 @@ def test_hello_text(flask_client):
 def test_hello_status(flask_client):
     response = flask_client.get("/hello")
     assert response.status == "200 OK"
+
+
+def test_puzzle_cache_enabled_by_config(app):
+    assert isinstance(app.puzzle_database, CachedPuzzleDatabase)
+    assert app.puzzle_database.cache.max_size == 128
@@ -1,5 +1,20 @@
 import json
+import time
+import zipfile
+from io import BytesIO
+
 import pytest
+import requests
+from botocore.exceptions import ClientError
+
+from flaskr import images
+from flaskr.bundle import bundle_key
+from flaskr.cache import DiskBlobCache
+from flaskr.cloud.database import DatabaseBusy
+from flaskr.cloud.storage import UploadedFile
+from flaskr.images import ResizeFailed
+from flaskr.puzzle_format import binary_puzzle_mimetype, decode_puzzle
+from flaskr.puzzle_import import PuzzleImporter
 
 
 class TestPuzzleAPI:
@@ -146,3 +161,1083 @@ class TestPuzzleAPI:
         )
 
         assert response.status == "200 OK"
+
+    def test_upload_stores_bundle(
+        self, app, flask_client, test_data_dir, new_user, s3_backend
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        key = bundle_key(app.puzzle_database.get_puzzle_meta_data("123"))
+        assert key in s3_backend.get_bucket("jhb-crossword").keys
+
+    def test_search_rebuilds_missing_bundle(
+        self, app, flask_client, test_data_dir, new_user, s3_backend
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        key = bundle_key(app.puzzle_database.get_puzzle_meta_data("123"))
+        s3_backend.delete_object("jhb-crossword", key)
+        app.cloud_storage.blob_cache.clear()
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        with zipfile.ZipFile(BytesIO(response.data)) as zf:
+            names = zf.namelist()
+        assert names == ["123.png", "123.json", "meta_data.json"]
+        assert key in s3_backend.get_bucket("jhb-crossword").keys
+
+    def test_search_missing_puzzle_file(
+        self, app, flask_client, test_data_dir, new_user, s3_backend
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:37",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        s3_backend.delete_object(
+            "jhb-crossword", bundle_key(app.puzzle_database.get_puzzle_meta_data("123"))
+        )
+        json_key = UploadedFile(
+            "test.json", test_data_dir.joinpath("test.json").read_bytes()
+        ).key
+        s3_backend.delete_object("jhb-crossword", json_key)
+        app.cloud_storage.blob_cache.clear()
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status == "404 NOT FOUND"
+        assert response.text == f"Could not locate {json_key}"
+
+    @pytest.mark.parametrize("delete_bundle", [True, False])
+    def test_search_streamed_bundle(
+        self, app, flask_client, test_data_dir, new_user, s3_backend, delete_bundle
+    ):
+        app.config["STREAM_BUNDLES"] = True
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        if delete_bundle:
+            key = bundle_key(app.puzzle_database.get_puzzle_meta_data("123"))
+            s3_backend.delete_object("jhb-crossword", key)
+            app.cloud_storage.blob_cache.clear()
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.is_streamed
+        with zipfile.ZipFile(BytesIO(response.data)) as zf:
+            assert zf.read("123.png") == test_data_dir.joinpath("test.png").read_bytes()
+        # a bundle that was missing is stored in the background for the next request
+        puzzle = app.puzzle_database.get_puzzle_meta_data("123")
+        deadline = time.monotonic() + 5
+        while not app.cloud_storage.bundle_exists(puzzle):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    def test_search_sends_validators(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.headers["ETag"]
+        assert response.headers["Last-Modified"] == "Sun, 28 May 2023 13:35:36 GMT"
+
+    @pytest.mark.parametrize(
+        "conditional_headers",
+        [
+            lambda etag: {"If-None-Match": etag},
+            lambda etag: {"If-None-Match": f'"other", {etag}'},
+            lambda etag: {"If-Modified-Since": "Sun, 28 May 2023 13:35:36 GMT"},
+        ],
+    )
+    def test_search_not_modified(
+        self,
+        app,
+        flask_client,
+        test_data_dir,
+        new_user,
+        s3_backend,
+        conditional_headers,
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        etag = response.headers["ETag"]
+        # a 304 must not need anything from S3
+        s3_backend.delete_object(
+            "jhb-crossword", bundle_key(app.puzzle_database.get_puzzle_meta_data("123"))
+        )
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}", **conditional_headers(etag)},
+        )
+
+        assert response.status == "304 NOT MODIFIED"
+        assert response.headers["ETag"] == etag
+        assert response.data == b""
+
+    @pytest.mark.parametrize(
+        "conditional_headers",
+        [
+            {"If-None-Match": '"not the etag"'},
+            {"If-Modified-Since": "Sun, 28 May 2023 13:35:35 GMT"},
+        ],
+    )
+    def test_search_modified(
+        self, flask_client, test_data_dir, new_user, conditional_headers
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}", **conditional_headers},
+        )
+
+        assert response.status == "200 OK"
+
+    def test_batch_download(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        for puzzle_id in ["1", "2"]:
+            data = {
+                "id": puzzle_id,
+                "timeCreated": "28/5/2023 12:35:36",
+                "lastModified": "28/5/2023 13:35:36",
+                "image": (test_data_dir.joinpath("test.png")).open("rb"),
+                "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+            }
+            flask_client.post(
+                "/puzzles/upload",
+                data=data,
+                headers={"Authorization": f"Bearer {token}"},
+            )
+
+        response = flask_client.post(
+            "/puzzles/batch",
+            json={"ids": ["1", "missing", "2"]},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status == "200 OK"
+        with zipfile.ZipFile(BytesIO(response.data)) as zf:
+            manifest = json.loads(zf.read("manifest.json"))
+            assert (
+                zf.read("2/2.json") == test_data_dir.joinpath("test.json").read_bytes()
+            )
+        assert manifest == {"1": "ok", "missing": "not_found", "2": "ok"}
+
+    @pytest.mark.parametrize("test_input", [None, "1", [1], ["1"] * 101])
+    def test_batch_download_bad_ids(self, flask_client, new_user, test_input):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        response = flask_client.post(
+            "/puzzles/batch",
+            json={"ids": test_input},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status == "400 BAD REQUEST"
+
+    def test_batch_download_throttled(self, app, flask_client, new_user, monkeypatch):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        def throttled(puzzle_ids):
+            raise DatabaseBusy("Could not read all of the puzzles")
+
+        monkeypatch.setattr(
+            app.puzzle_database, "get_puzzle_meta_data_batch", throttled
+        )
+        response = flask_client.post(
+            "/puzzles/batch",
+            json={"ids": ["1"]},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status == "503 SERVICE UNAVAILABLE"
+        assert response.headers["Retry-After"] == "1"
+
+    def test_search_sends_bundle_from_disk_cache(
+        self, app, flask_client, test_data_dir, new_user, tmp_path, monkeypatch
+    ):
+        monkeypatch.setattr(
+            app.cloud_storage, "disk_cache", DiskBlobCache(tmp_path, 1024 * 1024)
+        )
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        path = app.cloud_storage.cached_bundle_path(
+            app.puzzle_database.get_puzzle_meta_data("123")
+        )
+        assert response.status == "200 OK"
+        assert response.data == path.read_bytes()
+        response.close()
+
+    def test_search_presigned_urls(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": ((test_data_dir.joinpath("test.png")).open("rb"), "test.png"),
+            "puzzle": ((test_data_dir.joinpath("test.json")).open("rb"), "test.json"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123", "mode": "url"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status == "200 OK"
+        assert response.headers["Cache-Control"] == "no-store"
+        assert response.json["metaData"]["id"] == "123"
+        puzzle_json = requests.get(response.json["puzzle"])
+        assert puzzle_json.content == test_data_dir.joinpath("test.json").read_bytes()
+        bundle = requests.get(response.json["bundle"])
+        with zipfile.ZipFile(BytesIO(bundle.content)) as zf:
+            assert zf.namelist() == ["123.png", "123.json", "meta_data.json"]
+
+    def test_search_redirect(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": ((test_data_dir.joinpath("test.png")).open("rb"), "test.png"),
+            "puzzle": ((test_data_dir.joinpath("test.json")).open("rb"), "test.json"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        response = flask_client.post(
+            "/puzzles/search",
+            json={"id": "123", "mode": "redirect"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status == "302 FOUND"
+        bundle = requests.get(response.headers["Location"])
+        assert bundle.status_code == 200
+        assert zipfile.is_zipfile(BytesIO(bundle.content))
+
+    @pytest.mark.parametrize("mode", ["redirect", "url"])
+    def test_search_presigned_bundle_is_rebuilt(
+        self, app, flask_client, test_data_dir, new_user, s3_backend, mode
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": ((test_data_dir.joinpath("test.png")).open("rb"), "test.png"),
+            "puzzle": ((test_data_dir.joinpath("test.json")).open("rb"), "test.json"),
+        }
+
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        key = bundle_key(app.puzzle_database.get_puzzle_meta_data("123"))
+        s3_backend.delete_object("jhb-crossword", key)
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123", "mode": mode},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        url = response.headers["Location"] if mode == "redirect" else None
+        bundle = requests.get(url or response.json["bundle"])
+        assert bundle.status_code == 200
+        assert zipfile.is_zipfile(BytesIO(bundle.content))
+
+    def test_search_bad_mode(self, flask_client, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123", "mode": "tar"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status == "400 BAD REQUEST"
+
+    def test_upload_server_timing(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        response = flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert "metaData;dur=" in response.headers["Server-Timing"]
+
+    def test_upload_resize_failed(
+        self, app, flask_client, test_data_dir, new_user, monkeypatch
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        def broken(data):
+            raise ResizeFailed("an icon resizing process died")
+
+        monkeypatch.setattr(app.cloud_storage.icon_processor, "normalize", broken)
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+
+        response = flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status == "503 SERVICE UNAVAILABLE"
+        assert response.headers["Retry-After"] == "1"
+
+    @pytest.mark.parametrize(
+        "image, puzzle",
+        [("test.png", "invalid_clue_data.json"), ("test.json", "test.json")],
+    )
+    def test_upload_invalid_puzzle(
+        self, flask_client, test_data_dir, new_user, image, puzzle
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+
+        token = json.loads(response.text)["token"]
+
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath(image)).open("rb"),
+            "puzzle": (test_data_dir.joinpath(puzzle)).open("rb"),
+        }
+
+        response = flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status == "400 BAD REQUEST"
+
+    def _presigned_upload(self, flask_client, token, image, puzzle):
+        response = flask_client.post(
+            "/puzzles/upload/start", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status == "200 OK"
+        for part, content in (("icon", image), ("puzzle", puzzle)):
+            post = response.json[part]
+            stored = requests.post(
+                post["url"], data=post["fields"], files={"file": content}
+            )
+            assert stored.status_code == 204
+        return response.json["uploadId"]
+
+    def test_presigned_upload(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        upload_id = self._presigned_upload(
+            flask_client,
+            token,
+            test_data_dir.joinpath("test.png").read_bytes(),
+            test_data_dir.joinpath("test.json").read_bytes(),
+        )
+
+        response = flask_client.post(
+            "/puzzles/upload/complete",
+            json={
+                "uploadId": upload_id,
+                "id": "123",
+                "timeCreated": "28/5/2023 12:35:36",
+                "lastModified": "28/5/2023 13:35:36",
+            },
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "200 OK"
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "200 OK"
+        with zipfile.ZipFile(BytesIO(response.data)) as zf:
+            assert (
+                zf.read("123.json") == test_data_dir.joinpath("test.json").read_bytes()
+            )
+
+    @pytest.mark.parametrize(
+        "image, puzzle",
+        [("test.png", "invalid_clue_data.json"), ("test.json", "test.json")],
+    )
+    def test_presigned_upload_invalid_files(
+        self, flask_client, test_data_dir, new_user, s3_backend, image, puzzle
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        upload_id = self._presigned_upload(
+            flask_client,
+            token,
+            test_data_dir.joinpath(image).read_bytes(),
+            test_data_dir.joinpath(puzzle).read_bytes(),
+        )
+
+        response = flask_client.post(
+            "/puzzles/upload/complete",
+            json={
+                "uploadId": upload_id,
+                "id": "123",
+                "timeCreated": "28/5/2023 12:35:36",
+                "lastModified": "28/5/2023 13:35:36",
+            },
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "400 BAD REQUEST"
+        keys = s3_backend.get_bucket("jhb-crossword").keys
+        assert not any(upload_id in key for key in keys)
+
+    @pytest.mark.parametrize("upload_id", [None, "../test.png", 1])
+    def test_complete_upload_invalid_id(self, flask_client, new_user, upload_id):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        response = flask_client.post(
+            "/puzzles/upload/complete",
+            json={"uploadId": upload_id, "id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "400 BAD REQUEST"
+
+    def test_complete_upload_missing_files(self, flask_client, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        response = flask_client.post(
+            "/puzzles/upload/complete",
+            json={"uploadId": "0" * 32, "id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "404 NOT FOUND"
+
+    def test_import(self, flask_client, new_user, make_archive):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        archive = make_archive(["1", "2"], **{"2": {"2.json": b"{}"}})
+
+        response = flask_client.post(
+            "/puzzles/import",
+            data={"archive": (archive, "puzzles.zip")},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status == "200 OK"
+        assert response.json["imported"] == 1
+        assert [failure["id"] for failure in response.json["failed"]] == ["2"]
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "1"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "200 OK"
+
+    def test_import_replaces_bundle(
+        self, flask_client, test_data_dir, new_user, make_archive
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        data = {
+            "id": "1",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": (test_data_dir.joinpath("test.png")).open("rb"),
+            "puzzle": (test_data_dir.joinpath("test.json")).open("rb"),
+        }
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        # the same lastModified, but different JSON
+        puzzle_json = json.dumps(
+            json.loads(test_data_dir.joinpath("test.json").read_bytes()), indent=2
+        ).encode()
+        flask_client.post(
+            "/puzzles/import",
+            data={
+                "archive": (
+                    make_archive(["1"], **{"1": {"1.json": puzzle_json}}),
+                    "a.zip",
+                )
+            },
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "1"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        with zipfile.ZipFile(BytesIO(response.data)) as zf:
+            assert zf.read("1.json") == puzzle_json
+
+    @pytest.mark.parametrize("data", [{}, {"archive": (BytesIO(b"x"), "a.zip")}])
+    def test_import_bad_archive(self, flask_client, new_user, data):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        response = flask_client.post(
+            "/puzzles/import",
+            data=data,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "400 BAD REQUEST"
+
+    def test_import_too_many_puzzles(
+        self, flask_client, new_user, make_archive, monkeypatch
+    ):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        monkeypatch.setattr(PuzzleImporter, "max_archive_puzzles", 1)
+        response = flask_client.post(
+            "/puzzles/import",
+            data={"archive": (make_archive(["1", "2"]), "puzzles.zip")},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "413 REQUEST ENTITY TOO LARGE"
+
+    def test_import_command(self, app, tmp_path, make_archive):
+        path = tmp_path.joinpath("puzzles.zip")
+        path.write_bytes(make_archive(["1", "2"]).getvalue())
+        result = app.test_cli_runner().invoke(args=["puzzles", "import", str(path)])
+        assert result.exit_code == 0
+        assert "Imported 2 puzzles" in result.output
+        assert app.puzzle_database.get_puzzle_meta_data("2")["id"] == "2"
+
+    def test_import_command_failures(self, app, tmp_path, make_archive):
+        path = tmp_path.joinpath("puzzles.zip")
+        archive = make_archive(["1"], **{"1": {"1.png": b"x"}})
+        path.write_bytes(archive.getvalue())
+        result = app.test_cli_runner().invoke(args=["puzzles", "import", str(path)])
+        assert result.exit_code == 1
+        assert "Failed 1" in result.output
+
+    def _upload_puzzle(self, flask_client, test_data_dir, new_user) -> str:
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": ((test_data_dir.joinpath("test.png")).open("rb"), "test.png"),
+            "puzzle": ((test_data_dir.joinpath("test.json")).open("rb"), "test.json"),
+        }
+        flask_client.post(
+            "/puzzles/upload", data=data, headers={"Authorization": f"Bearer {token}"}
+        )
+        return token
+
+    @pytest.mark.parametrize("accept", [None, "*/*", "application/json"])
+    def test_puzzle_json(self, flask_client, test_data_dir, new_user, accept):
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        headers = {"Authorization": f"Bearer {token}"}
+        if accept is not None:
+            headers["Accept"] = accept
+        response = flask_client.get(
+            "/puzzles/puzzle", query_string={"id": "123"}, headers=headers
+        )
+        assert response.status == "200 OK"
+        assert response.mimetype == "application/json"
+        assert response.data == test_data_dir.joinpath("test.json").read_bytes()
+        assert "Accept" in response.vary
+
+    def test_puzzle_binary(self, flask_client, test_data_dir, new_user):
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        response = flask_client.get(
+            "/puzzles/puzzle",
+            query_string={"id": "123"},
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Accept": f"application/json;q=0.5, {binary_puzzle_mimetype}",
+            },
+        )
+        assert response.status == "200 OK"
+        assert response.mimetype == binary_puzzle_mimetype
+        assert "Accept" in response.vary
+        puzzle = json.loads(test_data_dir.joinpath("test.json").read_bytes())
+        assert decode_puzzle(response.data) == puzzle
+
+    @pytest.mark.parametrize(
+        "accept,status",
+        [
+            (f"{binary_puzzle_mimetype}, application/json;q=0.5", "200 OK"),
+            (binary_puzzle_mimetype, "406 NOT ACCEPTABLE"),
+        ],
+    )
+    def test_puzzle_without_binary_form(
+        self, app, flask_client, test_data_dir, new_user, monkeypatch, accept, status
+    ):
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+
+        def cannot_encode(file_name):
+            raise ValueError("puzzle cannot be encoded")
+
+        monkeypatch.setattr(app.cloud_storage, "download_puzzle_binary", cannot_encode)
+        response = flask_client.get(
+            "/puzzles/puzzle",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}", "Accept": accept},
+        )
+        assert response.status == status
+        if status == "200 OK":
+            assert response.mimetype == "application/json"
+            assert response.data == test_data_dir.joinpath("test.json").read_bytes()
+
+    def test_puzzle_etag_depends_on_format(self, flask_client, test_data_dir, new_user):
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        etags = []
+        for accept in ("application/json", binary_puzzle_mimetype):
+            headers = {"Authorization": f"Bearer {token}", "Accept": accept}
+            response = flask_client.get(
+                "/puzzles/puzzle", query_string={"id": "123"}, headers=headers
+            )
+            etags.append(response.headers["ETag"])
+            response = flask_client.get(
+                "/puzzles/puzzle",
+                query_string={"id": "123"},
+                headers={**headers, "If-None-Match": response.headers["ETag"]},
+            )
+            assert response.status == "304 NOT MODIFIED"
+        assert etags[0] != etags[1]
+
+    def test_puzzle_not_acceptable(self, flask_client, test_data_dir, new_user):
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        response = flask_client.get(
+            "/puzzles/puzzle",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}", "Accept": "text/html"},
+        )
+        assert response.status == "406 NOT ACCEPTABLE"
+
+    def test_puzzle_not_found(self, flask_client, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        response = flask_client.get(
+            "/puzzles/puzzle",
+            query_string={"id": "missing"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "404 NOT FOUND"
+
+    @pytest.mark.parametrize(
+        "query,accept,expected",
+        [
+            ({"size": 100}, None, ("image/png", 128)),
+            ({"size": 100}, "image/webp,*/*;q=0.8", ("image/webp", 128)),
+            ({"size": 300, "format": "webp"}, "image/png", ("image/webp", 256)),
+            ({"size": 10}, "*/*", ("image/png", 64)),
+        ],
+    )
+    def test_icon_variant(
+        self, flask_client, test_data_dir, new_user, query, accept, expected
+    ):
+        Image = pytest.importorskip("PIL.Image")
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        headers = {"Authorization": f"Bearer {token}"}
+        if accept is not None:
+            headers["Accept"] = accept
+        response = flask_client.get(
+            "/puzzles/icon", query_string={"id": "123", **query}, headers=headers
+        )
+        assert response.status == "200 OK"
+        assert "Accept" in response.vary
+        with Image.open(BytesIO(response.data)) as image:
+            assert (response.mimetype, image.size[0]) == expected
+
+    def test_icon_original(self, flask_client, test_data_dir, new_user):
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        response = flask_client.get(
+            "/puzzles/icon",
+            query_string={"id": "123"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "200 OK"
+        assert response.data == test_data_dir.joinpath("test.png").read_bytes()
+
+    def test_icon_etag_depends_on_variant(self, flask_client, test_data_dir, new_user):
+        pytest.importorskip("PIL")
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        headers = {"Authorization": f"Bearer {token}"}
+        etags = set()
+        for query in ({}, {"size": 64}, {"size": 64, "format": "webp"}):
+            response = flask_client.get(
+                "/puzzles/icon", query_string={"id": "123", **query}, headers=headers
+            )
+            etags.add(response.headers["ETag"])
+            response = flask_client.get(
+                "/puzzles/icon",
+                query_string={"id": "123", **query},
+                headers={**headers, "If-None-Match": response.headers["ETag"]},
+            )
+            assert response.status == "304 NOT MODIFIED"
+        assert len(etags) == 3
+
+    def test_icon_without_pillow(
+        self, flask_client, test_data_dir, new_user, monkeypatch
+    ):
+        monkeypatch.setattr(images, "Image", None)
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        response = flask_client.get(
+            "/puzzles/icon",
+            query_string={"id": "123", "size": 64, "format": "webp"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "200 OK"
+        assert response.mimetype == "image/png"
+        assert response.data == test_data_dir.joinpath("test.png").read_bytes()
+
+    @pytest.mark.parametrize(
+        "query,accept,status",
+        [
+            ({"size": 0}, None, "400 BAD REQUEST"),
+            ({"format": "gif"}, None, "406 NOT ACCEPTABLE"),
+            ({}, "text/html", "406 NOT ACCEPTABLE"),
+        ],
+    )
+    def test_icon_bad_request(self, flask_client, new_user, query, accept, status):
+        response = flask_client.post("/auth/register", json=new_user)
+        token = json.loads(response.text)["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        if accept is not None:
+            headers["Accept"] = accept
+        response = flask_client.get(
+            "/puzzles/icon", query_string={"id": "123", **query}, headers=headers
+        )
+        assert response.status == status
+
+    def test_search_icon_variant_url(self, flask_client, test_data_dir, new_user):
+        pytest.importorskip("PIL")
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123", "mode": "url", "iconSize": 100},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "200 OK"
+        assert "/128.png" in response.json["icon"]
+
+    def test_search_icon_url_without_pillow(
+        self, app, flask_client, test_data_dir, new_user, monkeypatch
+    ):
+        monkeypatch.setattr(images, "Image", None)
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123", "mode": "url", "iconSize": 100},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "200 OK"
+        icon = app.puzzle_database.get_puzzle_meta_data("123")["icon"]
+        assert f"/{icon}?" in response.json["icon"]
+
+    def test_search_bad_icon_format(self, flask_client, test_data_dir, new_user):
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={
+                "id": "123",
+                "mode": "url",
+                "iconSize": 100,
+                "iconFormat": "gif",
+            },
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == "400 BAD REQUEST"
+
+    @pytest.mark.parametrize(
+        "code, status",
+        [("NoSuchKey", "404 NOT FOUND"), ("SlowDown", "500 INTERNAL SERVER ERROR")],
+    )
+    def test_search_icon_variant_url_source_error(
+        self, app, flask_client, test_data_dir, new_user, monkeypatch, code, status
+    ):
+        pytest.importorskip("PIL")
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+
+        def unreadable(file_name, size, image_format):
+            raise ClientError({"Error": {"Code": code}}, "GetObject")
+
+        # the variant may have been stored by another test
+        monkeypatch.setattr(app.cloud_storage, "icon_variant_url", unreadable)
+        response = flask_client.get(
+            "/puzzles/search",
+            query_string={"id": "123", "mode": "url", "iconSize": 100},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status == status
+
+    @pytest.mark.parametrize("mode", ["url", "icon"])
+    def test_icon_variant_resize_failed(
+        self, app, flask_client, test_data_dir, new_user, monkeypatch, mode
+    ):
+        pytest.importorskip("PIL")
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+
+        def broken(file_name, size, image_format):
+            raise ResizeFailed("an icon resizing process died")
+
+        monkeypatch.setattr(app.cloud_storage, "icon_variant_url", broken)
+        monkeypatch.setattr(app.cloud_storage, "download_icon_variant", broken)
+        headers = {"Authorization": f"Bearer {token}"}
+        if mode == "url":
+            response = flask_client.get(
+                "/puzzles/search",
+                query_string={"id": "123", "mode": "url", "iconSize": 100},
+                headers=headers,
+            )
+        else:
+            response = flask_client.get(
+                "/puzzles/icon",
+                query_string={"id": "123", "size": 100},
+                headers=headers,
+            )
+        assert response.status == "503 SERVICE UNAVAILABLE"
+        assert response.headers["Retry-After"] == "1"
+
+    def test_queued_upload(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+        headers = {"Authorization": f"Bearer {json.loads(response.text)['token']}"}
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": ((test_data_dir.joinpath("test.png")).open("rb"), "test.png"),
+            "puzzle": ((test_data_dir.joinpath("test.json")).open("rb"), "test.json"),
+        }
+        response = flask_client.post("/puzzles/upload/jobs", data=data, headers=headers)
+        assert response.status == "202 ACCEPTED"
+        location = response.headers["Location"]
+        assert location.endswith(f"/puzzles/upload/jobs/{response.json['id']}")
+
+        for _ in range(1000):
+            response = flask_client.get(location, headers=headers)
+            assert response.status == "200 OK"
+            if response.json["status"] in ("succeeded", "failed"):
+                break
+            time.sleep(0.01)
+        assert response.json["status"] == "succeeded"
+        assert response.headers["Cache-Control"] == "no-store"
+
+        response = flask_client.get(
+            "/puzzles/search", query_string={"id": "123"}, headers=headers
+        )
+        assert response.status == "200 OK"
+
+    def test_queued_upload_invalid(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+        headers = {"Authorization": f"Bearer {json.loads(response.text)['token']}"}
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "image": ((test_data_dir.joinpath("test.png")).open("rb"), "test.png"),
+        }
+        response = flask_client.post("/puzzles/upload/jobs", data=data, headers=headers)
+        assert response.status == "400 BAD REQUEST"
+
+    def test_upload_job_not_found(self, flask_client, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+        headers = {"Authorization": f"Bearer {json.loads(response.text)['token']}"}
+        response = flask_client.get("/puzzles/upload/jobs/missing", headers=headers)
+        assert response.status == "404 NOT FOUND"
+
+    def test_grid_preview(self, flask_client, test_data_dir, new_user):
+        token = self._upload_puzzle(flask_client, test_data_dir, new_user)
+        headers = {"Authorization": f"Bearer {token}"}
+        response = flask_client.get(
+            "/puzzles/preview", query_string={"id": "123"}, headers=headers
+        )
+        assert response.status == "200 OK"
+        assert response.mimetype == "image/png"
+        assert response.data.startswith(b"\x89PNG")
+        response = flask_client.get(
+            "/puzzles/preview",
+            query_string={"id": "123"},
+            headers={**headers, "If-None-Match": response.headers["ETag"]},
+        )
+        assert response.status == "304 NOT MODIFIED"
+
+    def test_upload_without_image(self, flask_client, test_data_dir, new_user):
+        response = flask_client.post("/auth/register", json=new_user)
+        headers = {"Authorization": f"Bearer {json.loads(response.text)['token']}"}
+        data = {
+            "id": "123",
+            "timeCreated": "28/5/2023 12:35:36",
+            "lastModified": "28/5/2023 13:35:36",
+            "puzzle": ((test_data_dir.joinpath("test.json")).open("rb"), "test.json"),
+        }
+        response = flask_client.post("/puzzles/upload", data=data, headers=headers)
+        assert response.status == "200 OK"
+        icon = flask_client.get(
+            "/puzzles/icon", query_string={"id": "123"}, headers=headers
+        )
+        preview = flask_client.get(
+            "/puzzles/preview", query_string={"id": "123"}, headers=headers
+        )
+        assert icon.data == preview.data
@@ -0,0 +1,128 @@
+import json
+import zipfile
+from datetime import datetime, timezone
+from io import BytesIO
+
+import pytest
+
+from flaskr.bundle import (
+    build_bundle,
+    bundle_etag,
+    bundle_key,
+    parse_last_modified,
+    stream_batch,
+    stream_bundle,
+)
+
+
+bundle_meta_data = {
+    "id": "123",
+    "lastModified": "28/5/2023 13:35:36",
+    "icon": "a.png",
+    "puzzle": "a.json",
+}
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"lastModified": "28/5/2023 13:35:37"},
+        {"icon": "b.png"},
+        {"puzzle": "b.json"},
+    ],
+)
+def test_bundle_key_changes_with_contents(changes):
+    assert bundle_key(bundle_meta_data) != bundle_key({**bundle_meta_data, **changes})
+
+
+def test_bundle_key_is_stable():
+    assert bundle_key(bundle_meta_data) == bundle_key(dict(bundle_meta_data))
+
+
+@pytest.mark.parametrize("puzzle_id", ["a/b", "../123", "12 3"])
+def test_bundle_key_escapes_puzzle_id(puzzle_id):
+    key = bundle_key({**bundle_meta_data, "id": puzzle_id})
+    assert key.count("/") == 2
+
+
+@pytest.mark.parametrize("test_input", [None, 1, True])
+def test_bundle_key_bad_id(test_input):
+    with pytest.raises(TypeError):
+        bundle_key({**bundle_meta_data, "id": test_input})
+
+
+def test_build_bundle_contents():
+    meta_data = {"id": "123", "lastModified": "28/5/2023 13:35:36"}
+    bundle = build_bundle("123", b"image", b"{}", meta_data)
+    with zipfile.ZipFile(BytesIO(bundle)) as zf:
+        assert zf.read("123.png") == b"image"
+        assert zf.read("123.json") == b"{}"
+        assert json.loads(zf.read("meta_data.json")) == meta_data
+
+
+def test_stream_bundle_matches_built_bundle():
+    meta_data = {"id": "123", "lastModified": "28/5/2023 13:35:36"}
+    chunks = stream_bundle("123", [b"ima", b"ge"], [b"{", b"}"], meta_data)
+    with zipfile.ZipFile(BytesIO(b"".join(chunks))) as zf:
+        assert zf.namelist() == ["123.png", "123.json", "meta_data.json"]
+        assert zf.read("123.png") == b"image"
+        assert zf.read("123.json") == b"{}"
+        assert json.loads(zf.read("meta_data.json")) == meta_data
+
+
+def test_stream_bundle_is_lazy():
+    def image_chunks():
+        yield b"image"
+        raise AssertionError("read too far")
+
+    chunks = stream_bundle("123", image_chunks(), [b"{}"], {})
+    assert next(chunks)
+
+
+def test_bundle_etag_changes_with_last_modified():
+    meta_data = {
+        "id": "123",
+        "lastModified": "28/5/2023 13:35:36",
+        "icon": "file.png",
+        "puzzle": "file.json",
+    }
+    etag = bundle_etag(meta_data)
+    meta_data["lastModified"] = "28/5/2023 13:35:37"
+    assert etag != bundle_etag(meta_data)
+
+
+@pytest.mark.parametrize(
+    "test_input, expected",
+    [
+        ("28/5/2023 13:35:36", datetime(2023, 5, 28, 13, 35, 36, tzinfo=timezone.utc)),
+        ("2/2/2 2:22 UTC+2", None),
+        (None, None),
+    ],
+)
+def test_parse_last_modified(test_input, expected):
+    assert parse_last_modified(test_input) == expected
+
+
+def test_stream_batch_manifest():
+    meta_data = {"a": {"id": "a"}, "b": {"id": "b"}}
+    files = iter(
+        [
+            ("a.png", BytesIO(b"image")),
+            ("a.json", BytesIO(b"{}")),
+            ("b.png", BytesIO(b"image")),
+            ("b.json", None),
+        ]
+    )
+    chunks = stream_batch(["a", "b", "c"], meta_data, files)
+    with zipfile.ZipFile(BytesIO(b"".join(chunks))) as zf:
+        assert zf.namelist() == [
+            "a/a.png",
+            "a/a.json",
+            "a/meta_data.json",
+            "manifest.json",
+        ]
+        assert json.loads(zf.read("manifest.json")) == {
+            "a": "ok",
+            "b": "missing_files",
+            "c": "not_found",
+        }
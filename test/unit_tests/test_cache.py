@@ -0,0 +1,197 @@
+import os
+
+import pytest
+
+from flaskr.cache import BlobCache, DiskBlobCache, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_get_missing_key(clock):
+    cache = TTLCache(2, 10, clock)
+    assert cache.get("a") is None
+    assert cache.misses == 1
+
+
+def test_get_cached_key(clock):
+    cache = TTLCache(2, 10, clock)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.hits == 1
+
+
+def test_entry_expires(clock):
+    cache = TTLCache(2, 10, clock)
+    cache.set("a", 1)
+    clock.time = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_entry_expires_after_its_own_ttl(clock):
+    cache = TTLCache(2, 10, clock)
+    cache.set("a", 1, ttl=2)
+    cache.set("b", 2)
+    clock.time = 2
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = TTLCache(2, 10, clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.evictions == 1
+
+
+def test_invalidate(clock):
+    cache = TTLCache(2, 10, clock)
+    cache.set("a", 1)
+    cache.invalidate("a")
+    cache.invalidate("b")
+    assert cache.get("a") is None
+
+
+def test_stats(clock):
+    cache = TTLCache(1, 10, clock)
+    cache.set("a", 1)
+    cache.set("b", 1)
+    cache.get("b")
+    cache.get("a")
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 1}
+
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        TTLCache(0, 10)
+
+
+def test_blob_cache_get_missing_key():
+    cache = BlobCache(10)
+    assert cache.get("a") is None
+    assert cache.misses == 1
+
+
+def test_blob_cache_returns_read_only_view():
+    cache = BlobCache(10)
+    cache.set("a", b"abc")
+    blob = cache.get("a")
+    assert isinstance(blob, memoryview)
+    assert blob.readonly
+    assert blob == b"abc"
+
+
+def test_blob_cache_shares_bytes():
+    cache = BlobCache(10)
+    data = b"abc"
+    cache.set("a", data)
+    assert cache.get("a").obj is data
+
+
+def test_blob_cache_evicts_by_size():
+    cache = BlobCache(10)
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    cache.get("a")
+    cache.set("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.size_bytes == 8
+    assert cache.evictions == 1
+
+
+def test_blob_cache_replace_updates_size():
+    cache = BlobCache(10)
+    cache.set("a", b"1234")
+    cache.set("a", b"12")
+    assert cache.size_bytes == 2
+    assert len(cache) == 1
+
+
+def test_blob_cache_skips_large_blobs():
+    cache = BlobCache(10, max_blob_bytes=3)
+    cache.set("a", b"1234")
+    assert cache.get("a") is None
+    assert cache.size_bytes == 0
+
+
+def test_blob_cache_invalidate():
+    cache = BlobCache(10)
+    cache.set("a", b"1234")
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.size_bytes == 0
+
+
+def test_blob_cache_negative_size():
+    with pytest.raises(ValueError):
+        BlobCache(-1)
+
+
+def test_disk_cache_round_trip(tmp_path):
+    cache = DiskBlobCache(tmp_path, 100)
+    cache.set("a.png", b"abc")
+    blob = cache.get("a.png")
+    assert blob == b"abc"
+    assert blob.readonly
+
+
+def test_disk_cache_empty_blob(tmp_path):
+    cache = DiskBlobCache(tmp_path, 100)
+    cache.set("a.png", b"")
+    assert cache.get("a.png") == b""
+
+
+def test_disk_cache_miss(tmp_path):
+    cache = DiskBlobCache(tmp_path, 100)
+    assert cache.get("a.png") is None
+    assert cache.get_path("a.png") is None
+    assert cache.misses == 2
+
+
+def test_disk_cache_is_shared(tmp_path):
+    DiskBlobCache(tmp_path, 100).set("a.png", b"abc")
+    assert DiskBlobCache(tmp_path, 100).get("a.png") == b"abc"
+
+
+def test_disk_cache_replace(tmp_path):
+    cache = DiskBlobCache(tmp_path, 100)
+    cache.set("a.png", b"abc")
+    cache.set("a.png", b"def")
+    assert cache.get("a.png") == b"def"
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskBlobCache(tmp_path, 10)
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    os.utime(cache.path("a"), (1, 1))
+    os.utime(cache.path("b"), (2, 2))
+    cache.set("c", b"1234")
+    assert cache.get("a") is None
+    assert cache.get("b") == b"1234"
+    assert cache.evictions == 1
+
+
+def test_disk_cache_invalidate(tmp_path):
+    cache = DiskBlobCache(tmp_path, 100)
+    cache.set("a", b"1234")
+    cache.invalidate("a")
+    cache.invalidate("b")
+    assert cache.get("a") is None
@@ -0,0 +1,97 @@
+import logging
+import time
+
+import dns.resolver
+import pytest
+
+from flaskr.email_domains import DnsResolver, EmailDomainChecker, StaticResolver
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+@pytest.fixture
+def resolver():
+    return StaticResolver({"nomail.com": False, "slow.com": None})
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def checker(resolver, clock):
+    return EmailDomainChecker(resolver, positive_ttl=60, negative_ttl=10, clock=clock)
+
+
+def test_domain_is_looked_up_once(checker, resolver):
+    assert checker.accepts_mail("a@Mail.com")
+    assert checker.accepts_mail("b@mail.com")
+    assert resolver.lookups == ["mail.com"]
+
+
+def test_positive_answer_expires(checker, resolver, clock):
+    checker.accepts_mail("a@mail.com")
+    clock.time = 59
+    checker.accepts_mail("a@mail.com")
+    clock.time = 60
+    checker.accepts_mail("a@mail.com")
+    assert resolver.lookups == ["mail.com", "mail.com"]
+
+
+def test_negative_answer_expires_sooner(checker, resolver, clock):
+    assert not checker.accepts_mail("a@nomail.com")
+    assert not checker.accepts_mail("a@nomail.com")
+    clock.time = 10
+    assert not checker.accepts_mail("a@nomail.com")
+    assert resolver.lookups == ["nomail.com", "nomail.com"]
+
+
+def test_unknown_answer_is_let_through_and_not_cached(checker, resolver):
+    assert checker.accepts_mail("a@slow.com")
+    assert checker.accepts_mail("a@slow.com")
+    assert resolver.lookups == ["slow.com", "slow.com"]
+    assert checker.stats()["unknown"] == 2
+
+
+def test_stats(checker):
+    checker.accepts_mail("a@mail.com")
+    checker.accepts_mail("a@mail.com")
+    checker.accepts_mail("a@mail.com")
+    checker.accepts_mail("a@nomail.com")
+    stats = checker.stats()
+    assert stats["domains"] == 2
+    assert (stats["hits"], stats["misses"], stats["lookups"]) == (2, 2, 2)
+    assert stats["hitRatio"] == 0.5
+    assert 0 <= stats["meanLookupTime"] <= stats["maxLookupTime"]
+
+
+def test_stats_are_logged_for_cached_checks(checker, caplog):
+    checker.report_every = 3
+    with caplog.at_level(logging.INFO, logger="flaskr.email_domains"):
+        for _ in range(3):
+            checker.accepts_mail("a@mail.com")
+    assert "hitRatio" in caplog.text
+
+
+def test_dns_lookups_share_one_timeout(monkeypatch):
+    resolver = DnsResolver(timeout=1.0)
+    lifetimes = []
+
+    def resolve(domain, record_type, lifetime):
+        lifetimes.append(lifetime)
+        if record_type == "MX":
+            time.sleep(0.2)
+            raise dns.resolver.NoAnswer()
+        raise dns.resolver.LifetimeTimeout(timeout=lifetime, errors={})
+
+    monkeypatch.setattr(resolver.resolver, "resolve", resolve)
+    assert resolver.accepts_mail("slow.com") is None
+    assert lifetimes[0] == 1.0
+    assert lifetimes[1] <= 0.8
@@ -1,6 +1,6 @@
 import pytest
 
-from flaskr.file_validation import get_file_extension
+from flaskr.file_validation import check_png_signature, get_file_extension
 
 
 @pytest.mark.parametrize(
@@ -32,3 +32,13 @@ def test_invalid_filename(test_input):
 )
 def test_valid_filename(test_input, file_ext):
     assert get_file_extension(test_input) == file_ext
+
+
+def test_check_png_signature(test_data_dir):
+    check_png_signature(test_data_dir.joinpath("test.png").read_bytes())
+
+
+@pytest.mark.parametrize("test_input", [b"", b"\x89PNG", b'{"gridSize": 1}'])
+def test_invalid_png_signature(test_input):
+    with pytest.raises(ValueError):
+        check_png_signature(test_input)
@@ -0,0 +1,69 @@
+import json
+import zlib
+
+import pytest
+
+from flaskr.grid_preview import grid_squares, max_grid_size, render_grid_preview
+from flaskr.images import png_dimensions
+
+
+def puzzle(grid_size: int, boxes: list[tuple[int, int]]) -> dict:
+    clues = {
+        "1a": {
+            "clue": "Clue (1)",
+            "clueBoxes": [
+                {"first": first, "second": second, "third": ""}
+                for first, second in boxes
+            ],
+            "clueName": "1a",
+        }
+    }
+    return {"gridSize": grid_size, "clues": clues, "_clues": clues}
+
+
+def test_grid_squares():
+    assert grid_squares(puzzle(3, [(0, 0), (1, 0), (2, 0), (1, 2)])) == [
+        bytearray(b"\x01\x01\x01"),
+        bytearray(b"\x00\x00\x00"),
+        bytearray(b"\x00\x01\x00"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "test_input",
+    [
+        puzzle(0, []),
+        puzzle(max_grid_size + 1, []),
+        puzzle("3", []),
+        puzzle(3, [(3, 0)]),
+        puzzle(3, [(0, -1)]),
+        puzzle(3, [(0, True)]),
+    ],
+)
+def test_grid_squares_invalid(test_input):
+    with pytest.raises(ValueError):
+        grid_squares(test_input)
+
+
+def test_render_grid_preview(test_data_dir):
+    data = render_grid_preview(
+        json.loads(test_data_dir.joinpath("test.json").read_bytes())
+    )
+    # 15 squares of 17 pixels, and the line along the far edges
+    assert png_dimensions(data) == (256, 256)
+
+
+def test_render_grid_preview_pixels():
+    data = render_grid_preview(puzzle(2, [(1, 0)]))
+    size, _ = png_dimensions(data)
+    cell = (size - 1) // 2
+    idat = data.index(b"IDAT")
+    length = int.from_bytes(data[idat - 4 : idat], "big")
+    rows = zlib.decompress(data[idat + 4 : idat + 4 + length])
+    # each scanline is its filter type and then a byte per pixel
+    row = rows[(size + 1) : (size + 1) * 2]
+    assert row[0] == 0
+    pixels = row[1:]
+    assert pixels[1] == 0  # the left square is black
+    assert pixels[cell + 1] == 255  # the right square is white
+    assert pixels[0] == pixels[cell] == pixels[-1] != 0
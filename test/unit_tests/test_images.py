@@ -0,0 +1,94 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from flaskr import images
+from flaskr.images import IconProcessor, ResizeFailed, check_icon, png_dimensions
+
+
+def test_png_dimensions(test_data_dir, make_png):
+    assert png_dimensions(test_data_dir.joinpath("test.png").read_bytes()) == (
+        500,
+        500,
+    )
+    assert png_dimensions(make_png(30, 20)) == (30, 20)
+
+
+@pytest.mark.parametrize(
+    "test_input",
+    [b"", b"GIF89a", b"\x89PNG\r\n\x1a\n", b"\x89PNG\r\n\x1a\n" + b"\0" * 16],
+)
+def test_png_dimensions_invalid(test_input):
+    with pytest.raises(ValueError):
+        png_dimensions(test_input)
+
+
+def test_check_icon_dimensions(make_png):
+    check_icon(make_png(16, 16), 16)
+    with pytest.raises(ValueError):
+        check_icon(make_png(17, 16), 16)
+
+
+def test_normalize_small_icon(test_data_dir):
+    data = test_data_dir.joinpath("test.png").read_bytes()
+    assert IconProcessor(20000).normalize(data) is data
+
+
+def test_normalize_without_pillow(make_png, monkeypatch):
+    monkeypatch.setattr(images, "Image", None)
+    with pytest.raises(ValueError) as excinfo:
+        IconProcessor(20000).normalize(make_png(100, 100))
+    assert "exceeds maximum upload size (20000)" in str(excinfo.value)
+
+
+def test_normalize_large_icon(make_png):
+    pytest.importorskip("PIL")
+    data = make_png(200, 200)
+    assert len(data) > 20000
+    resized = IconProcessor(20000).normalize(data)
+    assert len(resized) <= 20000
+    width, height = png_dimensions(resized)
+    assert width == height
+
+
+def test_fit_png_too_small_to_fit(make_png):
+    pytest.importorskip("PIL")
+    with pytest.raises(ValueError):
+        images.fit_png(make_png(64, 64), 10)
+
+
+@pytest.mark.parametrize("image_format", ["png", "webp"])
+def test_resize_icon(make_png, image_format):
+    Image = pytest.importorskip("PIL.Image")
+    data = images.resize_icon(make_png(200, 100), 64, image_format)
+    with Image.open(BytesIO(data)) as image:
+        assert image.format == image_format.upper()
+        assert image.size == (64, 32)
+
+
+def test_resize_icon_does_not_enlarge(make_png):
+    pytest.importorskip("PIL")
+    assert png_dimensions(images.resize_icon(make_png(30, 20), 64, "png")) == (30, 20)
+
+
+def test_no_icon_formats_without_pillow(make_png, monkeypatch):
+    monkeypatch.setattr(images, "Image", None)
+    assert images.icon_formats() == ()
+    with pytest.raises(ValueError):
+        IconProcessor(20000).render_variant(make_png(30, 20), 64, "png")
+
+
+def test_broken_pool_is_replaced(make_png):
+    pytest.importorskip("PIL")
+    processor = IconProcessor(20000)
+    with pytest.raises(ResizeFailed):
+        processor._run(os._exit, 1)
+    resized = processor.normalize(make_png(200, 200))
+    assert len(resized) <= 20000
+
+
+def test_render_variant_checks_dimensions(make_png):
+    processor = IconProcessor(20000)
+    with pytest.raises(ValueError):
+        processor.render_variant(make_png(processor.max_dimension + 1, 1), 64, "png")
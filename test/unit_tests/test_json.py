@@ -2,7 +2,12 @@ import json
 
 import pytest
 
-from flaskr.file_validation import check_puzzle_json
+from flaskr.file_validation import (
+    PuzzleJsonError,
+    check_puzzle_json,
+    find_puzzle_json_violations,
+    load_puzzle_json,
+)
 
 
 @pytest.mark.parametrize("test_input", ["test.json", "valid.json"])
@@ -27,3 +32,87 @@ def test_invalid_json(test_data_dir, test_input):
         json_input = json.load(local_file)
     with pytest.raises(KeyError):
         check_puzzle_json(json_input)
+
+
+def test_all_violations_are_reported():
+    puzzle = {
+        "clues": {
+            "1a": {"clue": "", "clueName": "1a"},
+            "2a": {
+                "clue": "",
+                "clueName": "2a",
+                "clueBoxes": [{"first": 0, "second": 0}, {"first": 0}],
+            },
+        }
+    }
+    with pytest.raises(PuzzleJsonError) as excinfo:
+        check_puzzle_json(puzzle)
+    assert excinfo.value.violations == [
+        "gridSize not in json",
+        "clues.1a: Invalid clue structure",
+        "clues.2a.clueBoxes[0]: Invalid clue box structure",
+        "clues.2a.clueBoxes[1]: Invalid clue box structure",
+        "_clues not in json",
+    ]
+
+
+@pytest.mark.parametrize(
+    "test_input",
+    [
+        [],
+        {"gridSize": 1, "clues": [], "_clues": {}},
+        {"gridSize": 1, "clues": {"1a": []}, "_clues": {}},
+        {
+            "gridSize": 1,
+            "clues": {"1a": {"clue": "", "clueName": "1a", "clueBoxes": {}}},
+            "_clues": {},
+        },
+    ],
+)
+def test_invalid_types(test_input):
+    with pytest.raises(KeyError):
+        check_puzzle_json(test_input)
+
+
+def test_violations_are_limited():
+    clue_boxes = [{}] * 10
+    puzzle = {
+        "gridSize": 1,
+        "clues": {"1a": {"clue": "", "clueName": "1a", "clueBoxes": clue_boxes}},
+        "_clues": {},
+    }
+    assert len(find_puzzle_json_violations(puzzle, max_violations=3)) == 3
+
+
+@pytest.mark.parametrize("reject_early", [False, True])
+@pytest.mark.parametrize("test_input", ["test.json", "valid.json"])
+def test_load_valid_json(test_data_dir, test_input, reject_early):
+    data = test_data_dir.joinpath(test_input).read_bytes()
+    assert load_puzzle_json(data, reject_early=reject_early) == json.loads(data)
+
+
+@pytest.mark.parametrize("reject_early", [False, True])
+@pytest.mark.parametrize(
+    "test_input",
+    [
+        "invalid_clue_boxes.json",
+        "invalid_clue_data.json",
+        "missing_clues_1.json",
+        "missing_clues_2.json",
+        "missing_grid_size.json",
+    ],
+)
+def test_load_invalid_json(test_data_dir, test_input, reject_early):
+    data = test_data_dir.joinpath(test_input).read_bytes()
+    with pytest.raises(PuzzleJsonError):
+        load_puzzle_json(data, reject_early=reject_early)
+
+
+def test_reject_early_stops_parsing():
+    # the file is cut off after the bad clue box, so only rejecting it during
+    # the parse gives a PuzzleJsonError rather than a decoding error
+    data = b'{"clues": {"1a": {"clueBoxes": [{"first": 0}], "truncated'
+    with pytest.raises(ValueError):
+        load_puzzle_json(data)
+    with pytest.raises(PuzzleJsonError):
+        load_puzzle_json(data, reject_early=True)
@@ -1,7 +1,8 @@
 import pytest
 from moto.dynamodb.models import DynamoDBBackend
 
-from flaskr import PuzzleDatabase
+from flaskr import CachedPuzzleDatabase, PuzzleDatabase
+from flaskr.cloud.database import DatabaseBusy
 
 
 class TestPuzzleDatabase:
@@ -153,3 +154,150 @@ class TestPuzzleDatabase:
                 puzzle_image_fname="file.png",
             )
         assert excinfo.type == TypeError
+
+    def test_get_metadata_batch(
+        self, fake_crossword_db: PuzzleDatabase, db_backend, puzzle_test_data
+    ):
+        db_backend.put_item("crosswords", puzzle_test_data)
+        data = fake_crossword_db.get_puzzle_meta_data_batch(["test", "missing"])
+        assert list(data) == ["test"]
+        assert data["test"]["puzzle"] == "file.json"
+
+    def test_get_metadata_batch_over_key_limit(
+        self, fake_crossword_db: PuzzleDatabase, db_backend, puzzle_test_data
+    ):
+        fake_crossword_db.max_batch_get_keys = 2
+        for puzzle_id in ["a", "b", "c"]:
+            db_backend.put_item(
+                "crosswords", {**puzzle_test_data, "id": {"S": puzzle_id}}
+            )
+        data = fake_crossword_db.get_puzzle_meta_data_batch(["a", "b", "c", "a"])
+        assert sorted(data) == ["a", "b", "c"]
+
+    def test_get_metadata_batch_unprocessed_keys(
+        self,
+        fake_crossword_db: PuzzleDatabase,
+        db_backend,
+        puzzle_test_data,
+        monkeypatch,
+    ):
+        for puzzle_id in ["a", "b"]:
+            db_backend.put_item(
+                "crosswords", {**puzzle_test_data, "id": {"S": puzzle_id}}
+            )
+        batch_get_item = fake_crossword_db.dynamodb.batch_get_item
+        calls = []
+
+        def throttled_batch_get_item(RequestItems):
+            # only process the first key of each request
+            calls.append(RequestItems)
+            keys = RequestItems["crosswords"]["Keys"]
+            response = batch_get_item(RequestItems={"crosswords": {"Keys": keys[:1]}})
+            if len(keys) > 1:
+                response["UnprocessedKeys"] = {"crosswords": {"Keys": keys[1:]}}
+            return response
+
+        monkeypatch.setattr(
+            fake_crossword_db.dynamodb, "batch_get_item", throttled_batch_get_item
+        )
+        data = fake_crossword_db.get_puzzle_meta_data_batch(["a", "b"])
+        assert sorted(data) == ["a", "b"]
+        assert len(calls) == 2
+
+    def test_get_metadata_batch_still_throttled(
+        self, fake_crossword_db: PuzzleDatabase, monkeypatch
+    ):
+        def throttled_batch_get_item(RequestItems):
+            return {"Responses": {}, "UnprocessedKeys": RequestItems}
+
+        monkeypatch.setattr(
+            fake_crossword_db.dynamodb, "batch_get_item", throttled_batch_get_item
+        )
+        monkeypatch.setattr(fake_crossword_db, "max_batch_get_retries", 1)
+        with pytest.raises(DatabaseBusy):
+            fake_crossword_db.get_puzzle_meta_data_batch(["a"])
+
+    def test_get_metadata_batch_bad_id(self, fake_crossword_db):
+        with pytest.raises(TypeError):
+            fake_crossword_db.get_puzzle_meta_data_batch(["test", 1])
+
+    def test_upload_meta_data_batch(self, fake_crossword_db):
+        items = [
+            {
+                "id": str(i),
+                "puzzle": "a.json",
+                "icon": "a.png",
+                "timeCreated": "1/1/2023 1:1:1",
+                "lastModified": "1/1/2023 1:1:1",
+            }
+            for i in range(30)
+        ]
+        fake_crossword_db.upload_puzzle_meta_data_batch(items)
+        found = fake_crossword_db.get_puzzle_meta_data_batch(
+            [str(i) for i in range(30)]
+        )
+        assert len(found) == 30
+
+
+class TestCachedPuzzleDatabase:
+    def test_get_metadata_is_cached(
+        self, fake_crossword_db, db_backend: DynamoDBBackend, puzzle_test_data
+    ):
+        cached_db = CachedPuzzleDatabase(fake_crossword_db, 8, 60)
+        db_backend.put_item("crosswords", puzzle_test_data)
+        cached_db.get_puzzle_meta_data("test")
+        db_backend.delete_item("crosswords", {"id": {"S": "test"}})
+        assert cached_db.get_puzzle_meta_data("test")["id"] == "test"
+        assert cached_db.cache.hits == 1
+
+    def test_missing_metadata_is_not_cached(self, fake_crossword_db):
+        cached_db = CachedPuzzleDatabase(fake_crossword_db, 8, 60)
+        with pytest.raises(KeyError):
+            cached_db.get_puzzle_meta_data("test")
+        assert len(cached_db.cache) == 0
+
+    def test_upload_invalidates_cache(self, fake_crossword_db):
+        cached_db = CachedPuzzleDatabase(fake_crossword_db, 8, 60)
+        for last_modified in ["1/1/1 1:11 UTC+1", "2/2/2 2:22 UTC+2"]:
+            cached_db.upload_puzzle_meta_data(
+                puzzle_id="test",
+                puzzle_json_fname="file.json",
+                time_created="1/1/1 1:11 UTC+1",
+                last_modified=last_modified,
+                puzzle_image_fname="file.png",
+            )
+            data = cached_db.get_puzzle_meta_data("test")
+            assert data["lastModified"] == last_modified
+
+    def test_get_metadata_batch_uses_cache(
+        self, fake_crossword_db, db_backend: DynamoDBBackend, puzzle_test_data
+    ):
+        cached_db = CachedPuzzleDatabase(fake_crossword_db, 8, 60)
+        db_backend.put_item("crosswords", puzzle_test_data)
+        db_backend.put_item("crosswords", {**puzzle_test_data, "id": {"S": "b"}})
+        cached_db.get_puzzle_meta_data("test")
+        db_backend.delete_item("crosswords", {"id": {"S": "test"}})
+        data = cached_db.get_puzzle_meta_data_batch(["test", "b", "missing"])
+        assert sorted(data) == ["b", "test"]
+        assert cached_db.get_puzzle_meta_data("b")["id"] == "b"
+
+    def test_other_attributes_are_passed_through(self, fake_crossword_db):
+        cached_db = CachedPuzzleDatabase(fake_crossword_db, 8, 60)
+        assert cached_db.table is fake_crossword_db.table
+
+    def test_upload_batch_invalidates_cache(self, fake_crossword_db):
+        cached_db = CachedPuzzleDatabase(fake_crossword_db, 8, 60)
+        for last_modified in ["1/1/1 1:11 UTC+1", "2/2/2 2:22 UTC+2"]:
+            cached_db.upload_puzzle_meta_data_batch(
+                [
+                    {
+                        "id": "test",
+                        "puzzle": "file.json",
+                        "icon": "file.png",
+                        "timeCreated": "1/1/1 1:11 UTC+1",
+                        "lastModified": last_modified,
+                    }
+                ]
+            )
+            data = cached_db.get_puzzle_meta_data("test")
+            assert data["lastModified"] == last_modified
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+from flaskr.passwords import HasherBusy, PasswordHasher, full_hash_method
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(max_workers=1)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_in_pool(hasher):
+    password_hash = hasher.hash("pword")
+    assert check_password_hash(password_hash, "pword")
+    assert hasher.check(password_hash, "pword")
+    assert not hasher.check(password_hash, "other")
+
+
+def test_hash_on_calling_thread():
+    hasher = PasswordHasher(max_workers=0)
+    assert hasher.check(hasher.hash("pword"), "pword")
+    assert hasher._executor is None
+
+
+def test_broken_pool_is_replaced(hasher):
+    with pytest.raises(HasherBusy):
+        # the worker process exits without answering
+        hasher._run(os._exit, 1)
+    assert hasher.check(hasher.hash("pword"), "pword")
+
+
+def test_hash_inline_without_pool(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise OSError(38, "Function not implemented")
+
+    monkeypatch.setattr("flaskr.passwords.ProcessPoolExecutor", no_pool)
+    hasher = PasswordHasher(max_workers=2)
+    assert hasher.check(hasher.hash("pword"), "pword")
+    assert hasher.max_workers == 0
+
+
+def test_stats(hasher):
+    hasher.hash("pword")
+    stats = hasher.stats()
+    assert stats["calls"] == 1
+    assert stats["rejected"] == 0
+    assert 0 <= stats["meanQueueTime"] <= stats["maxQueueTime"]
+
+
+def test_saturated_hasher_is_busy():
+    hasher = PasswordHasher(max_workers=0, max_pending=0)
+    with pytest.raises(HasherBusy):
+        hasher.hash("pword")
+    assert hasher.stats()["rejected"] == 1
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ("pbkdf2", f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"),
+        ("pbkdf2:sha512", f"pbkdf2:sha512:{DEFAULT_PBKDF2_ITERATIONS}"),
+        ("pbkdf2:sha256:1000", "pbkdf2:sha256:1000"),
+        ("scrypt", "scrypt:32768:8:1"),
+        ("scrypt:16384:8:1", "scrypt:16384:8:1"),
+    ],
+)
+def test_full_hash_method(test_input, expected):
+    assert full_hash_method(test_input) == expected
+
+
+@pytest.mark.parametrize(
+    "test_input", ["md5", "pbkdf2:sha256:1000:1", "scrypt:16384", "scrypt:1:2:3:4"]
+)
+def test_full_hash_method_invalid(test_input):
+    with pytest.raises(ValueError):
+        full_hash_method(test_input)
+
+
+def test_needs_rehash():
+    hasher = PasswordHasher(max_workers=0, method="pbkdf2:sha256:1000")
+    password_hash = hasher.hash("pword")
+    assert password_hash.startswith("pbkdf2:sha256:1000$")
+    assert not hasher.needs_rehash(password_hash)
+    assert hasher.needs_rehash(generate_password_hash("pword", "pbkdf2:sha256:2000"))
+    assert PasswordHasher(max_workers=0).needs_rehash(password_hash)
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from flaskr.puzzle_format import decode_puzzle, encode_puzzle
+
+
+@pytest.fixture
+def puzzle(test_data_dir):
+    return json.loads(test_data_dir.joinpath("test.json").read_bytes())
+
+
+@pytest.mark.parametrize("test_input", ["test.json", "valid.json"])
+def test_round_trip(test_data_dir, test_input):
+    puzzle = json.loads(test_data_dir.joinpath(test_input).read_bytes())
+    decoded = decode_puzzle(encode_puzzle(puzzle))
+    assert decoded == puzzle
+    assert list(decoded["clues"]) == list(puzzle["clues"])
+
+
+def test_encode_reordered_keys(puzzle):
+    clue = puzzle["clues"]["1a"]
+    puzzle["clues"]["1a"] = dict(reversed(clue.items()))
+    clue_box = clue["clueBoxes"][0]
+    clue["clueBoxes"][0] = dict(reversed(clue_box.items()))
+    assert decode_puzzle(encode_puzzle(puzzle)) == puzzle
+
+
+def test_encoding_is_compact(test_data_dir, puzzle):
+    encoded = encode_puzzle(puzzle)
+    assert len(encoded) * 4 < len(test_data_dir.joinpath("test.json").read_bytes())
+
+
+def test_round_trip_different_private_clues(puzzle):
+    puzzle["_clues"] = dict(list(puzzle["_clues"].items())[:3])
+    puzzle["_clues"]["1a"] = {**puzzle["_clues"]["1a"], "clue": "Ünïcode ✓"}
+    assert decode_puzzle(encode_puzzle(puzzle)) == puzzle
+
+
+def test_round_trip_empty():
+    puzzle = {"_clues": {}, "clues": {}, "gridSize": 0}
+    assert decode_puzzle(encode_puzzle(puzzle)) == puzzle
+
+
+def test_shared_clues_are_decoded_separately(puzzle):
+    decoded = decode_puzzle(encode_puzzle(puzzle))
+    assert decoded["clues"]["1a"] is not decoded["_clues"]["1a"]
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda puzzle: puzzle.update(extra=1),
+        lambda puzzle: puzzle.update(gridSize="15"),
+        lambda puzzle: puzzle.update(gridSize=2**31),
+        lambda puzzle: puzzle["clues"]["1a"].update(extra=1),
+        lambda puzzle: puzzle["clues"]["1a"].update(clue=None),
+        lambda puzzle: puzzle["clues"]["1a"]["clueBoxes"][0].update(first=True),
+        lambda puzzle: puzzle["clues"]["1a"]["clueBoxes"][0].update(second=1.5),
+        lambda puzzle: puzzle["clues"]["1a"]["clueBoxes"][0].update(third=0),
+    ],
+)
+def test_encode_unsupported_puzzle(puzzle, change):
+    change(puzzle)
+    with pytest.raises(ValueError):
+        encode_puzzle(puzzle)
+
+
+def test_decode_invalid_data(puzzle):
+    encoded = encode_puzzle(puzzle)
+    for data in (b"", b"PZB1", b"XXXX" + encoded[4:], encoded[:-1], encoded + b"\0"):
+        with pytest.raises(ValueError):
+            decode_puzzle(data)
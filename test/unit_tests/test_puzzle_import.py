@@ -0,0 +1,119 @@
+import zipfile
+from io import BytesIO
+
+import pytest
+from botocore.exceptions import ClientError
+
+from flaskr.cloud.storage import UploadedFile
+from flaskr.puzzle_import import PuzzleImporter, read_archive, validate_puzzle
+
+
+@pytest.fixture
+def importer(fake_storage, fake_crossword_db):
+    return PuzzleImporter(fake_storage, fake_crossword_db)
+
+
+def test_read_archive(make_archive):
+    puzzles = read_archive(make_archive(["1", "2"]), 1024 * 1024)
+    assert set(puzzles) == {"1", "2"}
+    assert set(puzzles["1"]) == {"icon", "puzzle", "metaData"}
+
+
+def test_read_archive_skips_large_files(make_archive):
+    puzzles = read_archive(make_archive(["1"]), 100)
+    assert puzzles["1"]["icon"] is None
+
+
+@pytest.mark.parametrize("max_total_size,max_puzzles", [(1024 * 1024, 2), (1000, None)])
+def test_read_archive_limits(make_archive, max_total_size, max_puzzles):
+    with pytest.raises(ValueError):
+        read_archive(
+            make_archive(["1", "2", "3"]), 1024 * 1024, max_total_size, max_puzzles
+        )
+
+
+def test_validate_puzzle(make_archive):
+    files = read_archive(make_archive(["1"]), 1024 * 1024)["1"]
+    times, icon, error = validate_puzzle("1", files, 20000)
+    assert error is None
+    assert icon is None
+    assert times == {
+        "timeCreated": "28/5/2023 12:35:36",
+        "lastModified": "28/5/2023 13:35:36",
+    }
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        {"1.png": None},
+        {"1.png": b"not a png"},
+        {"1.json": b"{}"},
+        {"1.json": b"not json"},
+        {"meta_data.json": b'{"timeCreated": "28/5/2023 12:35:36"}'},
+        {"meta_data.json": b'{"timeCreated": 1, "lastModified": 2}'},
+    ],
+)
+def test_validate_invalid_puzzle(overrides, make_archive):
+    archive = make_archive(["1"], **{"1": overrides})
+    files = read_archive(archive, 1024 * 1024)["1"]
+    times, icon, error = validate_puzzle("1", files, 20000)
+    assert times is None
+    assert error
+
+
+def test_import_archive(
+    importer, fake_crossword_db, s3_backend, test_data_dir, make_archive
+):
+    report = importer.import_archive(make_archive(["1", "2", "3"]))
+    assert report["imported"] == 3
+    assert report["failed"] == []
+    # every puzzle has the same icon and JSON, so they are stored once
+    assert report["objectsUploaded"] == 2
+    assert len(s3_backend.get_bucket("jhb-crossword").keys) == 2
+    puzzle = fake_crossword_db.get_puzzle_meta_data("2")
+    image = UploadedFile("2.png", test_data_dir.joinpath("test.png").read_bytes())
+    assert puzzle["icon"] == image.key
+    assert puzzle["lastModified"] == "28/5/2023 13:35:36"
+
+
+def test_import_archive_reports_failures(importer, fake_crossword_db, make_archive):
+    archive = make_archive(["1", "2"], **{"2": {"2.json": b"{}"}})
+    report = importer.import_archive(archive)
+    assert report["imported"] == 1
+    assert [failure["id"] for failure in report["failed"]] == ["2"]
+    with pytest.raises(KeyError):
+        fake_crossword_db.get_puzzle_meta_data("2")
+
+
+def test_import_archive_failed_upload(
+    importer, fake_storage, monkeypatch, make_archive
+):
+    def upload_file(upload):
+        raise ClientError({"Error": {"Code": "500", "Message": "Error"}}, "PutObject")
+
+    monkeypatch.setattr(fake_storage, "upload_file", upload_file)
+    report = importer.import_archive(make_archive(["1"]))
+    assert report["imported"] == 0
+    assert report["failed"] == [{"id": "1", "error": "could not store its files"}]
+
+
+def test_import_skips_stored_files(importer, make_archive):
+    importer.import_archive(make_archive(["1"]))
+    report = importer.import_archive(make_archive(["2"]))
+    assert report["objectsUploaded"] == 0
+    assert report["objectsSkipped"] == 2
+
+
+def test_import_bad_archive(importer):
+    with pytest.raises(zipfile.BadZipFile):
+        importer.import_archive(BytesIO(b"not a zip"))
+
+
+def test_validate_puzzle_shrinks_icon(make_archive, make_png):
+    pytest.importorskip("PIL")
+    archive = make_archive(["1"], **{"1": {"1.png": make_png(200, 200)}})
+    files = read_archive(archive, 1024 * 1024)["1"]
+    times, icon, error = validate_puzzle("1", files, 20000)
+    assert error is None
+    assert len(icon) <= 20000
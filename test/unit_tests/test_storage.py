@@ -1,3 +1,5 @@
+import hashlib
+from io import BytesIO
 from typing import List, Tuple
 
 import pytest
@@ -6,6 +8,12 @@ from botocore.exceptions import ClientError
 from moto.s3.models import FakeKey, FakeBucket
 from werkzeug.datastructures import FileStorage
 
+from flaskr import images
+from flaskr.bundle import bundle_key
+from flaskr.cloud.storage import CloudStorage, FileDownloadError, UploadedFile
+from flaskr.file_validation import PuzzleJsonError
+from flaskr.images import png_dimensions
+
 
 def _pop_latest_item(fb: FakeBucket) -> Tuple[str, List[FakeKey]]:
     item: Tuple[str, List[FakeKey]] = fb.keys.popitem()
@@ -126,7 +134,7 @@ def test_invalid_json_keys_upload(fake_storage, test_data_dir, test_input):
     file = FileStorage(open(test_data_dir.joinpath(test_input), "rb"), name=test_input)
     with pytest.raises(KeyError) as excinfo:
         fake_storage.upload_puzzle_json(file)
-    assert excinfo.type == KeyError
+    assert excinfo.type == PuzzleJsonError
 
 
 @pytest.mark.parametrize("test_input", ["test.png"])
@@ -168,3 +176,318 @@ def test_download_json(fake_storage, s3_backend, test_data_dir):
 #       )
 #     with pytest.raises(ValueError):
 #         fake_storage.upload_image(file)
+
+
+bundle_meta_data = {
+    "id": "123",
+    "lastModified": "28/5/2023 13:35:36",
+    "icon": "a.png",
+    "puzzle": "a.json",
+}
+
+
+def test_upload_bundle(fake_storage, s3_backend):
+    fake_storage.upload_bundle(bundle_meta_data, b"bundle")
+    fb: FakeBucket = s3_backend.get_bucket("jhb-crossword")
+    assert pop_latest_item_content(fb) == b"bundle"
+
+
+def test_download_bundle(fake_storage):
+    fake_storage.upload_bundle(bundle_meta_data, b"bundle")
+    assert fake_storage.download_bundle(bundle_meta_data).read() == b"bundle"
+
+
+def test_download_missing_bundle(fake_storage):
+    with pytest.raises(ClientError):
+        fake_storage.download_bundle(bundle_meta_data)
+
+
+def test_download_files(fake_storage, s3_backend):
+    s3_backend.put_object("jhb-crossword", key_name="a.png", value=b"a")
+    s3_backend.put_object("jhb-crossword", key_name="b.json", value=b"b")
+    files = fake_storage.download_files(["a.png", "b.json"])
+    assert [f.read() for f in files] == [b"a", b"b"]
+
+
+@pytest.mark.parametrize("missing", ["a.png", "b.json"])
+def test_download_files_missing_file(fake_storage, s3_backend, missing):
+    for fname in {"a.png", "b.json"} - {missing}:
+        s3_backend.put_object("jhb-crossword", key_name=fname, value=b"a")
+    with pytest.raises(FileDownloadError) as excinfo:
+        fake_storage.download_files(["a.png", "b.json"])
+    assert excinfo.value.file_name == missing
+    assert isinstance(excinfo.value, ClientError)
+
+
+@pytest.mark.parametrize(
+    "image_name, json_name", [("a.json", "b.json"), ("a.png", "b.png")]
+)
+def test_download_puzzle_files_wrong_ext(fake_storage, image_name, json_name):
+    with pytest.raises(ValueError):
+        fake_storage.download_puzzle_files(image_name, json_name)
+
+
+def test_open_files(fake_storage, s3_backend):
+    s3_backend.put_object("jhb-crossword", key_name="a.png", value=b"a" * 100)
+    s3_backend.put_object("jhb-crossword", key_name="b.json", value=b"b")
+    fake_storage.stream_chunk_size = 30
+    image_chunks, json_chunks = fake_storage.open_puzzle_files("a.png", "b.json")
+    assert [len(chunk) for chunk in image_chunks] == [30, 30, 30, 10]
+    assert b"".join(json_chunks) == b"b"
+
+
+def test_open_files_missing_file(fake_storage):
+    with pytest.raises(FileDownloadError) as excinfo:
+        fake_storage.open_files(["a.png"])
+    assert excinfo.value.file_name == "a.png"
+
+
+def test_open_bundle(fake_storage):
+    fake_storage.upload_bundle(bundle_meta_data, b"bundle")
+    assert b"".join(fake_storage.open_bundle(bundle_meta_data)) == b"bundle"
+
+
+def test_download_file_batch(fake_storage, s3_backend):
+    s3_backend.put_object("jhb-crossword", key_name="a.png", value=b"a")
+    s3_backend.put_object("jhb-crossword", key_name="c.png", value=b"c")
+    files = list(fake_storage.download_file_batch(["a.png", "b.png", "c.png"]))
+    assert [name for name, _ in files] == ["a.png", "b.png", "c.png"]
+    assert files[0][1].read() == b"a"
+    assert files[1][1] is None
+    assert files[2][1].read() == b"c"
+
+
+def test_download_file_batch_is_windowed(fake_storage, s3_backend, monkeypatch):
+    file_names = [f"{i}.png" for i in range(5)]
+    for file_name in file_names:
+        s3_backend.put_object("jhb-crossword", key_name=file_name, value=b"x")
+    submitted = []
+    submit = fake_storage.executor.submit
+
+    def record(func, file_name):
+        submitted.append(file_name)
+        return submit(func, file_name)
+
+    monkeypatch.setattr(fake_storage, "max_batch_downloads_ahead", 2)
+    monkeypatch.setattr(fake_storage.executor, "submit", record)
+    files = fake_storage.download_file_batch(file_names)
+    assert submitted == file_names[:2]
+    assert next(files)[0] == "0.png"
+    assert submitted == file_names[:3]
+    assert [name for name, _ in files] == file_names[1:]
+    assert submitted == file_names
+
+
+def test_download_blob_is_cached(fake_storage, s3_backend):
+    s3_backend.put_object("jhb-crossword", key_name="a.png", value=b"a")
+    fake_storage.download_blob("a.png")
+    s3_backend.delete_object("jhb-crossword", "a.png")
+    blob = fake_storage.download_blob("a.png")
+    assert blob == b"a"
+    assert blob.readonly
+    assert fake_storage.blob_cache.hits == 1
+
+
+@pytest.mark.parametrize("test_input", ["test.png"])
+def test_upload_caches_blob(fake_storage, test_data_dir, s3_backend, test_input):
+    file = FileStorage(
+        open(test_data_dir.joinpath(test_input), "rb"), filename=test_input
+    )
+    upload = fake_storage.upload_image(file)
+    s3_backend.delete_object("jhb-crossword", upload.key)
+    downloaded = fake_storage.download_image(upload.key).read()
+    assert downloaded == test_data_dir.joinpath(test_input).read_bytes()
+
+
+@pytest.mark.parametrize("test_input", ["test.png", "test.json"])
+def test_upload_is_content_addressed(fake_storage, test_data_dir, test_input):
+    data = test_data_dir.joinpath(test_input).read_bytes()
+    upload = UploadedFile(test_input, data)
+    assert upload.key == hashlib.sha256(data).hexdigest() + test_input[4:]
+    assert fake_storage.upload_file(upload)
+    response = fake_storage.client.get_object(
+        Bucket=fake_storage.bucket_name, Key=upload.key
+    )
+    assert response["Body"].read() == data
+    assert response["CacheControl"] == fake_storage.immutable_cache_control
+
+
+def test_upload_skips_stored_content(fake_storage, s3_backend, monkeypatch):
+    assert fake_storage.upload_file(UploadedFile("a.png", b"a"))
+
+    def upload_fileobj(*args, **kwargs):
+        raise AssertionError("uploaded a stored file again")
+
+    monkeypatch.setattr(fake_storage.client, "upload_fileobj", upload_fileobj)
+    assert not fake_storage.upload_file(UploadedFile("b.png", b"a"))
+    assert len(s3_backend.get_bucket("jhb-crossword").keys) == 1
+
+
+def test_store_staged_file(fake_storage, s3_backend):
+    s3_backend.put_object("jhb-crossword", key_name="uploads/1/icon.png", value=b"a")
+    upload = UploadedFile("uploads/1/icon.png", b"a", staged=True)
+    assert fake_storage.store_staged_file(upload)
+    assert list(s3_backend.get_bucket("jhb-crossword").keys) == [upload.key]
+    response = fake_storage.client.get_object(
+        Bucket=fake_storage.bucket_name, Key=upload.key
+    )
+    assert response["CacheControl"] == fake_storage.immutable_cache_control
+
+
+def test_stale_download_is_not_served_after_upload(fake_storage):
+    stale_key = fake_storage._cache_key("a.png")
+    fake_storage._cache_upload("a.png", b"new")
+    # a download that started before the upload finishes after it
+    fake_storage.blob_cache.set(stale_key, b"old")
+    assert fake_storage.download_blob("a.png") == b"new"
+
+
+def test_open_file_uses_cache(fake_storage, s3_backend):
+    s3_backend.put_object("jhb-crossword", key_name="a.png", value=b"a")
+    fake_storage.download_blob("a.png")
+    s3_backend.delete_object("jhb-crossword", "a.png")
+    assert b"".join(fake_storage.open_files(["a.png"])[0]) == b"a"
+
+
+def test_download_uses_disk_cache(fake_storage, s3_backend, tmp_path):
+    s3_backend.put_object("jhb-crossword", key_name="a.png", value=b"a")
+    CloudStorage(disk_cache_dir=tmp_path).download_blob("a.png")
+    s3_backend.delete_object("jhb-crossword", "a.png")
+    # a second process on the same host
+    storage = CloudStorage(disk_cache_dir=tmp_path)
+    assert storage.download_image("a.png").read() == b"a"
+    assert b"".join(storage.open_files(["a.png"])[0]) == b"a"
+    assert storage.cached_file_path("a.png").read_bytes() == b"a"
+
+
+def test_upload_writes_disk_cache(fake_storage, tmp_path):
+    CloudStorage(disk_cache_dir=tmp_path).upload_bundle(bundle_meta_data, b"z")
+    storage = CloudStorage(disk_cache_dir=tmp_path)
+    assert storage.cached_bundle_path(bundle_meta_data).read_bytes() == b"z"
+
+
+def test_no_disk_cache(fake_storage):
+    fake_storage.upload_bundle(bundle_meta_data, b"z")
+    assert fake_storage.cached_bundle_path(bundle_meta_data) is None
+
+
+@pytest.mark.parametrize("test_input", ["test.png"])
+def test_upload_image_returns_content(fake_storage, test_data_dir, test_input):
+    local_content = test_data_dir.joinpath(test_input).read_bytes()
+    file = FileStorage(open(test_data_dir.joinpath(test_input), "rb"), name=test_input)
+    upload = fake_storage.upload_image(file)
+    assert upload.data == local_content
+    assert upload.sha256 == hashlib.sha256(local_content).hexdigest()
+
+
+@pytest.mark.parametrize("test_input", ["test.json"])
+def test_read_puzzle_json_does_not_upload(
+    fake_storage, test_data_dir, s3_backend, test_input
+):
+    file = FileStorage(open(test_data_dir.joinpath(test_input), "rb"), name=test_input)
+    upload = fake_storage.read_puzzle_json(file)
+    assert upload.data == test_data_dir.joinpath(test_input).read_bytes()
+    assert len(s3_backend.get_bucket("jhb-crossword").keys) == 0
+
+
+def test_delete_file(fake_storage, s3_backend):
+    fake_storage.upload_bundle(bundle_meta_data, b"z")
+    assert fake_storage.download_bundle(bundle_meta_data).getvalue() == b"z"
+    fake_storage.delete_file(bundle_key(bundle_meta_data))
+    assert len(s3_backend.get_bucket("jhb-crossword").keys) == 0
+    with pytest.raises(ClientError):
+        fake_storage.download_bundle(bundle_meta_data)
+
+
+def test_download_puzzle_binary_is_cached(fake_storage, test_data_dir, monkeypatch):
+    upload = UploadedFile("test.json", test_data_dir.joinpath("test.json").read_bytes())
+    fake_storage.upload_file(upload)
+    encoded = fake_storage.download_puzzle_binary(upload.key)
+    monkeypatch.setattr(fake_storage, "download_blob", None)
+    assert fake_storage.download_puzzle_binary(upload.key) == encoded
+
+
+def test_read_image_shrinks_large_icon(fake_storage, make_png):
+    pytest.importorskip("PIL")
+    data = make_png(200, 200)
+    upload = fake_storage.read_image(FileStorage(BytesIO(data), filename="a.png"))
+    assert len(upload.data) <= fake_storage.max_thumbnail_size
+    assert upload.key != UploadedFile("a.png", data).key
+
+
+def test_read_image_rejects_large_icon_without_pillow(
+    fake_storage, make_png, monkeypatch
+):
+    monkeypatch.setattr(images, "Image", None)
+    with pytest.raises(ValueError):
+        fake_storage.read_image(FileStorage(BytesIO(make_png(200, 200)), "a.png"))
+
+
+def test_read_puzzle_json_stops_at_limit(fake_storage, monkeypatch):
+    monkeypatch.setattr(fake_storage, "max_puzzle_json_size", 100)
+    stream = BytesIO(b" " * 1000)
+    with pytest.raises(ValueError):
+        fake_storage.read_puzzle_json(FileStorage(stream, "a.json"))
+    assert stream.tell() == 101
+
+
+def test_store_changed_staged_file(fake_storage, s3_backend):
+    s3_backend.put_object("jhb-crossword", key_name="uploads/1/icon.png", value=b"a")
+    upload = UploadedFile("uploads/1/icon.png", b"b")
+    assert fake_storage.store_staged_file(upload)
+    assert list(s3_backend.get_bucket("jhb-crossword").keys) == [upload.key]
+    assert fake_storage.download_blob(upload.key) == b"b"
+
+
+@pytest.mark.parametrize(
+    "test_input,expected", [(1, 64), (64, 64), (65, 128), (256, 256), (1000, 256)]
+)
+def test_icon_size_for(fake_storage, test_input, expected):
+    assert fake_storage.icon_size_for(test_input) == expected
+
+
+def test_download_icon_variant(fake_storage, s3_backend, make_png, monkeypatch):
+    pytest.importorskip("PIL")
+    upload = UploadedFile("a.png", make_png(200, 200))
+    fake_storage.upload_file(upload)
+    data = fake_storage.download_icon_variant(upload.key, 64, "png")
+    assert png_dimensions(data) == (64, 64)
+    key = fake_storage.icon_variant_key(upload.key, 64, "png")
+    assert key in s3_backend.get_bucket("jhb-crossword").keys
+    # made once, then served from storage
+    monkeypatch.setattr(fake_storage, "_store_icon_variant", None)
+    assert fake_storage.download_icon_variant(upload.key, 64, "png") == data
+
+
+@pytest.mark.parametrize("size,image_format", [(100, "png"), (64, "gif")])
+def test_download_icon_variant_unsupported(fake_storage, size, image_format):
+    with pytest.raises(ValueError):
+        fake_storage.download_icon_variant("a.png", size, image_format)
+
+
+def test_icon_variant_url_makes_variant(fake_storage, s3_backend, make_png):
+    pytest.importorskip("PIL")
+    upload = UploadedFile("a.png", make_png(200, 200))
+    fake_storage.upload_file(upload)
+    key = fake_storage.icon_variant_key(upload.key, 128, "png")
+    assert key in fake_storage.icon_variant_url(upload.key, 128, "png")
+    assert key in s3_backend.get_bucket("jhb-crossword").keys
+
+
+def test_download_grid_preview(fake_storage, s3_backend, test_data_dir, monkeypatch):
+    upload = UploadedFile("test.json", test_data_dir.joinpath("test.json").read_bytes())
+    fake_storage.upload_file(upload)
+    data = fake_storage.download_grid_preview(upload.key)
+    assert png_dimensions(data) == (256, 256)
+    key = fake_storage.grid_preview_key(upload.key)
+    assert key in s3_backend.get_bucket("jhb-crossword").keys
+    # rendered once, then served from storage
+    monkeypatch.setattr(fake_storage, "_store_derived_file", None)
+    assert fake_storage.download_grid_preview(upload.key) == data
+
+
+def test_prepare_puzzle_files_without_image(fake_storage, test_data_dir):
+    upload = UploadedFile("test.json", test_data_dir.joinpath("test.json").read_bytes())
+    image, puzzle_json = fake_storage.prepare_puzzle_files(None, upload)
+    assert puzzle_json is upload
+    assert png_dimensions(image.data) == (256, 256)
@@ -0,0 +1,132 @@
+import pytest
+from botocore.exceptions import ClientError
+from moto.s3.models import FakeBucket
+
+from flaskr.bundle import bundle_key
+from flaskr.cloud.storage import UploadedFile
+from flaskr.upload import PuzzleUploader, UploadError
+
+
+@pytest.fixture
+def uploads(test_data_dir):
+    image = UploadedFile("test.png", test_data_dir.joinpath("test.png").read_bytes())
+    puzzle_json = UploadedFile(
+        "test.json", test_data_dir.joinpath("test.json").read_bytes()
+    )
+    return image, puzzle_json
+
+
+def client_error(*args):
+    raise ClientError({"Error": {"Code": "500", "Message": "Error"}}, "PutObject")
+
+
+def test_upload(fake_storage, fake_crossword_db, s3_backend, uploads):
+    uploader = PuzzleUploader(fake_storage, fake_crossword_db)
+    puzzle = uploader.upload("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *uploads)
+    fb: FakeBucket = s3_backend.get_bucket("jhb-crossword")
+    image, puzzle_json = uploads
+    assert set(fb.keys) == {
+        image.key,
+        puzzle_json.key,
+        bundle_key(puzzle),
+    }
+    assert fake_crossword_db.get_puzzle_meta_data("123") == puzzle
+    assert puzzle["icon"] == image.key
+    assert puzzle["puzzle"] == puzzle_json.key
+
+
+def test_upload_timings(fake_storage, fake_crossword_db, uploads):
+    uploader = PuzzleUploader(fake_storage, fake_crossword_db)
+    uploader.upload("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *uploads)
+    assert set(uploader.timings) == {"image", "puzzle", "metaData", "bundle", "total"}
+    assert "image;dur=" in uploader.server_timing()
+
+
+def test_failed_object_upload_keeps_stored_objects(
+    fake_storage, fake_crossword_db, s3_backend, uploads, monkeypatch
+):
+    upload_file = fake_storage.upload_file
+
+    def fail_for_json(upload):
+        if upload.file_name == "test.json":
+            client_error()
+        return upload_file(upload)
+
+    monkeypatch.setattr(fake_storage, "upload_file", fail_for_json)
+    uploader = PuzzleUploader(fake_storage, fake_crossword_db)
+    with pytest.raises(UploadError) as excinfo:
+        uploader.upload("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *uploads)
+    assert excinfo.value.stage == "puzzle"
+    # another upload of the same icon may already refer to it
+    assert list(s3_backend.get_bucket("jhb-crossword").keys) == [uploads[0].key]
+    with pytest.raises(KeyError):
+        fake_crossword_db.get_puzzle_meta_data("123")
+
+
+def test_failed_meta_data_upload_keeps_stored_objects(
+    fake_storage, fake_crossword_db, s3_backend, uploads, monkeypatch
+):
+    monkeypatch.setattr(fake_crossword_db, "upload_puzzle_meta_data", client_error)
+    uploader = PuzzleUploader(fake_storage, fake_crossword_db)
+    with pytest.raises(UploadError) as excinfo:
+        uploader.upload("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *uploads)
+    assert excinfo.value.stage == "metaData"
+    assert set(s3_backend.get_bucket("jhb-crossword").keys) == {
+        upload.key for upload in uploads
+    }
+
+
+@pytest.mark.parametrize("test_input", [None, 1])
+def test_invalid_meta_data_uploads_nothing(
+    fake_storage, fake_crossword_db, s3_backend, uploads, test_input
+):
+    uploader = PuzzleUploader(fake_storage, fake_crossword_db)
+    with pytest.raises(TypeError):
+        uploader.upload(test_input, "1/1/2023 1:1:1", "2/1/2023 1:1:1", *uploads)
+    assert len(s3_backend.get_bucket("jhb-crossword").keys) == 0
+
+
+def test_failed_upload_keeps_stored_content(
+    fake_storage, fake_crossword_db, s3_backend, uploads, monkeypatch
+):
+    image, puzzle_json = uploads
+    fake_storage.upload_file(image)
+    monkeypatch.setattr(fake_crossword_db, "upload_puzzle_meta_data", client_error)
+    uploader = PuzzleUploader(fake_storage, fake_crossword_db)
+    with pytest.raises(UploadError):
+        uploader.upload("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *uploads)
+    assert set(s3_backend.get_bucket("jhb-crossword").keys) == {
+        image.key,
+        puzzle_json.key,
+    }
+
+
+def test_complete(fake_storage, fake_crossword_db, s3_backend, uploads):
+    staged = []
+    for file_name, upload in zip(fake_storage.staged_upload_keys("1"), uploads):
+        s3_backend.put_object("jhb-crossword", key_name=file_name, value=upload.data)
+        staged.append(UploadedFile(file_name, upload.data, staged=True))
+    uploader = PuzzleUploader(fake_storage, fake_crossword_db)
+    puzzle = uploader.complete("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *staged)
+    assert puzzle["icon"] == uploads[0].key
+    assert set(s3_backend.get_bucket("jhb-crossword").keys) == {
+        uploads[0].key,
+        uploads[1].key,
+        bundle_key(puzzle),
+    }
+
+
+def test_complete_failed_meta_data_upload_keeps_stored_objects(
+    fake_storage, fake_crossword_db, s3_backend, uploads, monkeypatch
+):
+    staged = []
+    for file_name, upload in zip(fake_storage.staged_upload_keys("1"), uploads):
+        s3_backend.put_object("jhb-crossword", key_name=file_name, value=upload.data)
+        staged.append(UploadedFile(file_name, upload.data, staged=True))
+    monkeypatch.setattr(fake_crossword_db, "upload_puzzle_meta_data", client_error)
+    uploader = PuzzleUploader(fake_storage, fake_crossword_db)
+    with pytest.raises(UploadError):
+        uploader.complete("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *staged)
+    assert set(s3_backend.get_bucket("jhb-crossword").keys) == {
+        upload.key for upload in uploads
+    }
@@ -0,0 +1,167 @@
+import fcntl
+import json
+import time
+from io import BytesIO
+
+import pytest
+from botocore.exceptions import ClientError
+from werkzeug.datastructures import FileStorage
+
+from flaskr.upload_queue import UploadQueue
+
+
+@pytest.fixture
+def upload_queue(fake_storage, fake_crossword_db, tmp_path):
+    return UploadQueue(fake_storage, fake_crossword_db, tmp_path, retry_delay=0.01)
+
+
+@pytest.fixture
+def parts(test_data_dir):
+    def parts(puzzle: bytes | None = None):
+        image = test_data_dir.joinpath("test.png").read_bytes()
+        if puzzle is None:
+            puzzle = test_data_dir.joinpath("test.json").read_bytes()
+        return (
+            FileStorage(BytesIO(image), "test.png"),
+            FileStorage(BytesIO(puzzle), "test.json"),
+        )
+
+    return parts
+
+
+def wait_for(upload_queue: UploadQueue, job_id: str) -> dict:
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        status = upload_queue.status(job_id)
+        if status["status"] in ("succeeded", "failed"):
+            return status
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def client_error(*args):
+    raise ClientError({"Error": {"Code": "500", "Message": "Error"}}, "PutItem")
+
+
+def test_enqueue(upload_queue, fake_crossword_db, parts, tmp_path):
+    job = upload_queue.enqueue("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *parts())
+    assert job["status"] == "queued"
+    status = wait_for(upload_queue, job["id"])
+    assert status["status"] == "succeeded"
+    assert status["attempts"] == 1
+    assert "metaData" in status["timings"]
+    assert fake_crossword_db.get_puzzle_meta_data("123")["id"] == "123"
+    # only the status and the lock are kept once the job is done
+    assert {path.name for path in tmp_path.joinpath(job["id"]).iterdir()} == {
+        "status.json",
+        ".lock",
+    }
+
+
+@pytest.mark.parametrize(
+    "puzzle_id,image_name",
+    [(None, "test.png"), ("123", "test.gif")],
+)
+def test_enqueue_invalid(upload_queue, parts, tmp_path, puzzle_id, image_name):
+    image, puzzle_json = parts()
+    image.filename = image_name
+    with pytest.raises((TypeError, ValueError)):
+        upload_queue.enqueue(
+            puzzle_id, "1/1/2023 1:1:1", "2/1/2023 1:1:1", image, puzzle_json
+        )
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_invalid_files_are_not_retried(upload_queue, parts):
+    job = upload_queue.enqueue("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *parts(b"{}"))
+    status = wait_for(upload_queue, job["id"])
+    assert status["status"] == "failed"
+    assert status["attempts"] == 1
+    assert status["error"].startswith("Invalid puzzle upload")
+
+
+def test_failed_upload_is_retried(upload_queue, fake_crossword_db, parts, monkeypatch):
+    upload_puzzle_meta_data = fake_crossword_db.upload_puzzle_meta_data
+    calls = []
+
+    def fail_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            client_error()
+        return upload_puzzle_meta_data(*args)
+
+    monkeypatch.setattr(fake_crossword_db, "upload_puzzle_meta_data", fail_once)
+    job = upload_queue.enqueue("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *parts())
+    status = wait_for(upload_queue, job["id"])
+    assert status["status"] == "succeeded"
+    assert status["attempts"] == 2
+
+
+def test_retries_are_limited(upload_queue, fake_crossword_db, parts, monkeypatch):
+    monkeypatch.setattr(fake_crossword_db, "upload_puzzle_meta_data", client_error)
+    job = upload_queue.enqueue("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *parts())
+    status = wait_for(upload_queue, job["id"])
+    assert status["status"] == "failed"
+    assert status["attempts"] == upload_queue.max_attempts
+
+
+@pytest.mark.parametrize("job_id", ["missing", "../status", None])
+def test_unknown_job(upload_queue, job_id):
+    with pytest.raises(KeyError):
+        upload_queue.status(job_id)
+
+
+def test_recover(fake_storage, fake_crossword_db, parts, tmp_path, monkeypatch):
+    upload_queue = UploadQueue(fake_storage, fake_crossword_db, tmp_path)
+    # the job is spooled, but its process stops before running it
+    monkeypatch.setattr(upload_queue.executor, "submit", lambda *args: None)
+    job = upload_queue.enqueue("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *parts())
+
+    upload_queue = UploadQueue(fake_storage, fake_crossword_db, tmp_path)
+    assert upload_queue.recover() == 1
+    assert wait_for(upload_queue, job["id"])["status"] == "succeeded"
+
+
+def test_recover_deletes_expired_jobs(fake_storage, fake_crossword_db, tmp_path):
+    job_dir = tmp_path.joinpath("9b2f6a1e-4f8c-4a3e-8a61-2f0c1d3b5e7a")
+    job_dir.mkdir()
+    job_dir.joinpath("status.json").write_text(
+        json.dumps({"id": job_dir.name, "status": "succeeded", "updated": 0})
+    )
+    upload_queue = UploadQueue(fake_storage, fake_crossword_db, tmp_path)
+    assert upload_queue.recover() == 0
+    assert not job_dir.exists()
+
+
+def test_enqueue_without_image(upload_queue, fake_crossword_db, parts):
+    _, puzzle_json = parts()
+    job = upload_queue.enqueue(
+        "123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", None, puzzle_json
+    )
+    assert wait_for(upload_queue, job["id"])["status"] == "succeeded"
+    assert fake_crossword_db.get_puzzle_meta_data("123")["icon"].endswith(".png")
+
+
+def test_claimed_job_is_skipped(
+    fake_storage, fake_crossword_db, parts, tmp_path, monkeypatch
+):
+    upload_queue = UploadQueue(fake_storage, fake_crossword_db, tmp_path)
+    monkeypatch.setattr(upload_queue.executor, "submit", lambda *args: None)
+    job = upload_queue.enqueue("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *parts())
+
+    # another worker is running the job
+    with open(tmp_path.joinpath(job["id"], ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        upload_queue._run(job["id"])
+        assert upload_queue.status(job["id"])["attempts"] == 0
+
+    upload_queue._run(job["id"])
+    assert upload_queue.status(job["id"])["status"] == "succeeded"
+
+
+def test_finished_job_is_not_run_again(upload_queue, parts):
+    job = upload_queue.enqueue("123", "1/1/2023 1:1:1", "2/1/2023 1:1:1", *parts())
+    wait_for(upload_queue, job["id"])
+    upload_queue._run(job["id"])
+    status = upload_queue.status(job["id"])
+    assert (status["status"], status["attempts"]) == ("succeeded", 1)
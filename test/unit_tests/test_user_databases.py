@@ -1,5 +1,8 @@
 #  TODO: are these integration tests?
 import pytest
+from botocore.exceptions import ClientError
+
+from flaskr.cloud.database import RegistrationConflict
 
 
 class TestUserDatabase:
@@ -110,16 +113,15 @@ class TestUserDatabase:
             reset_guid="123",
         )
 
-        registered_second_user = fake_crossword_user_databases.register_new_user(
-            user_id="test1",
-            username="uname",
-            password="pword",
-            email="anther_email@addr.com",
-            reset_guid="123",
-        )
-
-        # db_backend.get_item("crossword-userdata", {"id": {"S": "test1"}})
-        assert not registered_second_user
+        with pytest.raises(RegistrationConflict) as excinfo:
+            fake_crossword_user_databases.register_new_user(
+                user_id="test1",
+                username="uname",
+                password="pword",
+                email="anther_email@addr.com",
+                reset_guid="123",
+            )
+        assert excinfo.value.fields == ["username"]
 
     def test_add_duplicate_username_backend(
         self, fake_crossword_user_databases, user_db_backend
@@ -132,13 +134,14 @@ class TestUserDatabase:
             reset_guid="123",
         )
 
-        fake_crossword_user_databases.register_new_user(
-            user_id="second_user_id",
-            username="uname",
-            password="pword",
-            email="anther_email@addr.com",
-            reset_guid="123",
-        )
+        with pytest.raises(RegistrationConflict):
+            fake_crossword_user_databases.register_new_user(
+                user_id="second_user_id",
+                username="uname",
+                password="pword",
+                email="anther_email@addr.com",
+                reset_guid="123",
+            )
 
         data = user_db_backend.get_item(
             "crossword-usernames", {"username": {"S": "uname"}}
@@ -154,13 +157,15 @@ class TestUserDatabase:
             reset_guid="123",
         )
 
-        fake_crossword_user_databases.register_new_user(
-            user_id="second_user_id",
-            username="another_uname",
-            password="pword",
-            email="email@addr.com",
-            reset_guid="123",
-        )
+        with pytest.raises(RegistrationConflict) as excinfo:
+            fake_crossword_user_databases.register_new_user(
+                user_id="second_user_id",
+                username="another_uname",
+                password="pword",
+                email="email@addr.com",
+                reset_guid="123",
+            )
+        assert excinfo.value.fields == ["email"]
 
         data = user_db_backend.get_item(
             "crossword-emails", {"email": {"S": "email@addr.com"}}
@@ -207,3 +212,193 @@ class TestUserDatabase:
         fake_crossword_user_databases.update_password("test", "pword2", "456")
         data = user_db_backend.get_item("crossword-userdata", {"id": {"S": "test"}})
         assert data.attrs[key].value == val
+
+    @staticmethod
+    def _register_legacy_user(user_database, user_id, username, email):
+        # as registered before credentials were copied to the lookup tables
+        user_database.username_table.put_item(
+            Item={"username": username, "id": user_id}
+        )
+        user_database.email_table.put_item(Item={"email": email, "id": user_id})
+        user_database.user_table.put_item(
+            Item={
+                "id": user_id,
+                "username": username,
+                "password": "pword",
+                "email": email,
+                "resetGuid": "123",
+            }
+        )
+
+    def test_register_copies_credentials(self, fake_crossword_user_databases):
+        fake_crossword_user_databases.register_new_user(
+            user_id="test",
+            username="uname",
+            password="pword",
+            email="email@addr.com",
+            reset_guid="123",
+        )
+        user = fake_crossword_user_databases.get_user_data("test")["Item"]
+        assert (
+            fake_crossword_user_databases.get_id_for_username("uname")["Item"] == user
+        )
+        assert (
+            fake_crossword_user_databases.get_id_for_email("email@addr.com")["Item"]
+            == user
+        )
+
+    def test_get_credentials_in_one_request(
+        self, fake_crossword_user_databases, monkeypatch
+    ):
+        fake_crossword_user_databases.register_new_user(
+            user_id="test",
+            username="uname",
+            password="pword",
+            email="email@addr.com",
+            reset_guid="123",
+        )
+        monkeypatch.setattr(fake_crossword_user_databases, "user_table", None)
+        user = fake_crossword_user_databases.get_credentials_for_username("uname")
+        assert user["id"] == "test"
+        assert user["password"] == "pword"
+        user = fake_crossword_user_databases.get_credentials_for_email("email@addr.com")
+        assert user["resetGuid"] == "123"
+
+    def test_get_credentials_of_legacy_user(self, fake_crossword_user_databases):
+        self._register_legacy_user(
+            fake_crossword_user_databases, "test", "uname", "email@addr.com"
+        )
+        user = fake_crossword_user_databases.get_credentials_for_username("uname")
+        assert user["password"] == "pword"
+
+    def test_get_credentials_no_user(self, fake_crossword_user_databases):
+        assert fake_crossword_user_databases.get_credentials_for_username("x") is None
+        assert fake_crossword_user_databases.get_credentials_for_email("x") is None
+
+    @pytest.mark.parametrize("names", [{}, {"username": "uname", "email": "e@a.com"}])
+    def test_update_password_updates_copies(self, fake_crossword_user_databases, names):
+        fake_crossword_user_databases.register_new_user(
+            user_id="test",
+            username="uname",
+            password="pword",
+            email="e@a.com",
+            reset_guid="123",
+        )
+        fake_crossword_user_databases.update_password("test", "pword2", "456", **names)
+        for user in (
+            fake_crossword_user_databases.get_user_data("test")["Item"],
+            fake_crossword_user_databases.get_credentials_for_username("uname"),
+            fake_crossword_user_databases.get_credentials_for_email("e@a.com"),
+        ):
+            assert (user["password"], user["resetGuid"]) == ("pword2", "456")
+
+    def test_update_password_of_legacy_user(self, fake_crossword_user_databases):
+        self._register_legacy_user(
+            fake_crossword_user_databases, "test", "uname", "e@a.com"
+        )
+        # an item with only some of the credentials is not used as a copy
+        fake_crossword_user_databases.username_table.update_item(
+            Key={"username": "uname"},
+            UpdateExpression="set password = :p",
+            ExpressionAttributeValues={":p": "pword"},
+        )
+        user = fake_crossword_user_databases.get_credentials_for_username("uname")
+        assert user["email"] == "e@a.com"
+
+        fake_crossword_user_databases.update_password("test", "pword2", "456")
+        user = fake_crossword_user_databases.get_user_data("test")["Item"]
+        for key, table in (
+            ({"username": "uname"}, fake_crossword_user_databases.username_table),
+            ({"email": "e@a.com"}, fake_crossword_user_databases.email_table),
+        ):
+            assert table.get_item(Key=key)["Item"] == user
+
+    def test_update_password_is_atomic(self, fake_crossword_user_databases):
+        fake_crossword_user_databases.register_new_user(
+            user_id="test",
+            username="uname",
+            password="pword",
+            email="e@a.com",
+            reset_guid="123",
+        )
+        with pytest.raises(ClientError):
+            # the username item belongs to the user, but this email's does not
+            fake_crossword_user_databases.update_password(
+                "test", "pword2", "456", "uname", "other@a.com"
+            )
+        user = fake_crossword_user_databases.get_user_data("test")["Item"]
+        assert user["password"] == "pword"
+
+    def test_backfill_credentials(self, fake_crossword_user_databases):
+        self._register_legacy_user(fake_crossword_user_databases, "1", "a", "a@a.com")
+        self._register_legacy_user(fake_crossword_user_databases, "2", "b", "b@a.com")
+        # the email item of this user was claimed by someone else
+        fake_crossword_user_databases.email_table.put_item(
+            Item={"email": "b@a.com", "id": "3"}
+        )
+        assert fake_crossword_user_databases.backfill_credentials() == (1, 0, 1)
+        assert (
+            fake_crossword_user_databases.get_id_for_username("a")["Item"]["password"]
+            == "pword"
+        )
+        assert (
+            "password"
+            not in fake_crossword_user_databases.get_id_for_email("b@a.com")["Item"]
+        )
+
+    def test_backfill_keeps_newer_credentials(
+        self, fake_crossword_user_databases, monkeypatch
+    ):
+        self._register_legacy_user(fake_crossword_user_databases, "1", "a", "a@a.com")
+        scanned = fake_crossword_user_databases.get_user_data("1")["Item"]
+        # the password is reset after the user was scanned
+        fake_crossword_user_databases.update_password("1", "pword2", "456")
+        monkeypatch.setattr(
+            fake_crossword_user_databases.user_table,
+            "scan",
+            lambda **kwargs: {"Items": [scanned]},
+        )
+        assert fake_crossword_user_databases.backfill_credentials() == (0, 1, 0)
+        user = fake_crossword_user_databases.get_credentials_for_username("a")
+        assert (user["password"], user["resetGuid"]) == ("pword2", "456")
+
+    def test_register_is_one_request(self, fake_crossword_user_databases, monkeypatch):
+        client = fake_crossword_user_databases.dynamodb.meta.client
+        calls = []
+        monkeypatch.setattr(
+            client, "_make_api_call", lambda *args: calls.append(args[0]) or {}
+        )
+        assert fake_crossword_user_databases.register_new_user(
+            user_id="test",
+            username="uname",
+            password="pword",
+            email="email@addr.com",
+            reset_guid="123",
+        )
+        assert calls == ["TransactWriteItems"]
+
+    def test_failed_registration_writes_nothing(
+        self, fake_crossword_user_databases, user_db_backend
+    ):
+        fake_crossword_user_databases.register_new_user(
+            user_id="first",
+            username="uname",
+            password="pword",
+            email="email@addr.com",
+            reset_guid="123",
+        )
+        with pytest.raises(RegistrationConflict):
+            fake_crossword_user_databases.register_new_user(
+                user_id="second",
+                username="another_uname",
+                password="pword",
+                email="email@addr.com",
+                reset_guid="123",
+            )
+        assert (
+            fake_crossword_user_databases.get_id_for_username("another_uname").get(
+                "Item"
+            )
+            is None
+        )
+        assert "Item" not in fake_crossword_user_databases.get_user_data("second")